@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
@@ -9,9 +9,19 @@ from src.middleware.rate_limiter import RateLimitMiddleware
 from src.middleware.exception_handler import global_exception_handler
 from src.middleware.logging_middleware import logging_middleware
 from src.utils.logger import get_logger, get_correlation_id
+from src.utils.performance_monitor import RESPONSE_TIME_WINDOWS, performance_monitor
 from src.utils.background_tasks import background_task_manager
+from src.utils.cache_snapshot import cache_snapshotter
+from src.services.session_store import session_store
+from src.services.user_service import user_service
+from src.services.conversation_writer import conversation_writer
+from src.middleware.rate_limiter import rate_limiter
+from src.services.google_certs import google_certs
+from src.utils.client_registry import client_registry
 
 import time
+import asyncio
+from typing import Optional
 
 logger = get_logger(__name__)
 
@@ -24,7 +34,7 @@ app.add_middleware(GZipMiddleware, minimum_size=1000)
 app.add_middleware(RateLimitMiddleware)
 
 # CORS middleware
-app.add_middleware(CORSMiddleware,allow_origins=settings.allowed_origins,allow_credentials=True,allow_methods=["*"],allow_headers=["*"],)
+app.add_middleware(CORSMiddleware,allow_origins=settings.allowed_origins,allow_credentials=True,allow_methods=["*"],allow_headers=["*"],expose_headers=["X-Total-Count", "X-Next-Cursor", "X-Prev-Cursor", "X-TokenQuota-Limit", "X-TokenQuota-Remaining", "X-TokenQuota-Reset", "Retry-After"],)
 
 # Add logging middleware
 app.middleware("http")(logging_middleware)
@@ -52,6 +62,31 @@ async def health_check():
         "correlation_id": get_correlation_id()
     }
 
+@app.get("/metrics")
+async def metrics(history: bool = False, percentiles: Optional[str] = None, sketches: bool = False):
+    """Get performance metrics from the latest system sample.
+
+    percentiles adds comma-separated response time percentiles (e.g. 90,99.9); history adds the
+    system sample history; sketches adds the serialized response time histograms for merging
+    across workers.
+    """
+    try:
+        requested = [float(p) for p in percentiles.split(',') if p.strip()] if percentiles else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be comma-separated numbers")
+    if any(not 0 <= p <= 100 for p in requested):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+
+    stats = performance_monitor.get_summary_stats(requested)
+    if history:
+        stats["system_history"] = performance_monitor.sampler.get_history()
+    if sketches:
+        stats["response_time_sketches"] = {
+            window: performance_monitor.get_response_time_histogram(window).to_dict()
+            for window in RESPONSE_TIME_WINDOWS
+        }
+    return stats
+
 
 
 # Application lifecycle events
@@ -59,13 +94,28 @@ async def health_check():
 async def startup_event():
     """Initialize application on startup"""
     logger.info("Starting Shellkode AI Chatbot API")
+    performance_monitor.sampler.start()
     background_task_manager.start_background_tasks()
+    conversation_writer.start()
+    # Open outbound connections before serving so the first request doesn't pay for them
+    await client_registry.start()
+    # Warm caches from the last snapshot in the background so readiness isn't delayed
+    background_task_manager.tasks.append(asyncio.create_task(cache_snapshotter.restore_async()))
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on application shutdown"""
     logger.info("Shutting down Shellkode AI Chatbot API")
     background_task_manager.stop_background_tasks()
+    await cache_snapshotter.save_async()
+    # Flush queued conversation writes before closing the store
+    await conversation_writer.stop()
+    await session_store.close()
+    await user_service.close()
+    await rate_limiter.close()
+    await google_certs.close()
+    await client_registry.close()
+    performance_monitor.sampler.stop()
     
 
 
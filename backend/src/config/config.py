@@ -12,16 +12,85 @@ class Settings(BaseSettings):
     # AWS Bedrock Configuration
     aws_region: str = "us-west-2"
     bedrock_model_id: str = "anthropic.claude-3-sonnet-20240229-v1:0"
+    # Override for VPC endpoints or a local stand-in
+    bedrock_endpoint_url: Optional[str] = None
+    bedrock_connect_timeout: float = 5.0
+    bedrock_read_timeout: float = 60.0
+
+    # Shared outbound clients
+    http_client_timeout: float = 10.0
+    http_client_max_connections: int = 100
+    http_client_max_keepalive: int = 20
+    client_prewarm_connections: int = 4
+    client_prewarm_timeout: float = 10.0
     
     # Performance Configuration
     max_conversation_history: int = 15
     response_timeout: int = 30
     max_concurrent_requests: int = 100
+    max_concurrent_generations_per_user: int = 2
     cache_ttl: int = 300
+    cache_compression_threshold: int = 4096
+    cache_memory_budget_mb: int = 256
+    response_cache_max_entries: int = 10000
+    mode_detection_cache_max_entries: int = 50000
+
+    # Near-duplicate response cache (MinHash LSH over normalized queries)
+    near_duplicate_cache_enabled: bool = False
+    near_duplicate_threshold: float = 0.8
+    near_duplicate_max_history: int = 2
+    near_duplicate_min_tokens: int = 2
+
+    # Streaming cache replay
+    stream_replay_paced: bool = False
+    stream_replay_max_gap: float = 0.5
+    stream_replay_chunk_size: int = 64
+    cache_snapshot_path: str = "cache_snapshot.bin"
+    cache_snapshot_interval: int = 300
+    cache_snapshot_max_entries: int = 50000
+    cache_snapshot_load_budget_seconds: float = 10.0
+    
+    # Session storage
+    session_db_path: str = "chat_sessions.db"
+    session_db_max_batch: int = 256
+    persistence_queue_size: int = 10000
+    persistence_batch_size: int = 500
+    persistence_flush_interval: float = 0.05
+    session_memory_budget_mb: int = 64
+    session_idle_seconds: int = 900
+    session_spill_interval: int = 60
+    search_index_interval: float = 1.0
+    search_index_batch_size: int = 2000
+    search_candidate_limit: int = 1000
+    export_chunk_size: int = 500
+
+    # Content-addressed code/error context blobs
+    blob_store_memory_mb: int = 64
+    blob_max_bytes: int = 1024 * 1024
+    blob_idle_seconds: int = 3600
+    
+    # System metrics sampling (history_size samples are kept, one hour at the default interval)
+    metrics_sample_interval: float = 5.0
+    metrics_history_size: int = 720
+    # Relative error of response time percentiles
+    latency_sketch_relative_accuracy: float = 0.01
     
     # Rate Limiting
     rate_limit_requests: int = 60
     rate_limit_window: int = 60
+    rate_limit_max_clients: int = 100000
+    rate_limit_eviction_interval: int = 60
+    # "memory" keeps limits per process; "redis" shares them across workers
+    rate_limit_backend: str = "memory"
+    rate_limit_redis_url: str = "redis://localhost:6379/0"
+    rate_limit_redis_timeout: float = 0.05
+    rate_limit_lease_size: int = 8
+    rate_limit_lease_seconds: float = 1.0
+
+    # LLM token quotas per signed-in user, or per IP without a valid token
+    token_quota_user_tokens: int = 500000
+    token_quota_anonymous_tokens: int = 100000
+    token_quota_window: int = 3600
     
     # CORS Configuration
     allowed_origins: List[str] = ["http://localhost:5174", "http://localhost:3000", "*"]
@@ -34,9 +103,23 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    auth_token_cache_max_entries: int = 10000
+
+    # User accounts
+    user_db_path: str = "users.db"
+    user_cache_ttl: int = 60
+    user_cache_max_entries: int = 10000
+    user_login_flush_interval: float = 5.0
     
     # Google OAuth
     google_client_id: Optional[str] = None
+    google_certs_url: str = "https://www.googleapis.com/oauth2/v1/certs"
+    google_certs_default_max_age: int = 3600
+    google_certs_refresh_margin: int = 300
+    google_certs_unknown_kid_interval: int = 60
+    google_certs_timeout: float = 10.0
+    # Verify Google ID token signatures against the cached certs at login
+    google_verify_signature: bool = False
     google_client_secret: Optional[str] = None
     google_redirect_uri: Optional[str] = None
     
@@ -1,72 +1,327 @@
+import asyncio
+import math
 import time
-from typing import Dict, Tuple
-from fastapi import Request, HTTPException
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from src.config.config import settings
-import threading
+from src.utils.logger import get_logger
+from src.utils.performance_monitor import performance_monitor
+from src.utils.resp_client import RespClient, RespError
+
+logger = get_logger(__name__)
+
+# Clients dropped per eviction call, keeping each lock hold short
+EVICTION_BATCH_SIZE = 10000
+
+def get_client_ip(request: Request) -> str:
+    """Get the client IP, using X-Forwarded-For if behind proxy"""
+    forwarded_for = request.headers.get('X-Forwarded-For')
+    if forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
 
 class RateLimiter:
-    """Thread-safe rate limiter using sliding window"""
+    """Thread-safe GCRA rate limiter storing one theoretical arrival time per client.
+
+    Each request advances the client's theoretical arrival time (TAT) by the
+    emission interval (window / limit); a request is allowed while the TAT stays
+    within one window of now, which permits a burst of the full limit. Clients
+    are kept in last-update order: once a client has been idle for a window its
+    TAT has passed and it is evicted, since a missing entry means a full bucket.
+    """
     
-    def __init__(self, max_requests: int, window_seconds: int):
+    def __init__(self, max_requests: int, window_seconds: int, max_clients: int):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests: Dict[str, list] = {}
+        self.emission_interval = window_seconds / max_requests
+        self.max_clients = max_clients
+        self.requests: "OrderedDict[str, float]" = OrderedDict()
         self.lock = threading.RLock()
+
+        self.allowed = 0
+        self.denied = 0
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
     
     def is_allowed(self, client_id: str) -> Tuple[bool, Dict[str, int]]:
         """Check if request is allowed and return rate limit info"""
         current_time = time.time()
         
         with self.lock:
-            if client_id not in self.requests:
-                self.requests[client_id] = []
-            
-            # Remove old requests outside the window
-            self.requests[client_id] = [
-                req_time for req_time in self.requests[client_id]
-                if current_time - req_time < self.window_seconds
-            ]
+            tat = max(self.requests.get(client_id, current_time), current_time)
+            new_tat = tat + self.emission_interval
             
-            # Check if under limit
-            if len(self.requests[client_id]) < self.max_requests:
-                self.requests[client_id].append(current_time)
-                remaining = self.max_requests - len(self.requests[client_id])
-                reset_time = int(current_time + self.window_seconds)
+            if new_tat - current_time <= self.window_seconds:
+                self.requests[client_id] = new_tat
+                self.requests.move_to_end(client_id)
+                if len(self.requests) > self.max_clients:
+                    # Forgetting the least recently seen client only gives it a full bucket back
+                    self.requests.popitem(last=False)
+                    self.capacity_evictions += 1
+                self.allowed += 1
                 
+                remaining = int((self.window_seconds - (new_tat - current_time)) / self.emission_interval)
                 return True, {
                     'limit': self.max_requests,
                     'remaining': remaining,
-                    'reset': reset_time
+                    'reset': math.ceil(new_tat)
                 }
             else:
-                # Calculate when the oldest request will expire
-                oldest_request = min(self.requests[client_id])
-                reset_time = int(oldest_request + self.window_seconds)
+                # The next request fits once the TAT is back within the window
+                self.denied += 1
+                retry_after = math.ceil(new_tat - self.window_seconds - current_time)
                 
                 return False, {
                     'limit': self.max_requests,
                     'remaining': 0,
-                    'reset': reset_time
+                    'reset': int(current_time) + retry_after,
+                    'retry_after': retry_after
                 }
 
+    async def check(self, client_id: str) -> Tuple[bool, Dict[str, int]]:
+        """Async decision entry point shared with SharedRateLimiter"""
+        return self.is_allowed(client_id)
+
+    async def close(self) -> None:
+        """Nothing to release for in-process state"""
+
+    def evict_idle(self, limit: int = EVICTION_BATCH_SIZE) -> int:
+        """Drop up to limit clients whose bucket has fully refilled and return how many were removed"""
+        evicted = 0
+        with self.lock:
+            # Oldest update first; an allowed request never sets the TAT more than a
+            # window ahead, so a refilled client behind the stop point waits at most one more window
+            current_time = time.time()
+            while self.requests and evicted < limit:
+                client_id, tat = next(iter(self.requests.items()))
+                if tat > current_time:
+                    break
+                del self.requests[client_id]
+                evicted += 1
+        self.idle_evictions += evicted
+        return evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get tracked client count and decision statistics"""
+        return {
+            'tracked_clients': len(self.requests),
+            'max_clients': self.max_clients,
+            'allowed': self.allowed,
+            'denied': self.denied,
+            'idle_evictions': self.idle_evictions,
+            'capacity_evictions': self.capacity_evictions
+        }
+
+# Atomic GCRA lease: grants up to ARGV[3] requests and returns {granted, remaining, ms}, where ms is the
+# time until the bucket is full again, or until the next request fits when nothing was granted.
+# Uses the server clock so every worker agrees on now.
+GCRA_LEASE_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + tonumber(clock[2]) / 1000
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+local available = math.floor((window - (tat - now)) / interval + 1e-9)
+if available < 1 then
+  return {0, 0, tostring(tat + interval - window - now)}
+end
+local granted = math.min(want, available)
+tat = tat + granted * interval
+redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil(tat - now))
+return {granted, available - granted, tostring(tat - now)}
+"""
+
+RATE_LIMIT_KEY_PREFIX = 'ratelimit:'
+
+# How long to stay on per-process limits before trying an unavailable store again
+STORE_RETRY_SECONDS = 1.0
+
+class Lease:
+    """Requests granted to this process for one client by the shared store"""
+
+    __slots__ = ('tokens', 'size', 'used', 'remaining', 'reset', 'expires', 'denied')
+
+    def __init__(self, tokens: int, size: int, remaining: int, reset: int, expires: float):
+        self.tokens = tokens
+        self.size = size
+        self.used = 0
+        self.remaining = remaining
+        self.reset = reset
+        self.expires = expires
+        self.denied = tokens == 0
+
+class SharedRateLimiter:
+    """GCRA rate limiter whose state lives in a shared Redis-protocol store.
+
+    Decisions are made atomically by a Lua script on the server, so all workers
+    enforce one limit per client and limits survive restarts. To keep round-trips
+    off most requests, each call leases a few requests to this process for a short
+    time; the lease size follows the client's recent rate, so occasional clients
+    lease one request and busy ones up to the configured maximum. Denials are
+    cached until the retry time. If the store is unreachable, decisions fall back
+    to the per-process limiter.
+    """
+
+    def __init__(self, client: RespClient, max_requests: int, window_seconds: int,
+                 lease_size: int, lease_seconds: float, fallback: RateLimiter):
+        self.client = client
+        self.max_requests = max_requests
+        self.interval_ms = window_seconds * 1000 / max_requests
+        self.window_ms = window_seconds * 1000
+        self.lease_size = lease_size
+        self.lease_seconds = lease_seconds
+        self.fallback = fallback
+        self.leases: "OrderedDict[str, Lease]" = OrderedDict()
+        self._renewals: Dict[str, asyncio.Future] = {}
+        self.degraded = False
+        self.retry_at = 0.0
+
+        self.local_decisions = 0
+        self.remote_calls = 0
+        self.remote_errors = 0
+        self.fallback_decisions = 0
+        self.remote_latencies: Deque[float] = deque(maxlen=1000)
+
+    def _lease_size(self, previous: Optional[Lease]) -> int:
+        """Double the lease while the client uses it up, shrink it to what was used otherwise"""
+        if previous is None or previous.denied:
+            return 1
+        if previous.tokens == 0:
+            return min(self.lease_size, previous.size * 2)
+        return max(1, previous.used)
+
+    async def check(self, client_id: str) -> Tuple[bool, Dict[str, int]]:
+        """Check if request is allowed and return rate limit info"""
+        while True:
+            renewal = self._renewals.get(client_id)
+            if renewal is not None:
+                # Another request for this client is already asking the store
+                await asyncio.shield(renewal)
+                continue
+
+            now = time.monotonic()
+            lease = self.leases.get(client_id)
+            if lease is not None and lease.expires > now:
+                if lease.tokens > 0:
+                    lease.tokens -= 1
+                    lease.used += 1
+                    self.local_decisions += 1
+                    return True, {
+                        'limit': self.max_requests,
+                        'remaining': lease.remaining + lease.tokens,
+                        'reset': lease.reset
+                    }
+                if lease.denied:
+                    self.local_decisions += 1
+                    return False, {
+                        'limit': self.max_requests,
+                        'remaining': 0,
+                        'reset': lease.reset,
+                        'retry_after': max(1, math.ceil(lease.expires - now))
+                    }
+
+            decision = await self._renew(client_id, lease)
+            if decision is not None:
+                return decision
+
+    async def _renew(self, client_id: str, previous: Optional[Lease]) -> Optional[Tuple[bool, Dict[str, int]]]:
+        """Lease requests from the store; returns a fallback decision if the store is unavailable"""
+        if self.degraded and time.monotonic() < self.retry_at:
+            self.fallback_decisions += 1
+            return self.fallback.is_allowed(client_id)
+
+        size = self._lease_size(previous)
+        renewal = asyncio.get_running_loop().create_future()
+        self._renewals[client_id] = renewal
+        started = time.perf_counter()
+        try:
+            granted, remaining, wait_ms = await self.client.eval_script(
+                GCRA_LEASE_SCRIPT, [RATE_LIMIT_KEY_PREFIX + client_id],
+                [self.interval_ms, self.window_ms, size]
+            )
+        except (RespError, OSError, asyncio.TimeoutError) as e:
+            self.remote_errors += 1
+            self.fallback_decisions += 1
+            self.retry_at = time.monotonic() + STORE_RETRY_SECONDS
+            if not self.degraded:
+                self.degraded = True
+                logger.warning(f"Shared rate limit store unavailable, using per-process limits: {str(e)}")
+            return self.fallback.is_allowed(client_id)
+        finally:
+            del self._renewals[client_id]
+            renewal.set_result(None)
+
+        self.remote_calls += 1
+        self.remote_latencies.append(time.perf_counter() - started)
+        if self.degraded:
+            self.degraded = False
+            logger.info("Shared rate limit store available again")
+
+        wait = float(wait_ms) / 1000
+        self.leases[client_id] = Lease(
+            tokens=granted,
+            size=size,
+            remaining=remaining,
+            reset=math.ceil(time.time() + wait),
+            expires=time.monotonic() + (wait if granted == 0 else self.lease_seconds)
+        )
+        self.leases.move_to_end(client_id)
+        return None
+
+    async def close(self) -> None:
+        """Close the store connection"""
+        await self.client.close()
+
+    def evict_idle(self, limit: int = EVICTION_BATCH_SIZE) -> int:
+        """Drop up to limit expired leases and return how many were removed"""
+        evicted = 0
+        current_time = time.monotonic()
+        while self.leases and evicted < limit:
+            client_id, lease = next(iter(self.leases.items()))
+            if lease.expires > current_time:
+                break
+            del self.leases[client_id]
+            evicted += 1
+        return evicted + self.fallback.evict_idle(limit)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get lease, round-trip and fallback statistics"""
+        latencies = sorted(self.remote_latencies)
+        decisions = self.local_decisions + self.remote_calls
+        return {
+            'tracked_clients': len(self.leases),
+            'local_decisions': self.local_decisions,
+            'remote_calls': self.remote_calls,
+            'local_rate': round(self.local_decisions / decisions * 100, 2) if decisions else 0,
+            'remote_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3) if latencies else 0,
+            'remote_errors': self.remote_errors,
+            'fallback_decisions': self.fallback_decisions,
+            'degraded': self.degraded
+        }
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """Rate limiting middleware"""
     
     def __init__(self, app, max_requests: int = None, window_seconds: int = None):
         super().__init__(app)
-        self.rate_limiter = RateLimiter(
-            max_requests or settings.rate_limit_requests,
-            window_seconds or settings.rate_limit_window
-        )
+        if max_requests is None and window_seconds is None:
+            self.rate_limiter = rate_limiter
+        else:
+            self.rate_limiter = RateLimiter(
+                max_requests or settings.rate_limit_requests,
+                window_seconds or settings.rate_limit_window,
+                settings.rate_limit_max_clients
+            )
     
     def get_client_id(self, request: Request) -> str:
         """Get client identifier for rate limiting"""
-        # Use X-Forwarded-For if behind proxy, otherwise use client IP
-        forwarded_for = request.headers.get('X-Forwarded-For')
-        if forwarded_for:
-            return forwarded_for.split(',')[0].strip()
-        return request.client.host if request.client else 'unknown'
+        return get_client_ip(request)
     
     async def dispatch(self, request: Request, call_next):
         # Skip rate limiting for health checks
@@ -74,17 +329,18 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             return await call_next(request)
         
         client_id = self.get_client_id(request)
-        allowed, rate_info = self.rate_limiter.is_allowed(client_id)
+        allowed, rate_info = await self.rate_limiter.check(client_id)
         
         if not allowed:
-            raise HTTPException(
+            # Exceptions raised in middleware bypass the HTTP exception handlers, so respond directly
+            return JSONResponse(
                 status_code=429,
-                detail="Rate limit exceeded",
+                content={"detail": "Rate limit exceeded"},
                 headers={
                     'X-RateLimit-Limit': str(rate_info['limit']),
                     'X-RateLimit-Remaining': str(rate_info['remaining']),
                     'X-RateLimit-Reset': str(rate_info['reset']),
-                    'Retry-After': str(rate_info['reset'] - int(time.time()))
+                    'Retry-After': str(rate_info['retry_after'])
                 }
             )
         
@@ -95,4 +351,21 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         response.headers['X-RateLimit-Remaining'] = str(rate_info['remaining'])
         response.headers['X-RateLimit-Reset'] = str(rate_info['reset'])
         
-        return response
\ No newline at end of file
+        return response
+
+# Global rate limiter shared by the middleware and the eviction task
+rate_limiter = RateLimiter(
+    settings.rate_limit_requests,
+    settings.rate_limit_window,
+    settings.rate_limit_max_clients
+)
+if settings.rate_limit_backend == 'redis':
+    rate_limiter = SharedRateLimiter(
+        RespClient(settings.rate_limit_redis_url, settings.rate_limit_redis_timeout),
+        settings.rate_limit_requests,
+        settings.rate_limit_window,
+        settings.rate_limit_lease_size,
+        settings.rate_limit_lease_seconds,
+        fallback=rate_limiter
+    )
+performance_monitor.register_component('rate_limiter', rate_limiter.get_stats)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from typing import Optional
 from datetime import datetime
 
@@ -12,6 +12,9 @@ class UserCreate(BaseModel):
     google_id: str
 
 class UserResponse(BaseModel):
+    # Frozen so cached instances can be shared between requests
+    model_config = ConfigDict(frozen=True)
+
     id: str
     email: str
     name: str
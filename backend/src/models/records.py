@@ -0,0 +1,38 @@
+import time
+from typing import Dict, Optional
+from src.models.schemas import MessageType
+
+# Rough fixed cost of a record: the object with its slots plus the content str header
+RECORD_OVERHEAD_BYTES = 120
+
+class MessageRecord:
+    """Compact internal representation of one stored conversation turn.
+
+    Used for in-memory history instead of Pydantic models or dicts: the message
+    type is the shared enum member, content is held once and the timestamp is an
+    epoch int. API models are built from stored payloads only at the boundary.
+    """
+
+    __slots__ = ('type', 'content', 'created_at')
+
+    def __init__(self, type: MessageType, content: str, created_at: Optional[float] = None):
+        self.type = type
+        self.content = content
+        self.created_at = int(time.time() if created_at is None else created_at)
+
+    @classmethod
+    def from_row(cls, role: str, content: str, created_at: float) -> "MessageRecord":
+        """Build a record from a stored message row"""
+        return cls(MessageType(role), content, created_at)
+
+    @property
+    def size(self) -> int:
+        """Estimate the memory held by this record"""
+        return len(self.content) + RECORD_OVERHEAD_BYTES
+
+    def to_turn(self) -> Dict[str, str]:
+        """Get the role/content dict used for model context"""
+        return {"role": self.type.value, "content": self.content}
+
+    def __repr__(self) -> str:
+        return f"MessageRecord({self.type.value}, {len(self.content)} chars, {self.created_at})"
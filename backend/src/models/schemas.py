@@ -13,6 +13,11 @@ class MessageType(str, Enum):
     USER = "user"
     ASSISTANT = "assistant"
 
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    MARKDOWN = "markdown"
+    HTML = "html"
+
 class ChatMessageRequest(BaseModel):
     content: str
     mode: ChatMode
@@ -22,6 +27,10 @@ class ChatMessageRequest(BaseModel):
     code: Optional[str] = None
     error: Optional[str] = None
     comments: Optional[str] = None
+    
+    # Digests of previously uploaded context blobs, used instead of code/error
+    code_ref: Optional[str] = None
+    error_ref: Optional[str] = None
 
 class Source(BaseModel):
     title: str
@@ -80,4 +89,29 @@ class ChatSession(BaseModel):
     user_id: Optional[str] = None
 
 class ChatSessionResponse(BaseModel):
-    sessions: List[ChatSession]
\ No newline at end of file
+    sessions: List[ChatSession]
+
+class SessionMessageChange(BaseModel):
+    session_id: str
+    seq: int
+    message: ChatMessageResponse
+
+class ChatSessionChangesResponse(BaseModel):
+    version: int
+    sessions: List[ChatSession]
+    messages: List[SessionMessageChange]
+    deleted: List[str]
+    has_more: bool = False
+    reset: bool = False
+
+class SearchResult(BaseModel):
+    session_id: str
+    seq: int
+    type: MessageType
+    snippet: str
+    score: float
+    created_at: datetime
+
+class ChatSearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends
 from src.models.auth_schemas import GoogleTokenRequest, LoginResponse, UserResponse
 from src.services.auth_service import auth_service
+from src.services.user_repository import EmailInUseError
 from src.middleware.auth_middleware import get_current_user_required
 from src.utils.logger import get_logger, log_with_context
 
@@ -29,6 +30,12 @@ async def google_login(request: GoogleTokenRequest):
         
     except HTTPException:
         raise
+    except EmailInUseError:
+        log_with_context(logger, 'warning', 'Google login for an email linked to another Google account')
+        raise HTTPException(
+            status_code=409,
+            detail="This email is already linked to a different Google account"
+        )
     except Exception as e:
         log_with_context(logger, 'error', f'Google login error: {str(e)}')
         raise HTTPException(
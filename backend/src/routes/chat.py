@@ -1,13 +1,19 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Depends, Query, Response
 from fastapi.responses import StreamingResponse
-from typing import Dict, List
+from starlette.background import BackgroundTask
+from typing import Dict, List, Optional, Tuple
 from src.models.schemas import (
-    ChatMessageRequest, ChatMessageResponse, ChatSession, ChatSessionResponse, ChatMode
+    ChatMessageRequest, ChatMessageResponse, ChatSessionResponse, ChatSessionChangesResponse,
+    ChatSearchResponse, ChatMode, ExportFormat
 )
 from src.services.chat_service import ChatService
+from src.services.export_service import export_service
+from src.services.blob_store import blob_store
+from src.services.token_quota import TokenCharge, current_charge, estimate_tokens, token_quota
+from src.services.generation_scheduler import generation_scheduler
 from src.utils.logger import get_logger, log_with_context, get_correlation_id
 from src.config.config import settings
-from src.middleware.auth_middleware import get_current_user_optional
+from src.middleware.auth_middleware import get_current_user_optional, get_current_user_required
 from src.models.auth_schemas import UserResponse
 import uuid
 import json
@@ -21,11 +27,43 @@ logger = get_logger(__name__)
 # Track active streaming cancellation events
 active_streams: Dict[str, asyncio.Event] = {}
 
+def _quota_headers(state: Dict[str, int]) -> Dict[str, str]:
+    """Expose token quota state as response headers"""
+    headers = {
+        'X-TokenQuota-Limit': str(state['limit']),
+        'X-TokenQuota-Remaining': str(state['remaining']),
+        'X-TokenQuota-Reset': str(state['reset'])
+    }
+    if 'retry_after' in state:
+        headers['Retry-After'] = str(state['retry_after'])
+    return headers
+
+def _finish_stream(request_id: str, charge: TokenCharge) -> None:
+    """Release a stream's tracking and quota reservation, even if its body never ran; no-op once it has"""
+    active_streams.pop(request_id, None)
+    token_quota.settle(charge)
+
+async def _admit_token_quota(http_request: Request, request: ChatMessageRequest) -> Tuple[TokenCharge, Dict[str, int]]:
+    """Charge the message's estimated input tokens to the caller's quota; raises 429 when it is used up"""
+    identity = await token_quota.identify(http_request)
+    charge, state = token_quota.admit(identity, estimate_tokens(request.content, request.code, request.error))
+    if charge is None:
+        raise HTTPException(status_code=429, detail="Token quota exceeded", headers=_quota_headers(state))
+    current_charge.set(charge)
+    return charge, state
+
 @router.post("/message", response_model=ChatMessageResponse)
-async def send_message(request: ChatMessageRequest,current_user: UserResponse = Depends(get_current_user_optional)):
+async def send_message(request: ChatMessageRequest, http_request: Request, http_response: Response,
+                       current_user: UserResponse = Depends(get_current_user_optional)):
     """
     Send a message to the AI chatbot (non-streaming)
     """
+    # Resolve uploaded context first so the estimate covers its text, not its digest
+    try:
+        chat_service.resolve_context_refs(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    charge, _ = await _admit_token_quota(http_request, request)
     try:
         log_with_context(logger, 'info', 'Processing message request', mode=request.mode.value, session_id=request.session_id,message_length=len(request.content))
         
@@ -38,19 +76,33 @@ async def send_message(request: ChatMessageRequest,current_user: UserResponse =
         
     except asyncio.TimeoutError:
         log_with_context(logger, 'error', 'Request timeout', timeout=settings.response_timeout)
-        raise HTTPException(status_code=408, detail="Request timeout")
+        error = HTTPException(status_code=408, detail="Request timeout")
     except ValueError as e:
         log_with_context(logger, 'error', f'Validation error: {str(e)}')
-        raise HTTPException(status_code=400, detail=str(e))
+        error = HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         log_with_context(logger, 'error', f'Unexpected error: {str(e)}')
-        raise HTTPException(status_code=500, detail="Internal server error")
+        error = HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        # Reconcile the estimate with the usage the model reported
+        quota_headers = _quota_headers(token_quota.settle(charge))
+        http_response.headers.update(quota_headers)
+    # Error responses don't use the injected response, so they carry the headers themselves
+    error.headers = quota_headers
+    raise error
 
 @router.post("/message/stream")
-async def send_message_stream(request: ChatMessageRequest,current_user: UserResponse = Depends(get_current_user_optional)):
+async def send_message_stream(request: ChatMessageRequest, http_request: Request,
+                              current_user: UserResponse = Depends(get_current_user_optional)):
     """
     Send a message to the AI chatbot with streaming response
     """
+    try:
+        chat_service.resolve_context_refs(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    charge, quota_state = await _admit_token_quota(http_request, request)
+    
     try:
         # Generate unique request ID for tracking
         request_id = str(uuid.uuid4())
@@ -60,117 +112,123 @@ async def send_message_stream(request: ChatMessageRequest,current_user: UserResp
         active_streams[request_id] = cancel_event
         
         async def generate_stream():
-            # Get conversation history for context
-            history = chat_service.conversation_history.get(request.session_id, []) if request.session_id else []
-            
-            # Check if mode switch should be suggested
-            should_suggest, suggested_mode, suggestion_message = chat_service.mode_detector.should_suggest_mode_switch(request.content, request.mode)
-            
-            # Send mode suggestion first if applicable
-            if should_suggest and suggested_mode:
-                _, confidence, reason = chat_service.mode_detector.detect_mode(request.content, request.mode)
-                mode_suggestion = {
-                    "suggested_mode": suggested_mode.value,
-                    "confidence": confidence,
-                    "reason": reason,
-                    "message": suggestion_message
-                }
-                
-                yield f"data: {json.dumps({'type': 'mode_suggestion', 'data': mode_suggestion})}\n\n"
-            
-            # Generate message ID
-            message_id = str(uuid.uuid4())
-            
-            # Send start event with request ID
-            yield f"data: {json.dumps({'type': 'start', 'message_id': message_id, 'request_id': request_id, 'timestamp': datetime.now().isoformat()})}\n\n"
-            
-            # Stream the AI response with code block detection
+            current_charge.set(charge)
             accumulated_content = ""
-            buffer = ""
-            
             try:
-                async for chunk in chat_service.bedrock_service.generate_streaming_response(
-                    user_message=request.content,
-                    mode=request.mode,
-                    conversation_history=history,
-                    code_context=request.code,
-                    error_context=request.error,
-                    cancel_event=cancel_event
-                ):
-                    # Check for cancellation before processing each chunk
-                    if cancel_event.is_set():
-                        raise asyncio.CancelledError()
+                # Get conversation history for context
+                history = await chat_service.get_conversation_history(request.session_id)
+                
+                # Check if mode switch should be suggested
+                should_suggest, suggested_mode, suggestion_message = chat_service.mode_detector.should_suggest_mode_switch(request.content, request.mode)
+                
+                # Send mode suggestion first if applicable
+                if should_suggest and suggested_mode:
+                    _, confidence, reason = chat_service.mode_detector.detect_mode(request.content, request.mode)
+                    mode_suggestion = {
+                        "suggested_mode": suggested_mode.value,
+                        "confidence": confidence,
+                        "reason": reason,
+                        "message": suggestion_message
+                    }
+                
+                    yield f"data: {json.dumps({'type': 'mode_suggestion', 'data': mode_suggestion})}\n\n"
+                
+                # Generate message ID
+                message_id = str(uuid.uuid4())
+                
+                # Send start event with request ID
+                yield f"data: {json.dumps({'type': 'start', 'message_id': message_id, 'request_id': request_id, 'timestamp': datetime.now().isoformat()})}\n\n"
+                
+                # Stream the AI response with code block detection
+                buffer = ""
+                
+                try:
+                    async for chunk in chat_service.bedrock_service.generate_streaming_response(
+                        user_message=request.content,
+                        mode=request.mode,
+                        conversation_history=history,
+                        code_context=request.code,
+                        error_context=request.error,
+                        cancel_event=cancel_event
+                    ):
+                        # Check for cancellation before processing each chunk
+                        if cancel_event.is_set():
+                            raise asyncio.CancelledError()
                         
-                    if chunk['type'] == 'content':
-                        content = chunk['content']
-                        accumulated_content += content
-                        buffer += content
+                        if chunk['type'] == 'content':
+                            content = chunk['content']
+                            accumulated_content += content
+                            buffer += content
                         
-                        # Check for code block markers
-                        if '```' in buffer:
-                            parts = buffer.split('```')
+                            # Check for code block markers
+                            if '```' in buffer:
+                                parts = buffer.split('```')
                             
-                            # Process complete parts
-                            for i, part in enumerate(parts[:-1]):
-                                if i % 2 == 0:  # Text before code block
-                                    if part:
-                                        yield f"data: {json.dumps({'type': 'content', 'content': part})}\n\n"
-                                else:  # Code block content
-                                    # Extract language and code
-                                    lines = part.split('\n', 1)
-                                    lang = lines[0].strip() if lines else ''
-                                    code_content = lines[1] if len(lines) > 1 else ''
+                                # Process complete parts
+                                for i, part in enumerate(parts[:-1]):
+                                    if i % 2 == 0:  # Text before code block
+                                        if part:
+                                            yield f"data: {json.dumps({'type': 'content', 'content': part})}\n\n"
+                                    else:  # Code block content
+                                        # Extract language and code
+                                        lines = part.split('\n', 1)
+                                        lang = lines[0].strip() if lines else ''
+                                        code_content = lines[1] if len(lines) > 1 else ''
                                     
-                                    # Send as structured code block
-                                    code_block = {'type': 'code_block','language': lang,'content': code_content}
-                                    yield f"data: {json.dumps(code_block)}\n\n"
+                                        # Send as structured code block
+                                        code_block = {'type': 'code_block','language': lang,'content': code_content}
+                                        yield f"data: {json.dumps(code_block)}\n\n"
                             
-                            # Keep the last incomplete part in buffer
-                            buffer = parts[-1]
-                        else:
-                            # No code blocks, send content normally but check for partial markers
-                            if not buffer.endswith('`'):
-                                # Send content that doesn't end with potential code marker
-                                send_content = buffer
-                                if '`' in send_content:
-                                    # Keep potential code marker in buffer
-                                    last_backtick = send_content.rfind('`')
-                                    if last_backtick > 0:
-                                        yield f"data: {json.dumps({'type': 'content', 'content': send_content[:last_backtick]})}\n\n"
-                                        buffer = send_content[last_backtick:]
+                                # Keep the last incomplete part in buffer
+                                buffer = parts[-1]
+                            else:
+                                # No code blocks, send content normally but check for partial markers
+                                if not buffer.endswith('`'):
+                                    # Send content that doesn't end with potential code marker
+                                    send_content = buffer
+                                    if '`' in send_content:
+                                        # Keep potential code marker in buffer
+                                        last_backtick = send_content.rfind('`')
+                                        if last_backtick > 0:
+                                            yield f"data: {json.dumps({'type': 'content', 'content': send_content[:last_backtick]})}\n\n"
+                                            buffer = send_content[last_backtick:]
+                                        else:
+                                            buffer = send_content
                                     else:
-                                        buffer = send_content
-                                else:
-                                    yield f"data: {json.dumps({'type': 'content', 'content': send_content})}\n\n"
-                                    buffer = ""
+                                        yield f"data: {json.dumps({'type': 'content', 'content': send_content})}\n\n"
+                                        buffer = ""
                     
-                    elif chunk['type'] == 'end':
-                        # Send any remaining buffer content
-                        if buffer:
-                            yield f"data: {json.dumps({'type': 'content', 'content': buffer})}\n\n"
+                        elif chunk['type'] == 'end':
+                            # Send any remaining buffer content
+                            if buffer:
+                                yield f"data: {json.dumps({'type': 'content', 'content': buffer})}\n\n"
                         
-                        # Store session data asynchronously to avoid blocking
-                        if request.session_id and accumulated_content:
-                            user_id = current_user.id if current_user else None
-                            asyncio.create_task(chat_service.store_conversation_async(
-                                request.session_id, message_id, request.content, 
-                                accumulated_content, request.mode, user_id
-                            ))
+                            # Queue session data for write-behind persistence (only waits under backpressure)
+                            if request.session_id and accumulated_content:
+                                user_id = current_user.id if current_user else None
+                                await chat_service.store_conversation_async(
+                                    request.session_id, message_id, request.content, 
+                                    accumulated_content, request.mode, user_id
+                                )
                         
-                        yield f"data: {json.dumps({'type': 'end', 'message_id': message_id})}\n\n"
+                            # Usage has been reported by now, so the quota reflects this response
+                            quota = token_quota.settle(charge, len(accumulated_content))
+                            yield f"data: {json.dumps({'type': 'end', 'message_id': message_id, 'quota': quota})}\n\n"
                     
-                    elif chunk['type'] == 'error':
-                        yield f"data: {json.dumps({'type': 'error', 'error': chunk['error']})}\n\n"
-            
-            except asyncio.CancelledError:
-                yield f"data: {json.dumps({'type': 'stopped', 'message': 'Response generation stopped'})}\n\n"
-                return
+                        elif chunk['type'] == 'error':
+                            yield f"data: {json.dumps({'type': 'error', 'error': chunk['error']})}\n\n"
+                
+                except asyncio.CancelledError:
+                    yield f"data: {json.dumps({'type': 'stopped', 'message': 'Response generation stopped'})}\n\n"
+                    return
+                
+                # Send final done event
+                yield f"data: {json.dumps({'type': 'done'})}\n\n"
             finally:
-                # Clean up event from tracking
+                # Runs however the stream ends, including failures before the model is called
                 active_streams.pop(request_id, None)
-            
-            # Send final done event
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                # Stopped or failed streams pay for the output produced so far
+                token_quota.settle(charge, len(accumulated_content))
         
         return StreamingResponse(
             generate_stream(),
@@ -179,13 +237,24 @@ async def send_message_stream(request: ChatMessageRequest,current_user: UserResp
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
                 "X-Accel-Buffering": "no",  # Disable nginx buffering
+                **_quota_headers(quota_state),
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Headers": "*",
                 "Access-Control-Allow-Methods": "*"
-            }
+            },
+            # Starlette skips the body when the client disconnects before it starts
+            background=BackgroundTask(_finish_stream, request_id, charge)
         )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e), headers=_quota_headers(token_quota.settle(charge)))
+
+@router.get("/queue")
+async def get_queue_status(http_request: Request):
+    """
+    Get the caller's running and waiting generations and their wait times
+    """
+    identity = await token_quota.identify(http_request)
+    return generation_scheduler.get_user_stats(identity)
 
 @router.post("/stop/{request_id}")
 async def stop_streaming(request_id: str):
@@ -202,49 +271,167 @@ async def stop_streaming(request_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _set_page_headers(response: Response, total: int, next_cursor, prev_cursor):
+    """Expose pagination metadata as response headers"""
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    if prev_cursor is not None:
+        response.headers["X-Prev-Cursor"] = str(prev_cursor)
+
 @router.get("/sessions", response_model=ChatSessionResponse)
-async def get_sessions(current_user: UserResponse = Depends(get_current_user_optional)):
+async def get_sessions(response: Response,
+                       limit: Optional[int] = Query(None, ge=1, le=500),
+                       before: Optional[str] = None,
+                       after: Optional[str] = None,
+                       current_user: UserResponse = Depends(get_current_user_optional)):
     """
-    Get all chat sessions for the current user
+    Get chat sessions for the current user, most recently updated first.
+    Pass limit to page; follow X-Next-Cursor with before= and X-Prev-Cursor with after=.
     """
     try:
         user_id = current_user.id if current_user else None
-        sessions_data = chat_service.get_all_sessions(user_id)
-        sessions = []
-        
-        for session_id, messages in sessions_data.items():
-            if messages:
-                first_message = messages[0]
-                sessions.append(ChatSession(
-                    id=session_id,
-                    title=first_message.content[:50] + "..." if len(first_message.content) > 50 else first_message.content,
-                    mode=first_message.mode,
-                    created_at=first_message.timestamp,
-                    updated_at=messages[-1].timestamp,
-                    message_count=len(messages),
-                    user_id=user_id
-                ))
+        sessions, total, next_cursor, prev_cursor = await chat_service.list_sessions_page(user_id, limit, before, after)
+        _set_page_headers(response, total, next_cursor, prev_cursor)
         
         return ChatSessionResponse(sessions=sessions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/changes", response_model=ChatSessionChangesResponse)
+async def get_session_changes(since: int = Query(0, ge=0),
+                              limit: int = Query(500, ge=1, le=5000),
+                              current_user: UserResponse = Depends(get_current_user_optional)):
+    """
+    Get sessions and messages changed, and sessions deleted, since a per-user version.
+    Pass the returned version as since on the next call; since=0 performs a full sync.
+    """
+    try:
+        user_id = current_user.id if current_user else None
+        return await chat_service.get_session_changes(user_id, since, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sessions/{session_id}", response_model=List[ChatMessageResponse])
-async def get_session_messages(session_id: str, current_user: UserResponse = Depends(get_current_user_optional)):
+async def get_session_messages(session_id: str,
+                               limit: Optional[int] = Query(None, ge=1, le=500),
+                               before: Optional[int] = None,
+                               after: Optional[int] = None,
+                               current_user: UserResponse = Depends(get_current_user_optional)):
+    """
+    Get messages for a specific session (user-specific), oldest first.
+    Pass limit to page; cursors are message sequence numbers.
+    """
+    try:
+        user_id = current_user.id if current_user else None
+        page = await chat_service.get_session_messages_page(session_id, user_id, limit, before, after)
+        if page is None or page[1] == 0:
+            raise HTTPException(status_code=404, detail="Session not found")
+        payloads, total, next_cursor, prev_cursor = page
+        
+        # Stored payloads are already serialized responses, so pass them through as-is
+        response = Response(content="[" + ",".join(payloads) + "]", media_type="application/json")
+        _set_page_headers(response, total, next_cursor, prev_cursor)
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/search", response_model=ChatSearchResponse)
+async def search_messages(q: str = Query(..., min_length=1, max_length=200),
+                          limit: int = Query(20, ge=1, le=100),
+                          current_user: UserResponse = Depends(get_current_user_optional)):
     """
-    Get messages for a specific session (user-specific)
+    Search the current user's past messages (newly stored messages are searchable within seconds)
     """
     try:
         user_id = current_user.id if current_user else None
-        messages = chat_service.get_session_messages(session_id, user_id)
-        if not messages:
+        return await chat_service.search_messages(user_id, q, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _export_response(chunks, name: str, export_format: ExportFormat, gzip: bool) -> StreamingResponse:
+    """Stream an export as a file download"""
+    filename = export_service.filename(name, export_format, gzip)
+    return StreamingResponse(
+        export_service.encode(chunks, gzip),
+        media_type=export_service.media_type(export_format, gzip),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/sessions/{session_id}/export")
+async def export_session(session_id: str,
+                         format: ExportFormat = ExportFormat.NDJSON,
+                         gzip: bool = False,
+                         after: int = Query(0, ge=0),
+                         current_user: UserResponse = Depends(get_current_user_optional)):
+    """
+    Export a session as NDJSON, Markdown or HTML, optionally gzipped.
+    Resume an interrupted export with after=<last seq received>.
+    """
+    try:
+        user_id = current_user.id if current_user else None
+        chunks = await export_service.open_session_export(user_id, session_id, format, after)
+        if chunks is None:
             raise HTTPException(status_code=404, detail="Session not found")
-        return messages
+        return _export_response(chunks, f"session-{session_id}", format, gzip)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/export")
+async def export_history(format: ExportFormat = ExportFormat.NDJSON,
+                         gzip: bool = False,
+                         after: Optional[str] = None,
+                         current_user: UserResponse = Depends(get_current_user_optional)):
+    """
+    Export all of the current user's sessions as NDJSON, Markdown or HTML, optionally gzipped.
+    Resume an interrupted export with after=<session_id>:<seq> of the last message received.
+    """
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    try:
+        chunks = await export_service.open_user_export(current_user.id, format, after)
+        return _export_response(chunks, "chat-history", format, gzip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/blobs")
+async def upload_blob(request: Request, current_user: UserResponse = Depends(get_current_user_required)):
+    """
+    Upload code or error context once; reference it later as code_ref/error_ref by its SHA-256 digest.
+    Blobs are held in this worker's memory only, so a ref sent to another worker is unknown there.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.blob_max_bytes:
+        raise HTTPException(status_code=413, detail="Blob too large")
+    # The header is optional (chunked uploads), so stop reading once the limit is passed
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > settings.blob_max_bytes:
+            raise HTTPException(status_code=413, detail="Blob too large")
+    try:
+        digest, created = blob_store.put(bytes(data))
+        return {"digest": digest, "created": created}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.head("/blobs/{digest}")
+async def check_blob(digest: str, current_user: UserResponse = Depends(get_current_user_required)):
+    """
+    Check whether a context blob is stored, so clients upload only unknown content
+    """
+    if not blob_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return Response(status_code=200)
+
 @router.post("/sessions", response_model=Dict[str, str])
 async def create_session(current_user: UserResponse = Depends(get_current_user_optional)):
     """
@@ -255,7 +442,7 @@ async def create_session(current_user: UserResponse = Depends(get_current_user_o
         user_id = current_user.id if current_user else None
         
         if user_id:
-            chat_service.create_user_session(user_id, session_id)
+            await chat_service.create_user_session(user_id, session_id)
         
         return {"session_id": session_id, "message": "Session created successfully"}
     except Exception as e:
@@ -269,18 +456,11 @@ async def delete_session(session_id: str, current_user: UserResponse = Depends(g
     try:
         user_id = current_user.id if current_user else None
         
-        if user_id:
-            if chat_service.delete_user_session(user_id, session_id):
-                return {"message": "Session deleted successfully"}
-            else:
-                raise HTTPException(status_code=404, detail="Session not found")
+        # Anonymous sessions are stored under an empty owner in the session store
+        if await chat_service.delete_user_session(user_id, session_id):
+            return {"message": "Session deleted successfully"}
         else:
-            # Fallback for anonymous users
-            if session_id in chat_service.sessions:
-                del chat_service.sessions[session_id]
-                return {"message": "Session deleted successfully"}
-            else:
-                raise HTTPException(status_code=404, detail="Session not found")
+            raise HTTPException(status_code=404, detail="Session not found")
     except HTTPException:
         raise
     except Exception as e:
@@ -1,11 +1,15 @@
-import httpx
+import hashlib
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Set
 from jose import JWTError, jwt
 from src.config.config import settings
 from src.models.auth_schemas import UserCreate, UserResponse, Token, TokenData, LoginResponse
 from src.services.user_service import user_service
+from src.services.google_certs import google_certs
+from src.utils.cache_manager import InMemoryCache
 from src.utils.logger import get_logger, log_with_context
+from src.utils.performance_monitor import performance_monitor
 
 logger = get_logger(__name__)
 
@@ -14,40 +18,57 @@ class AuthService:
     
     def __init__(self):
         self.google_userinfo_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-        self.google_certs_url = "https://www.googleapis.com/oauth2/v1/certs"
+        # Verified access tokens by digest, each holding its resolved user for at most user_cache_ttl
+        self.token_cache = InMemoryCache(name="auth_token", max_entries=settings.auth_token_cache_max_entries)
+        self._token_keys_by_user: Dict[str, Set[str]] = {}
+        self._token_users: Dict[str, str] = {}
+        self._invalidations = 0
+        self.token_cache.add_removal_listener(self._forget_token)
+        user_service.add_invalidation_listener(self.invalidate_user)
+        performance_monitor.register_cache(self.token_cache.name, self.token_cache.get_stats)
+    
+    def _forget_token(self, key: str) -> None:
+        """Drop a cached token from the per-user index"""
+        user_id = self._token_users.pop(key, None)
+        keys = self._token_keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._token_keys_by_user[user_id]
+    
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop every cached token of a user so the next request re-resolves them"""
+        self._invalidations += 1
+        for key in list(self._token_keys_by_user.get(user_id, ())):
+            self.token_cache.delete(key)
     
     async def verify_google_id_token_full(self, token: str) -> Optional[Dict[str, Any]]:
         """Full verification of Google ID token with signature validation"""
         try:
-            # Get Google's public keys
-            async with httpx.AsyncClient() as client:
-                certs_response = await client.get(self.google_certs_url)
-                if certs_response.status_code != 200:
-                    return None
-                    
-                certs = certs_response.json()
-                
-                # Decode and verify token
-                header = jwt.get_unverified_header(token)
-                key_id = header.get('kid')
-                
-                if key_id not in certs:
-                    return None
-                    
-                public_key = certs[key_id]
-                payload = jwt.decode(token, public_key, algorithms=['RS256'])
+            # Get Google's public key for this token from the shared certs cache
+            header = jwt.get_unverified_header(token)
+            public_key = await google_certs.get_key(header.get('kid'))
+            if public_key is None:
+                return None
+            
+            # Decode and verify token, checking the audience when a client id is configured
+            payload = jwt.decode(
+                token, public_key, algorithms=['RS256'],
+                audience=settings.google_client_id,
+                options={'verify_aud': bool(settings.google_client_id), 'verify_at_hash': False}
+            )
+            
+            # Validate claims
+            if payload.get('iss') not in ['https://accounts.google.com', 'accounts.google.com']:
+                return None
                 
-                # Validate claims
-                if payload.get('iss') not in ['https://accounts.google.com', 'accounts.google.com']:
-                    return None
-                    
-                return {
-                    'id': payload.get('sub'),
-                    'email': payload.get('email'),
-                    'name': payload.get('name'),
-                    'picture': payload.get('picture'),
-                    'email_verified': payload.get('email_verified', False)
-                }
+            return {
+                'id': payload.get('sub'),
+                'email': payload.get('email'),
+                'name': payload.get('name'),
+                'picture': payload.get('picture'),
+                'email_verified': payload.get('email_verified', False)
+            }
                 
         except Exception as e:
             log_with_context(logger, 'error', f'Error verifying Google ID token: {str(e)}')
@@ -106,7 +127,10 @@ class AuthService:
         """Authenticate user with Google token"""
         # Verify Google token
         print('google_token ===== ', google_token)
-        google_user_info = await self.verify_google_token(google_token)
+        if settings.google_verify_signature:
+            google_user_info = await self.verify_google_id_token_full(google_token)
+        else:
+            google_user_info = await self.verify_google_token(google_token)
         if not google_user_info:
             return None
         
@@ -161,28 +185,49 @@ class AuthService:
         
         return encoded_jwt
     
-    async def verify_token(self, token: str) -> Optional[TokenData]:
-        """Verify JWT token"""
+    def _decode_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verify a JWT's signature and expiry and return its claims"""
         try:
             payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-            user_id: str = payload.get("sub")
-            email: str = payload.get("email")
-            
-            if user_id is None:
-                return None
-                
-            return TokenData(user_id=user_id, email=email)
-            
         except JWTError:
             return None
+        return payload if payload.get("sub") is not None else None
+    
+    async def verify_token(self, token: str) -> Optional[TokenData]:
+        """Verify JWT token"""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        user = self.token_cache.get(key)
+        if user is not None:
+            return TokenData(user_id=user.id, email=user.email)
+        
+        payload = self._decode_token(token)
+        if payload is None:
+            return None
+        return TokenData(user_id=payload["sub"], email=payload.get("email"))
     
     async def get_current_user(self, token: str) -> Optional[UserResponse]:
-        """Get current user from JWT token"""
-        token_data = await self.verify_token(token)
-        if not token_data or not token_data.user_id:
+        """Get current user from JWT token, served from the verified token cache when possible"""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        user = self.token_cache.get(key)
+        if user is not None:
+            return user
+        
+        payload = self._decode_token(token)
+        if payload is None:
+            return None
+        
+        invalidations = self._invalidations
+        user = await user_service.get_user_by_id(payload["sub"])
+        if not user or not user.is_active:
             return None
         
-        user = await user_service.get_user_by_id(token_data.user_id)
+        # Skip caching if the user changed while it was being loaded. Entries expire with the user
+        # cache so changes made by other workers (e.g. deactivation) are picked up
+        ttl = min(payload.get("exp", 0) - time.time(), settings.user_cache_ttl)
+        if ttl > 0 and invalidations == self._invalidations:
+            self.token_cache.set(key, user, ttl=ttl)
+            self._token_users[key] = user.id
+            self._token_keys_by_user.setdefault(user.id, set()).add(key)
         return user
 
 # Global auth service instance
@@ -1,22 +1,23 @@
-import os
+import itertools
 import json
-import boto3
 from typing import Dict, List, Any, Optional, AsyncGenerator
 from datetime import datetime
 from src.models.schemas import ChatMode
-import boto3
-import os
+from src.utils.client_registry import client_registry
 from src.utils.cache_manager import cache_manager
+from src.utils.near_duplicate_index import near_duplicate_index
+from src.services.blob_store import content_digest
+from src.services.token_quota import current_charge, record_usage
+from src.services.generation_scheduler import GenerationPriority, generation_scheduler
 from src.utils.logger import get_logger, log_with_context
 from src.config.config import settings
 import asyncio
 import hashlib
+import time
 
 class BedrockService:
     def __init__(self):
         self.logger = get_logger(__name__)
-        # Use singleton client manager instead of creating new client
-        self._client = None
         # Model mapping for different chat modes
         self.model_mapping = {
             ChatMode.RESEARCH: 'us.anthropic.claude-sonnet-4-20250514-v1:0',
@@ -27,13 +28,8 @@ class BedrockService:
     
     @property
     def client(self):
-        """Get Bedrock client"""
-        if self._client is None:
-            self._client = boto3.client(
-                'bedrock-runtime',
-                region_name=os.getenv('AWS_REGION', 'us-west-2')
-            )
-        return self._client
+        """Get the shared Bedrock client"""
+        return client_registry.bedrock
     
     def _generate_cache_key(self, user_message: str, mode: ChatMode, 
                            conversation_history: Optional[List[Dict[str, str]]] = None,
@@ -44,11 +40,90 @@ class BedrockService:
             'message': user_message,
             'mode': mode.value,
             'history_hash': hashlib.md5(str(conversation_history or []).encode()).hexdigest()[:8],
-            'code_hash': hashlib.md5((code_context or '').encode()).hexdigest()[:8],
-            'error_hash': hashlib.md5((error_context or '').encode()).hexdigest()[:8]
+            # Blob-backed context reuses its upload digest instead of re-hashing the payload
+            'code_hash': content_digest(code_context)[:16] if code_context else '',
+            'error_hash': content_digest(error_context)[:16] if error_context else ''
         }
         return cache_manager.response_cache._generate_key(**context_data)
         
+    def _is_near_duplicate_eligible(self, conversation_history: Optional[List[Dict[str, str]]] = None,
+                                    code_context: Optional[str] = None,
+                                    error_context: Optional[str] = None) -> bool:
+        """Near-duplicate matching only applies to standalone questions without attached context"""
+        return (
+            settings.near_duplicate_cache_enabled
+            and len(conversation_history or []) <= settings.near_duplicate_max_history
+            and not code_context
+            and not error_context
+        )
+    
+    def _get_cached_response(self, cache_key: str, user_message: str, mode: ChatMode,
+                             near_duplicate_eligible: bool) -> Optional[Dict[str, Any]]:
+        """Look up a cached response by exact key, then by near-duplicate question"""
+        cached_response = cache_manager.response_cache.get(cache_key)
+        # Entries without raw_content predate the current layout (e.g. from an old snapshot)
+        if cached_response and 'raw_content' in cached_response:
+            log_with_context(self.logger, 'info', 'Cache hit for response', cache_key=cache_key)
+            return cached_response
+        
+        # Fall back to a near-duplicate question answered in the same mode
+        if near_duplicate_eligible:
+            match_key = near_duplicate_index.lookup(user_message, mode.value)
+            if match_key:
+                cached_response = cache_manager.response_cache.get(match_key)
+                if cached_response and 'raw_content' in cached_response:
+                    log_with_context(self.logger, 'info', 'Near-duplicate cache hit for response', cache_key=match_key)
+                    return cached_response
+        return None
+    
+    def _cache_response(self, cache_key: str, raw_content: str, user_message: str, mode: ChatMode,
+                        near_duplicate_eligible: bool, chunks: Optional[List[str]] = None,
+                        timings: Optional[List[float]] = None) -> None:
+        """Store a response where both the streaming and non-streaming paths can find it.
+
+        The raw model text is kept once; a streamed response adds where each chunk
+        ended in it and when it arrived, so replay can rebuild the same chunks.
+        """
+        entry: Dict[str, Any] = {'raw_content': raw_content}
+        if near_duplicate_eligible:
+            # Kept so the near-duplicate index can be rebuilt when the entry is restored from a snapshot
+            entry['query'] = (user_message, mode.value)
+        if chunks:
+            entry['chunk_ends'] = list(itertools.accumulate(len(chunk) for chunk in chunks))
+            entry['chunk_timings'] = timings
+        cache_manager.response_cache.set(cache_key, entry, ttl=settings.cache_ttl)
+        if near_duplicate_eligible:
+            near_duplicate_index.add(cache_key, user_message, mode.value)
+        log_with_context(self.logger, 'info', 'Response cached', cache_key=cache_key)
+    
+    async def _replay_cached_stream(self, cached_response: Dict[str, Any], mode: ChatMode,
+                                    cancel_event: Optional[asyncio.Event] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """Replay a cached response as stream chunks, instantly or paced by the recorded timing"""
+        raw_content = cached_response['raw_content']
+        chunk_ends = cached_response.get('chunk_ends')
+        timings = cached_response.get('chunk_timings') if settings.stream_replay_paced else None
+        if chunk_ends:
+            chunks = [raw_content[start:end] for start, end in zip([0] + chunk_ends, chunk_ends)]
+        else:
+            # Filled by the non-streaming path: re-chunk the raw model output
+            size = settings.stream_replay_chunk_size
+            chunks = [raw_content[i:i + size] for i in range(0, len(raw_content), size)]
+        
+        previous = 0.0
+        for i, content in enumerate(chunks):
+            if cancel_event and cancel_event.is_set():
+                raise asyncio.CancelledError()
+            if timings and i < len(timings):
+                await asyncio.sleep(min(max(timings[i] - previous, 0), settings.stream_replay_max_gap))
+                previous = timings[i]
+            yield {'type': 'content', 'content': content, 'mode': mode.value}
+        yield {'type': 'end'}
+    
+    def _generation_slot(self, priority: GenerationPriority):
+        """Wait for a fair turn at the model for the user making the current request"""
+        charge = current_charge.get()
+        return generation_scheduler.slot(charge.identity if charge else 'internal', priority)
+    
     def _get_model_id(self, mode: ChatMode) -> str:
         """Get model ID based on chat mode"""
         return self.model_mapping.get(mode, self.model_mapping[ChatMode.STANDARD])
@@ -222,21 +297,18 @@ class BedrockService:
         """Generate non-streaming response with caching"""
         # Check cache first
         cache_key = self._generate_cache_key(user_message, mode, conversation_history, code_context, error_context)
-        cached_response = cache_manager.response_cache.get(cache_key)
+        near_duplicate_eligible = self._is_near_duplicate_eligible(conversation_history, code_context, error_context)
+        cached_response = self._get_cached_response(cache_key, user_message, mode, near_duplicate_eligible)
         
         if cached_response:
-            log_with_context(self.logger, 'info', 'Cache hit for response', cache_key=cache_key)
-            return cached_response
+            return self._format_response(cached_response['raw_content'], mode)
         
         # Generate new response
         try:
-            response = await self._generate_bedrock_response(user_message, mode, conversation_history, code_context, error_context)
+            content = await self._generate_bedrock_response(user_message, mode, conversation_history, code_context, error_context)
+            self._cache_response(cache_key, content, user_message, mode, near_duplicate_eligible)
             
-            # Cache the response
-            cache_manager.response_cache.set(cache_key, response, ttl=settings.cache_ttl)
-            log_with_context(self.logger, 'info', 'Response cached', cache_key=cache_key)
-            
-            return response
+            return self._format_response(content, mode)
         except Exception as e:
             log_with_context(self.logger, 'error', f'Error generating response: {str(e)}', mode=mode.value)
             raise
@@ -252,9 +324,29 @@ class BedrockService:
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Generate streaming response using Bedrock Claude"""
         try:
+            # Replay a cached response filled by either path
+            cache_key = self._generate_cache_key(user_message, mode, conversation_history, code_context, error_context)
+            near_duplicate_eligible = self._is_near_duplicate_eligible(conversation_history, code_context, error_context)
+            cached_response = self._get_cached_response(cache_key, user_message, mode, near_duplicate_eligible)
+            if cached_response:
+                async for chunk in self._replay_cached_stream(cached_response, mode, cancel_event):
+                    yield chunk
+                return
+            
             log_with_context(self.logger, 'info', 'Starting streaming response', mode=mode.value)
             
+            # Record the delta sequence so a completed stream can be cached
+            chunks = []
+            timings = []
+            stream_start = time.monotonic()
+            
             async for chunk in self._generate_bedrock_streaming_response(user_message, mode, conversation_history, code_context, error_context, cancel_event):
+                if chunk['type'] == 'content':
+                    chunks.append(chunk['content'])
+                    timings.append(round(time.monotonic() - stream_start, 3))
+                elif chunk['type'] == 'end' and chunks:
+                    self._cache_response(cache_key, ''.join(chunks), user_message, mode,
+                                         near_duplicate_eligible, chunks, timings)
                 yield chunk
                 
         except Exception as e:
@@ -268,22 +360,24 @@ class BedrockService:
         conversation_history: Optional[List[Dict[str, str]]] = None,
         code_context: Optional[str] = None,
         error_context: Optional[str] = None
-    ) -> Dict[str, Any]:
-        """Generate non-streaming response from Bedrock"""
+    ) -> str:
+        """Generate non-streaming response from Bedrock and return the raw model text"""
         messages = self._build_messages(user_message, mode, conversation_history, code_context, error_context)
         body = self._build_request_body(mode, messages)
         model_id = self._get_model_id(mode)
         
-        response = self.client.invoke_model(
-            modelId=model_id,
-            body=json.dumps(body)
-        )
-        
-        response_body = json.loads(response['body'].read())
-        content = response_body['content'][0]['text']
-        formatted_response = self._format_response(content, mode)
+        def invoke() -> Dict[str, Any]:
+            response = self.client.invoke_model(
+                modelId=model_id,
+                body=json.dumps(body)
+            )
+            return json.loads(response['body'].read())
         
-        return formatted_response
+        async with self._generation_slot(GenerationPriority.STANDARD):
+            response_body = await client_registry.run_bedrock(invoke)
+        usage = response_body.get('usage', {})
+        record_usage(usage.get('input_tokens'), usage.get('output_tokens'))
+        return response_body['content'][0]['text']
     
     async def _generate_bedrock_streaming_response(
         self, 
@@ -300,30 +394,50 @@ class BedrockService:
             body = self._build_request_body(mode, messages)
             model_id = self._get_model_id(mode)
             
-            response = self.client.invoke_model_with_response_stream(
-                modelId=model_id,
-                body=json.dumps(body)
-            )
-            
-            for event in response['body']:
-                # Check for cancellation
-                if cancel_event and cancel_event.is_set():
-                    raise asyncio.CancelledError()
-                    
-                if 'chunk' in event:
-                    chunk_data = json.loads(event['chunk']['bytes'])
-                    
-                    if chunk_data['type'] == 'content_block_delta':
-                        if 'delta' in chunk_data and 'text' in chunk_data['delta']:
-                            content = chunk_data['delta']['text']
-                            yield {'type': 'content', 'content': content, 'mode': mode.value}
-                    
-                    elif chunk_data['type'] == 'message_stop':
-                        yield {'type': 'end'}
+            async with self._generation_slot(GenerationPriority.INTERACTIVE):
+                async for chunk in self._stream_events(mode, model_id, body, cancel_event):
+                    yield chunk
                         
         except Exception as e:
             yield {'type': 'error', 'error': str(e)}
     
+    async def _stream_events(self, mode: ChatMode, model_id: str, body: Dict[str, Any],
+                             cancel_event: Optional[asyncio.Event] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """Invoke the streaming model API and translate its events into chunks"""
+        response = await client_registry.run_bedrock(
+            self.client.invoke_model_with_response_stream,
+            modelId=model_id,
+            body=json.dumps(body)
+        )
+        
+        events = iter(response['body'])
+        while True:
+            # Each read waits on the network, so it runs on the Bedrock thread pool too
+            event = await client_registry.run_bedrock(next, events, None)
+            if event is None:
+                break
+            
+            # Check for cancellation
+            if cancel_event and cancel_event.is_set():
+                raise asyncio.CancelledError()
+                
+            if 'chunk' in event:
+                chunk_data = json.loads(event['chunk']['bytes'])
+                
+                if chunk_data['type'] == 'content_block_delta':
+                    if 'delta' in chunk_data and 'text' in chunk_data['delta']:
+                        content = chunk_data['delta']['text']
+                        yield {'type': 'content', 'content': content, 'mode': mode.value}
+                
+                elif chunk_data['type'] == 'message_start':
+                    record_usage(input_tokens=chunk_data['message'].get('usage', {}).get('input_tokens'))
+                
+                elif chunk_data['type'] == 'message_delta':
+                    record_usage(output_tokens=chunk_data.get('usage', {}).get('output_tokens'))
+                
+                elif chunk_data['type'] == 'message_stop':
+                    yield {'type': 'end'}
+    
     def _build_messages(
         self, 
         user_message: str, 
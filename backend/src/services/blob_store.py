@@ -0,0 +1,171 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+from src.config.config import settings
+from src.utils.logger import get_logger, log_with_context
+from src.utils.performance_monitor import performance_monitor
+
+logger = get_logger(__name__)
+
+class BlobText(str):
+    """Context text backed by a stored blob, carrying its content digest so it is never re-hashed"""
+
+    digest: str
+
+def content_digest(text: str) -> str:
+    """Get the SHA-256 digest of context text, reusing the stored digest for blob-backed text"""
+    digest = getattr(text, 'digest', None)
+    if digest is not None:
+        return digest
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class Blob:
+    """One stored context payload"""
+
+    __slots__ = ('text', 'size', 'sessions', 'last_access')
+
+    def __init__(self, text: BlobText, size: int):
+        self.text = text
+        self.size = size
+        self.sessions: Set[str] = set()
+        self.last_access = time.monotonic()
+
+class BlobStore:
+    """Content-addressed store for large code/error context uploaded once and referenced by digest.
+
+    Blobs are reference-counted by the sessions that use them. Unreferenced blobs are
+    evicted first when the memory budget is exceeded; any blob idle past the
+    threshold is evicted, and clients re-upload on a missing reference.
+
+    The store lives in each worker's memory and is not shared: with several
+    workers a blob uploaded through one is unknown to the others, so clients
+    resend the context inline when a reference is rejected.
+    """
+
+    def __init__(self, memory_budget_bytes: int, max_blob_bytes: int, idle_seconds: float):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_blob_bytes = max_blob_bytes
+        self.idle_seconds = idle_seconds
+        self._blobs: "OrderedDict[str, Blob]" = OrderedDict()
+        self._session_refs: Dict[str, Set[str]] = {}
+        self.stored_bytes = 0
+
+        self.uploads = 0
+        self.duplicate_uploads = 0
+        self.resolved = 0
+        self.missing = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+    def put(self, data: bytes) -> Tuple[str, bool]:
+        """Store a UTF-8 payload and return (digest, created); raises ValueError if too large or not text"""
+        if len(data) > self.max_blob_bytes:
+            raise ValueError(f"Blob exceeds {self.max_blob_bytes} bytes")
+        digest = hashlib.sha256(data).hexdigest()
+
+        blob = self._blobs.get(digest)
+        if blob is not None:
+            self.uploads += 1
+            self.duplicate_uploads += 1
+            self._touch(digest, blob)
+            return digest, False
+
+        text = BlobText(data.decode('utf-8'))
+        text.digest = digest
+        self.uploads += 1
+        self._blobs[digest] = Blob(text, len(data))
+        self.stored_bytes += len(data)
+        self._enforce_budget(keep=digest)
+        return digest, True
+
+    def exists(self, digest: str) -> bool:
+        """Check whether a blob is stored, refreshing it so a follow-up reference finds it"""
+        blob = self._blobs.get(digest)
+        if blob is None:
+            return False
+        self._touch(digest, blob)
+        return True
+
+    def resolve(self, digest: str, session_id: Optional[str] = None) -> Optional[BlobText]:
+        """Get a blob's text and record the session as a reference holder"""
+        blob = self._blobs.get(digest)
+        if blob is None:
+            self.missing += 1
+            return None
+        self.resolved += 1
+        self.bytes_saved += blob.size
+        self._touch(digest, blob)
+        if session_id:
+            blob.sessions.add(session_id)
+            self._session_refs.setdefault(session_id, set()).add(digest)
+        return blob.text
+
+    def release_session(self, session_id: str) -> None:
+        """Drop every reference a session holds"""
+        for digest in self._session_refs.pop(session_id, ()):
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                blob.sessions.discard(session_id)
+
+    def _touch(self, digest: str, blob: Blob) -> None:
+        blob.last_access = time.monotonic()
+        self._blobs.move_to_end(digest)
+
+    def _evict(self, digest: str) -> None:
+        blob = self._blobs.pop(digest)
+        self.stored_bytes -= blob.size
+        self.evictions += 1
+        for session_id in blob.sessions:
+            refs = self._session_refs.get(session_id)
+            if refs is not None:
+                refs.discard(digest)
+                if not refs:
+                    del self._session_refs[session_id]
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        """Evict least recently used blobs, unreferenced ones first, until under budget"""
+        for referenced in (False, True):
+            if self.stored_bytes <= self.memory_budget_bytes:
+                return
+            for digest, blob in list(self._blobs.items()):
+                if self.stored_bytes <= self.memory_budget_bytes:
+                    return
+                if digest != keep and (referenced or not blob.sessions):
+                    self._evict(digest)
+
+    def evict_idle(self) -> int:
+        """Evict blobs idle past the threshold and return how many were removed"""
+        cutoff = time.monotonic() - self.idle_seconds
+        evicted = 0
+        for digest, blob in list(self._blobs.items()):
+            if blob.last_access > cutoff:
+                break
+            self._evict(digest)
+            evicted += 1
+        if evicted:
+            log_with_context(logger, 'info', 'Evicted idle context blobs', evicted=evicted, stored_bytes=self.stored_bytes)
+        return evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get blob counts, memory use and deduplication statistics"""
+        return {
+            'blobs': len(self._blobs),
+            'referenced_blobs': sum(1 for blob in self._blobs.values() if blob.sessions),
+            'stored_bytes': self.stored_bytes,
+            'memory_budget_bytes': self.memory_budget_bytes,
+            'uploads': self.uploads,
+            'duplicate_uploads': self.duplicate_uploads,
+            'resolved_refs': self.resolved,
+            'missing_refs': self.missing,
+            'bytes_saved': self.bytes_saved,
+            'evictions': self.evictions
+        }
+
+# Global blob store
+blob_store = BlobStore(
+    memory_budget_bytes=settings.blob_store_memory_mb * 1024 * 1024,
+    max_blob_bytes=settings.blob_max_bytes,
+    idle_seconds=settings.blob_idle_seconds
+)
+performance_monitor.register_component('blob_store', blob_store.get_stats)
@@ -1,30 +1,55 @@
+import base64
 import time
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from src.models.schemas import (
     ChatMessageRequest, ChatMessageResponse, ChatMode, MessageType,
-    Source, Step, CodeBlock, LogEntry, Diagnostics, ModeSuggestion
+    Source, Step, CodeBlock, LogEntry, Diagnostics, ModeSuggestion, ChatSession,
+    ChatSessionChangesResponse, SessionMessageChange, ChatSearchResponse, SearchResult
 )
+from src.models.records import MessageRecord
 from src.services.bedrock_service import BedrockService
 from src.services.mode_detector import ModeDetector
+from src.services.session_store import session_store
+from src.services.conversation_writer import conversation_writer
+from src.services.session_working_set import session_working_set
+from src.services.blob_store import blob_store
+from src.utils.logger import get_logger, log_with_context
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
 class ChatService:
     def __init__(self):
-        # In-memory storage for now (will be replaced with database)
-        self.sessions: Dict[str, List[ChatMessageResponse]] = {}
-        self.user_sessions: Dict[str, Dict[str, List[ChatMessageResponse]]] = {}  # user_id -> session_id -> messages
+        # Durable session storage (messages are persisted through the store)
+        self.store = session_store
         self.bedrock_service = BedrockService()
         self.mode_detector = ModeDetector()
-        self.conversation_history: Dict[str, List[Dict[str, str]]] = {}
+        # Recent turns per session for model context, bounded and reloaded from the store on demand
+        self.working_set = session_working_set
     
+    def resolve_context_refs(self, request: ChatMessageRequest) -> None:
+        """Replace code_ref/error_ref digests with the uploaded blob text; raises ValueError if unknown.
+        Resolved refs are cleared, so calling it again is a no-op."""
+        if request.code_ref:
+            code = blob_store.resolve(request.code_ref, request.session_id)
+            if code is None:
+                raise ValueError(f"Unknown code_ref {request.code_ref}; upload it again")
+            request.code, request.code_ref = code, None
+        if request.error_ref:
+            error = blob_store.resolve(request.error_ref, request.session_id)
+            if error is None:
+                raise ValueError(f"Unknown error_ref {request.error_ref}; upload it again")
+            request.error, request.error_ref = error, None
+
     async def process_message(self, request: ChatMessageRequest, user_id: Optional[str] = None) -> ChatMessageResponse:
         start_time = time.time()
+        self.resolve_context_refs(request)
         
         # Generate message ID
         message_id = str(uuid.uuid4())
@@ -64,39 +89,13 @@ class ChatService:
         
         # Store in session and conversation history (if session_id provided)
         if request.session_id:
-            if user_id:
-                # Store in user-specific sessions
-                if user_id not in self.user_sessions:
-                    self.user_sessions[user_id] = {}
-                if request.session_id not in self.user_sessions[user_id]:
-                    self.user_sessions[user_id][request.session_id] = []
-                    self.conversation_history[request.session_id] = []
-                
-                # Add to conversation history for context
-                self.conversation_history[request.session_id].extend([
-                    {"role": "user", "content": request.content},
-                    {"role": "assistant", "content": response.content}
-                ])
-                
-                self.user_sessions[user_id][request.session_id].append(response)
-            else:
-                # Fallback to global sessions for anonymous users
-                if request.session_id not in self.sessions:
-                    self.sessions[request.session_id] = []
-                    self.conversation_history[request.session_id] = []
-                
-                self.conversation_history[request.session_id].extend([
-                    {"role": "user", "content": request.content},
-                    {"role": "assistant", "content": response.content}
-                ])
-                
-                self.sessions[request.session_id].append(response)
+            await self._store_turn(request.session_id, user_id, request.content, response)
         
         return response
     
     async def _process_research_mode(self, request: ChatMessageRequest, message_id: str) -> ChatMessageResponse:
         # Get conversation history for context
-        history = self.conversation_history.get(request.session_id, []) if request.session_id else []
+        history = await self.get_conversation_history(request.session_id)
         
         # Generate response using Bedrock
         bedrock_response = await self.bedrock_service.generate_response(
@@ -122,7 +121,7 @@ class ChatService:
     
     async def _process_code_mode(self, request: ChatMessageRequest, message_id: str) -> ChatMessageResponse:
         # Get conversation history for context
-        history = self.conversation_history.get(request.session_id, []) if request.session_id else []
+        history = await self.get_conversation_history(request.session_id)
         
         # Generate response using Bedrock with code context
         bedrock_response = await self.bedrock_service.generate_response(
@@ -162,7 +161,7 @@ class ChatService:
     
     async def _process_troubleshoot_mode(self, request: ChatMessageRequest, message_id: str) -> ChatMessageResponse:
         # Get conversation history for context
-        history = self.conversation_history.get(request.session_id, []) if request.session_id else []
+        history = await self.get_conversation_history(request.session_id)
         
         # Generate response using Bedrock with code and error context
         bedrock_response = await self.bedrock_service.generate_response(
@@ -212,7 +211,7 @@ class ChatService:
     
     async def _process_standard_mode(self, request: ChatMessageRequest, message_id: str) -> ChatMessageResponse:
         # Get conversation history for context
-        history = self.conversation_history.get(request.session_id, []) if request.session_id else []
+        history = await self.get_conversation_history(request.session_id)
         
         # Generate response using Bedrock
         bedrock_response = await self.bedrock_service.generate_response(
@@ -229,83 +228,166 @@ class ChatService:
             mode=request.mode
         )
     
-    def get_session_messages(self, session_id: str, user_id: Optional[str] = None) -> List[ChatMessageResponse]:
-        if user_id:
-            return self.user_sessions.get(user_id, {}).get(session_id, [])
-        return self.sessions.get(session_id, [])
+    async def get_conversation_history(self, session_id: Optional[str]) -> List[Dict[str, str]]:
+        """Get recent turns for model context, loading them from the store when not resident"""
+        if not session_id:
+            return []
+        return await self.working_set.get_history(session_id)
+    
+    async def _store_turn(self, session_id: str, user_id: Optional[str], user_content: str,
+                          response: ChatMessageResponse):
+        """Add a user/assistant turn to the context history and the session store"""
+        # The working set keeps the session resident until the rows below are queued
+        await self.working_set.append(session_id, [
+            MessageRecord(MessageType.USER, user_content),
+            MessageRecord(MessageType.ASSISTANT, response.content)
+        ])
+        
+        # Persisted write-behind; the context history above is already up to date
+        await conversation_writer.enqueue([
+            {"session_id": session_id, "user_id": user_id, "role": "user", "content": user_content},
+            {"session_id": session_id, "user_id": user_id, "role": "assistant", "content": response.content,
+             "message_id": response.id, "mode": response.mode.value, "payload": response.model_dump_json()}
+        ])
     
-    def get_all_sessions(self, user_id: Optional[str] = None) -> Dict[str, List[ChatMessageResponse]]:
-        if user_id:
-            return self.user_sessions.get(user_id, {})
-        return self.sessions
+    async def get_session_messages(self, session_id: str, user_id: Optional[str] = None) -> List[ChatMessageResponse]:
+        payloads = await self.store.get_session_messages(user_id, session_id)
+        return [ChatMessageResponse.model_validate_json(payload) for payload in payloads]
     
-    def get_user_sessions(self, user_id: str) -> Dict[str, List[ChatMessageResponse]]:
-        return self.user_sessions.get(user_id, {})
+    async def get_all_sessions(self, user_id: Optional[str] = None) -> Dict[str, List[ChatMessageResponse]]:
+        sessions = await self.store.get_user_sessions(user_id)
+        return {
+            session_id: [ChatMessageResponse.model_validate_json(payload) for payload in payloads]
+            for session_id, payloads in sessions.items()
+        }
     
-    def create_user_session(self, user_id: str, session_id: str):
-        if user_id not in self.user_sessions:
-            self.user_sessions[user_id] = {}
-        self.user_sessions[user_id][session_id] = []
-        self.conversation_history[session_id] = []
+    async def list_sessions(self, user_id: Optional[str] = None, limit: Optional[int] = None) -> List[ChatSession]:
+        """List session summaries from the maintained index, most recently updated first"""
+        sessions, _, _, _ = await self.list_sessions_page(user_id, limit)
+        return sessions
     
-    def delete_user_session(self, user_id: str, session_id: str) -> bool:
-        if user_id in self.user_sessions and session_id in self.user_sessions[user_id]:
-            del self.user_sessions[user_id][session_id]
-            if session_id in self.conversation_history:
-                del self.conversation_history[session_id]
+    @staticmethod
+    def _to_chat_session(summary: Dict, user_id: Optional[str]) -> ChatSession:
+        """Build the API session model from a stored session summary"""
+        return ChatSession(
+            id=summary['id'],
+            title=summary['title'] or "",
+            mode=summary['mode'] or ChatMode.STANDARD,
+            created_at=datetime.fromtimestamp(summary['created_at']),
+            updated_at=datetime.fromtimestamp(summary['updated_at']),
+            message_count=summary['message_count'],
+            user_id=user_id
+        )
+
+    async def get_session_changes(self, user_id: Optional[str], since: int = 0,
+                                  limit: int = 500) -> ChatSessionChangesResponse:
+        """Get sessions, messages and deletions after a per-user version (0 for a full sync)"""
+        changes = await self.store.get_changes(user_id, since, limit)
+        return ChatSessionChangesResponse(
+            version=changes['version'],
+            sessions=[self._to_chat_session(summary, user_id) for summary in changes['sessions']],
+            messages=[
+                SessionMessageChange(session_id=session_id, seq=seq,
+                                     message=ChatMessageResponse.model_validate_json(payload))
+                for session_id, seq, payload in changes['messages']
+            ],
+            deleted=changes['deleted'],
+            has_more=changes['has_more'],
+            reset=changes['reset']
+        )
+
+    async def search_messages(self, user_id: Optional[str], query: str, limit: int = 20) -> ChatSearchResponse:
+        """Full-text search the user's messages, best BM25 matches first with highlighted snippets"""
+        matches = await self.store.search(user_id, query, limit)
+        return ChatSearchResponse(
+            query=query,
+            results=[
+                SearchResult(
+                    session_id=match['session_id'],
+                    seq=match['seq'],
+                    type=match['role'],
+                    snippet=match['snippet'],
+                    score=match['score'],
+                    created_at=datetime.fromtimestamp(match['created_at'])
+                )
+                for match in matches
+            ]
+        )
+
+    @staticmethod
+    def encode_session_cursor(summary: Dict) -> str:
+        """Encode a stored session summary's (updated_at, id) position as an opaque cursor"""
+        raw = f"{summary['updated_at']!r}:{summary['id']}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_session_cursor(cursor: str) -> Tuple[float, str]:
+        """Decode a session cursor, raising ValueError if it is malformed"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            updated_at, session_id = raw.split(':', 1)
+            return float(updated_at), session_id
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    async def list_sessions_page(self, user_id: Optional[str], limit: Optional[int] = None,
+                                 before: Optional[str] = None,
+                                 after: Optional[str] = None) -> Tuple[List[ChatSession], int, Optional[str], Optional[str]]:
+        """Get one page of session summaries with the total count and next/prev cursors"""
+        before_key = self.decode_session_cursor(before) if before else None
+        after_key = self.decode_session_cursor(after) if after else None
+        summaries = await self.store.list_session_summaries(user_id, limit, before_key, after_key)
+        total = await self.store.count_sessions(user_id)
+        sessions = [self._to_chat_session(summary, user_id) for summary in summaries]
+        next_cursor = self.encode_session_cursor(summaries[-1]) if limit and len(summaries) == limit else None
+        prev_cursor = self.encode_session_cursor(summaries[0]) if summaries and (before or after) else None
+        return sessions, total, next_cursor, prev_cursor
+
+    async def get_session_messages_page(self, session_id: str, user_id: Optional[str] = None,
+                                        limit: Optional[int] = None, before: Optional[int] = None,
+                                        after: Optional[int] = None) -> Optional[Tuple[List[str], int, Optional[int], Optional[int]]]:
+        """Get one page of stored message payloads (JSON) with the total count and next/prev seq cursors"""
+        page = await self.store.get_message_page(user_id, session_id, limit, before, after)
+        if page is None:
+            return None
+        total, rows = page
+        next_cursor = rows[-1][0] if limit and len(rows) == limit else None
+        prev_cursor = rows[0][0] if rows and (before is not None or after is not None) else None
+        return [payload for _, payload in rows], total, next_cursor, prev_cursor
+
+    async def get_user_sessions(self, user_id: str) -> Dict[str, List[ChatMessageResponse]]:
+        return await self.get_all_sessions(user_id)
+    
+    async def create_user_session(self, user_id: str, session_id: str):
+        await self.store.create_session(user_id, session_id)
+        self.working_set.reset(session_id)
+    
+    async def delete_user_session(self, user_id: Optional[str], session_id: str) -> bool:
+        # Before the delete, so turns still queued for the session can't re-create it
+        conversation_writer.discard_session(session_id, user_id)
+        if await self.store.delete_session(user_id, session_id):
+            self.working_set.discard(session_id)
+            blob_store.release_session(session_id)
             return True
         return False
     
     async def store_conversation_async(self, session_id: str, message_id: str, 
                                      user_content: str, assistant_content: str, mode: ChatMode, user_id: Optional[str] = None):
-        """Store conversation asynchronously to avoid blocking streaming"""
+        """Queue a streamed conversation turn for write-behind persistence"""
         try:
-            if user_id:
-                # Store in user-specific sessions
-                if user_id not in self.user_sessions:
-                    self.user_sessions[user_id] = {}
-                if session_id not in self.user_sessions[user_id]:
-                    self.user_sessions[user_id][session_id] = []
-                    self.conversation_history[session_id] = []
-                
-                # Add to conversation history
-                self.conversation_history[session_id].extend([
-                    {"role": "user", "content": user_content},
-                    {"role": "assistant", "content": assistant_content}
-                ])
-                
-                # Create response object for storage
-                response = ChatMessageResponse(
-                    id=message_id,
-                    type="assistant",
-                    content=assistant_content,
-                    timestamp=datetime.now(),
-                    mode=mode
-                )
-                self.user_sessions[user_id][session_id].append(response)
-            else:
-                # Fallback for anonymous users
-                if session_id not in self.sessions:
-                    self.sessions[session_id] = []
-                    self.conversation_history[session_id] = []
-                
-                self.conversation_history[session_id].extend([
-                    {"role": "user", "content": user_content},
-                    {"role": "assistant", "content": assistant_content}
-                ])
-                
-                response = ChatMessageResponse(
-                    id=message_id,
-                    type="assistant",
-                    content=assistant_content,
-                    timestamp=datetime.now(),
-                    mode=mode
-                )
-                self.sessions[session_id].append(response)
+            # Create response object for storage
+            response = ChatMessageResponse(
+                id=message_id,
+                type="assistant",
+                content=assistant_content,
+                timestamp=datetime.now(),
+                mode=mode
+            )
+            await self._store_turn(session_id, user_id, user_content, response)
             
         except Exception as e:
             # Log error but don't fail the streaming
-            print(f"Error storing conversation: {e}")
+            log_with_context(logger, 'error', f'Error storing conversation: {str(e)}', session_id=session_id)
     
     def _format_html_response(self, content: str, mode: ChatMode) -> str:
         """Format response content with HTML tags for better frontend rendering"""
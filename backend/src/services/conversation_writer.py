@@ -0,0 +1,211 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from src.config.config import settings
+from src.services.session_store import SessionStore, session_store
+from src.utils.logger import get_logger, log_with_context
+from src.utils.performance_monitor import performance_monitor
+
+logger = get_logger(__name__)
+
+class ConversationWriter:
+    """Write-behind queue that batches conversation rows into few store transactions"""
+
+    def __init__(self, store: SessionStore, max_queue: int, batch_size: int, flush_interval: float):
+        self.store = store
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._accepting = True
+        # Rows queued or in flight per session, so readers know what isn't durable yet
+        self.pending_sessions: Counter = Counter()
+        # Rows still queued per (session id, user id), and how many of them to drop
+        # because the session was deleted after they were queued
+        self._queued: Counter = Counter()
+        self._discard: Counter = Counter()
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.discarded = 0
+        self.blocked_enqueues = 0
+        self.enqueue_wait_time = 0.0
+        self.max_depth = 0
+        self.worker_restarts = 0
+        self.last_flush_ms = 0.0
+
+    def start(self) -> None:
+        """Start the supervised writer on the running event loop"""
+        if self._supervisor is None or self._supervisor.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._accepting = True
+            self._supervisor = asyncio.create_task(self._supervise())
+            log_with_context(logger, 'info', 'Conversation writer started')
+
+    async def enqueue(self, rows: List[Dict[str, Any]]) -> None:
+        """Queue rows for persistence; waits only when the queue is full (backpressure)"""
+        if not self._accepting:
+            await self.store.append_messages(rows)
+            return
+        self.start()
+
+        for row in rows:
+            self.pending_sessions[row['session_id']] += 1
+            self._queued[row['session_id'], row.get('user_id')] += 1
+        self.enqueued += len(rows)
+
+        if self._queue.full():
+            self.blocked_enqueues += 1
+            wait_start = time.perf_counter()
+            await self._queue.put(rows)
+            self.enqueue_wait_time += time.perf_counter() - wait_start
+        else:
+            self._queue.put_nowait(rows)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _supervise(self) -> None:
+        """Keep the writer loop alive, restarting it after unexpected failures"""
+        while True:
+            try:
+                await self._write_loop()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.worker_restarts += 1
+                log_with_context(logger, 'error', f'Conversation writer crashed, restarting: {str(e)}')
+                await asyncio.sleep(1)
+
+    async def _next_batch(self) -> Tuple[List[Dict[str, Any]], bool]:
+        """Wait for rows, then linger briefly to group more into the same batch"""
+        item = await self._queue.get()
+        if item is None:
+            return [], True
+        rows = list(item)
+        if len(rows) + self._queue.qsize() < self.batch_size:
+            try:
+                await asyncio.sleep(self.flush_interval)
+            except asyncio.CancelledError:
+                self._finish(self._take(rows), stored=False)
+                raise
+        while len(rows) < self.batch_size and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                return rows, True
+            rows.extend(item)
+        return rows, False
+
+    async def _write_loop(self) -> None:
+        """Drain the queue in batches until the stop sentinel arrives"""
+        while True:
+            rows, done = await self._next_batch()
+            if rows:
+                await self._write_batch(rows)
+            if done:
+                return
+
+    def discard_session(self, session_id: str, user_id: Optional[str]) -> None:
+        """Drop the user's rows still queued for a session being deleted, so writing them can't re-create it.
+        Call before submitting the delete: batches already taken are then ahead of it in the store."""
+        queued = self._queued[session_id, user_id]
+        if queued:
+            self._discard[session_id, user_id] = queued
+
+    def _take(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Mark rows as taken off the queue and return those whose session was not deleted meanwhile"""
+        kept = []
+        for row in rows:
+            key = row['session_id'], row.get('user_id')
+            self._queued[key] -= 1
+            if self._queued[key] <= 0:
+                del self._queued[key]
+            if self._discard[key] > 0:
+                self._discard[key] -= 1
+                if self._discard[key] <= 0:
+                    del self._discard[key]
+                self.discarded += 1
+                self._settle(row)
+            else:
+                kept.append(row)
+        return kept
+
+    def _settle(self, row: Dict[str, Any]) -> None:
+        session_id = row['session_id']
+        self.pending_sessions[session_id] -= 1
+        if self.pending_sessions[session_id] <= 0:
+            del self.pending_sessions[session_id]
+
+    def _finish(self, rows: List[Dict[str, Any]], stored: bool) -> None:
+        """Settle taken rows, counting them as failed unless they were stored"""
+        if not stored:
+            self.failed += len(rows)
+        for row in rows:
+            self._settle(row)
+
+    async def _write_batch(self, rows: List[Dict[str, Any]]) -> None:
+        """Write one batch in a single store transaction, retrying transient failures"""
+        rows = self._take(rows)
+        if not rows:
+            return
+        start = time.perf_counter()
+        stored = False
+        try:
+            for attempt in range(3):
+                try:
+                    await self.store.append_messages(rows)
+                    stored = True
+                    self.written += len(rows)
+                    self.batches += 1
+                    break
+                except Exception as e:
+                    if attempt == 2:
+                        log_with_context(logger, 'error', f'Dropping conversation batch after retries: {str(e)}', rows=len(rows))
+                    else:
+                        await asyncio.sleep(0.1 * (attempt + 1))
+        finally:
+            # Also runs when the worker is cancelled or crashes mid-write, so the counts never leak
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self._finish(rows, stored)
+
+    async def stop(self) -> None:
+        """Stop accepting rows and durably flush everything still queued"""
+        self._accepting = False
+        if self._supervisor is not None and not self._supervisor.done():
+            # The worker drains everything ahead of the sentinel, then exits
+            await self._queue.put(None)
+            await self._supervisor
+        self._supervisor = None
+        log_with_context(logger, 'info', 'Conversation writer stopped', written=self.written, failed=self.failed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth, batching and backpressure metrics"""
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue': self.max_queue,
+            'max_depth': self.max_depth,
+            'enqueued_rows': self.enqueued,
+            'written_rows': self.written,
+            'failed_rows': self.failed,
+            'discarded_rows': self.discarded,
+            'batches': self.batches,
+            'avg_batch_rows': round(self.written / self.batches, 2) if self.batches else 0,
+            'blocked_enqueues': self.blocked_enqueues,
+            'enqueue_wait_ms': round(self.enqueue_wait_time * 1000, 2),
+            'pending_sessions': len(self.pending_sessions),
+            'worker_restarts': self.worker_restarts,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
+
+# Global conversation writer
+conversation_writer = ConversationWriter(
+    session_store,
+    max_queue=settings.persistence_queue_size,
+    batch_size=settings.persistence_batch_size,
+    flush_interval=settings.persistence_flush_interval
+)
+performance_monitor.register_component('conversation_writer', conversation_writer.get_stats)
@@ -0,0 +1,174 @@
+import html
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from src.config.config import settings
+from src.models.schemas import ExportFormat
+from src.services.session_store import SessionStore, session_store, strip_html
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.MARKDOWN: "text/markdown; charset=utf-8",
+    ExportFormat.HTML: "text/html; charset=utf-8",
+}
+
+FILE_EXTENSIONS = {
+    ExportFormat.NDJSON: "ndjson",
+    ExportFormat.MARKDOWN: "md",
+    ExportFormat.HTML: "html",
+}
+
+HTML_HEADER = (
+    '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{title}</title>'
+    '<style>body{{font-family:sans-serif;max-width:50em;margin:auto}}'
+    '.message{{white-space:pre-wrap;margin:1em 0}}.role{{font-weight:bold}}</style></head><body>\n'
+)
+
+ExportRow = Tuple[int, str, str, float]
+
+class ExportService:
+    """Stream session history as NDJSON, Markdown or HTML in bounded chunks.
+
+    Rows are read from the session store one chunk at a time and formatted as
+    they go, so memory use does not depend on history size. Every message carries
+    its session id and sequence number; exports resume after a given position, and a
+resumed export repeats the document and session headings so each part stands alone.
+    """
+
+    def __init__(self, store: SessionStore, chunk_size: int):
+        self.store = store
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _timestamp(created_at: float) -> str:
+        return datetime.fromtimestamp(created_at).isoformat()
+
+    def _document_start(self, export_format: ExportFormat, title: str) -> str:
+        if export_format == ExportFormat.MARKDOWN:
+            return f"# {title}\n\n"
+        if export_format == ExportFormat.HTML:
+            return HTML_HEADER.format(title=html.escape(title)) + f"<h1>{html.escape(title)}</h1>\n"
+        return ""
+
+    def _document_end(self, export_format: ExportFormat) -> str:
+        return "</body></html>\n" if export_format == ExportFormat.HTML else ""
+
+    def _session_start(self, export_format: ExportFormat, session_id: str, title: Optional[str]) -> str:
+        heading = title or session_id
+        if export_format == ExportFormat.MARKDOWN:
+            return f"## {strip_html(heading)}\n\n"
+        if export_format == ExportFormat.HTML:
+            return f'<h2 id="{html.escape(session_id)}">{html.escape(strip_html(heading))}</h2>\n'
+        return ""
+
+    def _format_rows(self, export_format: ExportFormat, session_id: str, rows: List[ExportRow]) -> str:
+        """Format one chunk of message rows"""
+        parts = []
+        for seq, role, content, created_at in rows:
+            if export_format == ExportFormat.NDJSON:
+                parts.append(json.dumps({
+                    "session_id": session_id, "seq": seq, "role": role,
+                    "content": content, "created_at": self._timestamp(created_at)
+                }) + "\n")
+            elif export_format == ExportFormat.MARKDOWN:
+                parts.append(f"**{role.capitalize()}** ({self._timestamp(created_at)}):\n\n{strip_html(content)}\n\n")
+            else:
+                parts.append(
+                    f'<div class="message {role}" data-seq="{seq}"><div class="role">{role.capitalize()} '
+                    f'<time>{self._timestamp(created_at)}</time></div>{html.escape(strip_html(content))}</div>\n'
+                )
+        return "".join(parts)
+
+    async def _session_rows(self, user_id: Optional[str], session_id: str,
+                            after_seq: int) -> AsyncIterator[List[ExportRow]]:
+        """Yield a session's rows chunk by chunk"""
+        while True:
+            rows = await self.store.get_export_rows(user_id, session_id, after_seq, self.chunk_size)
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self.chunk_size:
+                return
+            after_seq = rows[-1][0]
+
+    async def open_session_export(self, user_id: Optional[str], session_id: str, export_format: ExportFormat,
+                                  after_seq: int = 0) -> Optional[AsyncIterator[str]]:
+        """Get a text stream for one session, or None if the user does not own it"""
+        first_rows = await self.store.get_export_rows(user_id, session_id, after_seq, self.chunk_size)
+        if first_rows is None:
+            return None
+
+        async def generate() -> AsyncIterator[str]:
+            yield self._document_start(export_format, f"Chat session {session_id}")
+            if first_rows:
+                yield self._format_rows(export_format, session_id, first_rows)
+                if len(first_rows) == self.chunk_size:
+                    async for rows in self._session_rows(user_id, session_id, first_rows[-1][0]):
+                        yield self._format_rows(export_format, session_id, rows)
+            yield self._document_end(export_format)
+
+        return generate()
+
+    async def open_user_export(self, user_id: Optional[str], export_format: ExportFormat,
+                               after: Optional[str] = None) -> AsyncIterator[str]:
+        """Get a text stream of all the user's sessions, oldest first.
+        after is a "session_id:seq" position; raises ValueError if it is not valid for this user."""
+        resume: Optional[Tuple[str, int, Optional[str], float]] = None
+        if after:
+            session_id, _, seq = after.rpartition(':')
+            session = await self.store.get_export_session(user_id, session_id) if session_id else None
+            if session is None or not seq.isdigit():
+                raise ValueError("Invalid export position")
+            resume = (session_id, int(seq), *session)
+
+        async def generate() -> AsyncIterator[str]:
+            yield self._document_start(export_format, "Chat history")
+            position = None
+            if resume is not None:
+                session_id, after_seq, title, created_at = resume
+                yield self._session_start(export_format, session_id, title)
+                async for rows in self._session_rows(user_id, session_id, after_seq):
+                    yield self._format_rows(export_format, session_id, rows)
+                position = (created_at, session_id)
+
+            while True:
+                sessions = await self.store.list_export_sessions(user_id, position, self.chunk_size)
+                for session_id, title, created_at in sessions:
+                    yield self._session_start(export_format, session_id, title)
+                    async for rows in self._session_rows(user_id, session_id, 0):
+                        yield self._format_rows(export_format, session_id, rows)
+                if len(sessions) < self.chunk_size:
+                    break
+                position = (sessions[-1][2], sessions[-1][0])
+            yield self._document_end(export_format)
+
+        return generate()
+
+    @staticmethod
+    async def encode(chunks: AsyncIterator[str], gzip: bool = False) -> AsyncIterator[bytes]:
+        """Encode a text stream as UTF-8, gzip-compressing it on the fly if requested"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            data = chunk.encode()
+            if compressor is None:
+                yield data
+            else:
+                data = compressor.compress(data)
+                if data:
+                    yield data
+        if compressor is not None:
+            yield compressor.flush()
+
+    @staticmethod
+    def media_type(export_format: ExportFormat, gzip: bool = False) -> str:
+        return "application/gzip" if gzip else MEDIA_TYPES[export_format]
+
+    @staticmethod
+    def filename(name: str, export_format: ExportFormat, gzip: bool = False) -> str:
+        return f"{name}.{FILE_EXTENSIONS[export_format]}" + (".gz" if gzip else "")
+
+# Global export service
+export_service = ExportService(session_store, settings.export_chunk_size)
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Deque, Dict, List, Tuple
+from src.config.config import settings
+from src.utils.performance_monitor import performance_monitor
+
+class GenerationPriority(IntEnum):
+    """Scheduling class of a model generation, most latency-sensitive first"""
+    INTERACTIVE = 0
+    STANDARD = 1
+    BATCH = 2
+
+# Share of model capacity each class gets under contention
+PRIORITY_WEIGHTS = {
+    GenerationPriority.INTERACTIVE: 4,
+    GenerationPriority.STANDARD: 2,
+    GenerationPriority.BATCH: 1,
+}
+
+# Idle users whose scheduling stats are kept for reporting
+MAX_TRACKED_USERS = 1000
+
+class GenerationWaiter:
+    """One generation waiting for a slot"""
+
+    __slots__ = ('priority', 'future', 'enqueued')
+
+    def __init__(self, priority: GenerationPriority):
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+class UserQueue:
+    """Waiting generations, running count and wait statistics of one user"""
+
+    __slots__ = ('waiting', 'active', 'finish', 'ready', 'served', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.waiting: List[Tuple[int, int, GenerationWaiter]] = []
+        self.active = 0
+        self.finish = 0.0
+        self.ready = False
+        self.served = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class GenerationScheduler:
+    """Admission scheduler in front of model dispatch.
+
+    At most max_concurrent generations run at once and at most max_per_user for
+    any one user. Waiting generations are served by weighted fair queuing across
+    users: each user with an eligible request holds one entry in a ready heap,
+    tagged with a virtual finish time that advances by 1 / weight of its class,
+    so a user flooding requests waits behind everyone else's turns and
+    interactive streams get a larger share than non-streaming and batch calls.
+    Within a user, higher-priority requests go first.
+    """
+
+    def __init__(self, max_concurrent: int, max_per_user: int):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self._users: "OrderedDict[str, UserQueue]" = OrderedDict()
+        self._ready: List[Tuple[float, int, str]] = []
+        self._sequence = itertools.count()
+        self.active = 0
+        self.waiting = 0
+        self.virtual_time = 0.0
+
+        self.dispatched = {priority: 0 for priority in GenerationPriority}
+        self.waits: Dict[GenerationPriority, Deque[float]] = {
+            priority: deque(maxlen=1000) for priority in GenerationPriority
+        }
+
+    def _user(self, identity: str) -> UserQueue:
+        user = self._users.get(identity)
+        if user is None:
+            user = self._users[identity] = UserQueue()
+            self._trim_users()
+        else:
+            self._users.move_to_end(identity)
+        return user
+
+    def _trim_users(self) -> None:
+        """Forget the least recently seen idle users beyond the tracking limit"""
+        # The newest entry is the user being admitted
+        for identity in list(self._users)[:-1]:
+            if len(self._users) <= MAX_TRACKED_USERS:
+                return
+            user = self._users[identity]
+            # A ready user still has an entry in the fair queue, even if its waiter was withdrawn
+            if not user.active and not user.waiting and not user.ready:
+                del self._users[identity]
+
+    def _mark_ready(self, identity: str, user: UserQueue) -> None:
+        """Give a user with an eligible request its next place in the fair queue"""
+        if user.ready or not user.waiting or user.active >= self.max_per_user:
+            return
+        priority = user.waiting[0][0]
+        tag = max(self.virtual_time, user.finish) + 1 / PRIORITY_WEIGHTS[priority]
+        heapq.heappush(self._ready, (tag, next(self._sequence), identity))
+        user.ready = True
+
+    def _dispatch(self) -> None:
+        """Start waiting generations while there is capacity"""
+        while self.active < self.max_concurrent and self._ready:
+            tag, _, identity = heapq.heappop(self._ready)
+            user = self._users.get(identity)
+            if user is None:
+                continue
+            user.ready = False
+            if not user.waiting or user.active >= self.max_per_user:
+                continue
+
+            _, _, waiter = heapq.heappop(user.waiting)
+            self.waiting -= 1
+            if waiter.future.done():
+                # Cancelled before its task could withdraw it: skip without using a slot
+                self._mark_ready(identity, user)
+                continue
+            self.virtual_time = tag
+            user.finish = tag
+            self._start(user, waiter.priority, time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(None)
+            self._mark_ready(identity, user)
+
+    def _start(self, user: UserQueue, priority: GenerationPriority, waited: float) -> None:
+        user.active += 1
+        self.active += 1
+        user.served += 1
+        user.wait_total += waited
+        user.wait_max = max(user.wait_max, waited)
+        self.dispatched[priority] += 1
+        self.waits[priority].append(waited)
+
+    def _release(self, identity: str) -> None:
+        user = self._users[identity]
+        user.active -= 1
+        self.active -= 1
+        self._mark_ready(identity, user)
+        self._dispatch()
+
+    def _withdraw(self, identity: str, waiter: GenerationWaiter) -> None:
+        """Remove a waiting generation whose caller went away"""
+        user = self._users[identity]
+        for index, entry in enumerate(user.waiting):
+            if entry[2] is waiter:
+                user.waiting[index] = user.waiting[-1]
+                user.waiting.pop()
+                heapq.heapify(user.waiting)
+                self.waiting -= 1
+                break
+
+    @asynccontextmanager
+    async def slot(self, identity: str, priority: GenerationPriority) -> AsyncIterator[None]:
+        """Hold a generation slot for a user, waiting for a fair turn when at capacity"""
+        user = self._user(identity)
+        if self.active < self.max_concurrent and not self._ready and not self.waiting \
+                and user.active < self.max_per_user:
+            # Nobody is waiting: start at once, still advancing the user's virtual time
+            user.finish = max(self.virtual_time, user.finish) + 1 / PRIORITY_WEIGHTS[priority]
+            self._start(user, priority, 0.0)
+        else:
+            waiter = GenerationWaiter(priority)
+            heapq.heappush(user.waiting, (priority, next(self._sequence), waiter))
+            self.waiting += 1
+            self._mark_ready(identity, user)
+            self._dispatch()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Granted just as the caller was cancelled
+                    self._release(identity)
+                else:
+                    # Gone already if the dispatcher skipped it after the cancel
+                    self._withdraw(identity, waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release(identity)
+
+    def get_user_stats(self, identity: str) -> Dict[str, Any]:
+        """Get one user's running and waiting generations and wait times"""
+        user = self._users.get(identity)
+        if user is None:
+            return {'active': 0, 'waiting': 0, 'served': 0, 'avg_wait_ms': 0, 'max_wait_ms': 0}
+        return {
+            'active': user.active,
+            'waiting': len(user.waiting),
+            'served': user.served,
+            'avg_wait_ms': round(user.wait_total / user.served * 1000, 1) if user.served else 0,
+            'max_wait_ms': round(user.wait_max * 1000, 1)
+        }
+
+    @staticmethod
+    def _percentile(values: List[float], fraction: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 1) if values else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get capacity use, wait time percentiles per class and backlog counts"""
+        waits = {}
+        for priority, recent in self.waits.items():
+            values = sorted(recent)
+            waits[priority.name.lower()] = {
+                'dispatched': self.dispatched[priority],
+                'p50_wait_ms': self._percentile(values, 0.5),
+                'p99_wait_ms': self._percentile(values, 0.99)
+            }
+        # Counts only: identities are user ids and client IPs, and the metrics are public
+        backlogs = [len(user.waiting) for user in self._users.values() if user.waiting]
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'max_concurrent': self.max_concurrent,
+            'max_per_user': self.max_per_user,
+            'classes': waits,
+            'backlogged_users': len(backlogs),
+            'max_user_backlog': max(backlogs, default=0)
+        }
+
+# Global generation scheduler
+generation_scheduler = GenerationScheduler(
+    max_concurrent=settings.max_concurrent_requests,
+    max_per_user=settings.max_concurrent_generations_per_user
+)
+performance_monitor.register_component('generation_scheduler', generation_scheduler.get_stats)
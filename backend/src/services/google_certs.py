@@ -0,0 +1,144 @@
+import asyncio
+import re
+import time
+from typing import Any, Dict, Optional
+import httpx
+from src.config.config import settings
+from src.utils.client_registry import client_registry
+from src.utils.logger import get_logger, log_with_context
+from src.utils.performance_monitor import performance_monitor
+
+logger = get_logger(__name__)
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+class GoogleCertsCache:
+    """Google's ID token signing certificates, shared by all logins.
+
+    Certificates are fetched over the shared HTTP client and kept for the response's Cache-Control max-age. A background
+    task refreshes them shortly before they expire, so logins never wait on
+    Google; concurrent misses share a single fetch. A token signed with an
+    unknown key id triggers at most one early refetch per interval, to pick up
+    rotated keys without letting forged key ids drive requests at Google. If a
+    refresh fails, the previous certificates stay in use.
+    """
+
+    def __init__(self, url: str, default_max_age: int, refresh_margin: int,
+                 unknown_kid_interval: int, timeout: float):
+        self.url = url
+        self.default_max_age = default_max_age
+        self.refresh_margin = refresh_margin
+        self.unknown_kid_interval = unknown_kid_interval
+        self.timeout = timeout
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._generation = 0
+        self._last_unknown_kid_fetch = float('-inf')
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.background_refreshes = 0
+        self.unknown_kid_refetches = 0
+        self.lookups = 0
+
+    def _max_age(self, response: httpx.Response) -> int:
+        """Get how long a certs response stays fresh, net of time spent in upstream caches"""
+        match = MAX_AGE_PATTERN.search(response.headers.get('Cache-Control', ''))
+        if match is None:
+            return self.default_max_age
+        age = response.headers.get('Age', '0')
+        return max(0, int(match.group(1)) - (int(age) if age.isdigit() else 0))
+
+    async def _refresh(self, seen_generation: int) -> bool:
+        """Fetch the certificates unless another caller already did since seen_generation.
+        Returns False if the fetch failed and the previous certificates are still in use."""
+        async with self._lock:
+            if self._generation != seen_generation:
+                return True
+            self.fetches += 1
+            try:
+                response = await client_registry.http.get(self.url, timeout=self.timeout)
+                response.raise_for_status()
+                certs = response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                self.fetch_errors += 1
+                log_with_context(logger, 'error', f'Error fetching Google certs: {str(e)}', url=self.url)
+                if not self._certs:
+                    raise
+                return False
+
+            max_age = self._max_age(response)
+            self._certs = certs
+            self._expires_at = time.monotonic() + max_age
+            self._generation += 1
+            self._schedule_refresh(max(1, max_age - self.refresh_margin))
+            return True
+
+    def _schedule_refresh(self, delay: float) -> None:
+        """Replace any pending background refresh with one after delay seconds"""
+        task = self._refresh_task
+        if task is not None and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+        self._refresh_task = asyncio.create_task(self._refresh_later(delay))
+
+    async def _refresh_later(self, delay: float) -> None:
+        """Refresh the certificates before they expire"""
+        await asyncio.sleep(delay)
+        self.background_refreshes += 1
+        if not await self._refresh(self._generation):
+            # Keep serving the current certificates and try again shortly
+            self._schedule_refresh(max(1, self.refresh_margin / 4))
+
+    async def get_key(self, kid: Optional[str]) -> Optional[str]:
+        """Get the certificate for a key id, refetching once if the id is unknown"""
+        self.lookups += 1
+        if not self._certs or (time.monotonic() >= self._expires_at and
+                               (self._refresh_task is None or self._refresh_task.done())):
+            # Past expiry a pending background refresh keeps retrying, so serve the stale certs meanwhile
+            await self._refresh(self._generation)
+
+        cert = self._certs.get(kid)
+        now = time.monotonic()
+        if cert is None and kid and now - self._last_unknown_kid_fetch >= self.unknown_kid_interval:
+            self._last_unknown_kid_fetch = now
+            self.unknown_kid_refetches += 1
+            await self._refresh(self._generation)
+            cert = self._certs.get(kid)
+        return cert
+
+    async def warm(self) -> None:
+        """Fetch the certificates ahead of the first login"""
+        if not self._certs:
+            await self._refresh(self._generation)
+
+    async def close(self) -> None:
+        """Stop background refreshes"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cached key count, freshness and fetch statistics"""
+        return {
+            'keys': len(self._certs),
+            'expires_in': round(max(0.0, self._expires_at - time.monotonic()), 1),
+            'lookups': self.lookups,
+            'fetches': self.fetches,
+            'fetch_errors': self.fetch_errors,
+            'background_refreshes': self.background_refreshes,
+            'unknown_kid_refetches': self.unknown_kid_refetches
+        }
+
+# Global Google certs cache
+google_certs = GoogleCertsCache(
+    url=settings.google_certs_url,
+    default_max_age=settings.google_certs_default_max_age,
+    refresh_margin=settings.google_certs_refresh_margin,
+    unknown_kid_interval=settings.google_certs_unknown_kid_interval,
+    timeout=settings.google_certs_timeout
+)
+performance_monitor.register_component('google_certs', google_certs.get_stats)
+if settings.google_verify_signature:
+    client_registry.add_warmer('google_certs', google_certs.warm)
@@ -0,0 +1,693 @@
+import asyncio
+import html
+import queue
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.config.config import settings
+from src.models.records import MessageRecord
+from src.utils.logger import get_logger, log_with_context
+
+logger = get_logger(__name__)
+
+# Anonymous sessions are stored under an empty user id
+ANONYMOUS_USER = ""
+
+# Snippet highlight markers, swapped for <mark> tags after the snippet is HTML-escaped
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+def session_title(content: str) -> str:
+    """Derive a session title from its first assistant message"""
+    return content[:50] + "..." if len(content) > 50 else content
+
+def strip_html(content: str) -> str:
+    """Reduce formatted message HTML to plain text for indexing and export"""
+    text = re.sub(r'<br\s*/?>|</(?:p|div|li|h[1-6]|pre)>', '\n', content)
+    return html.unescape(re.sub(r'<[^>]+>', '', text))
+
+def build_match_query(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query requiring every term"""
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms)
+
+class SessionStore(ABC):
+    """Storage interface for chat sessions and their messages"""
+
+    @abstractmethod
+    async def create_session(self, user_id: Optional[str], session_id: str) -> None:
+        """Create an empty session owned by the user"""
+
+    @abstractmethod
+    async def append_messages(self, rows: List[Dict[str, Any]]) -> None:
+        """Append message rows (session_id, user_id, role, content, message_id, payload)"""
+
+    @abstractmethod
+    async def get_session_messages(self, user_id: Optional[str], session_id: str) -> List[str]:
+        """Get stored assistant message payloads (JSON) for a session in order"""
+
+    @abstractmethod
+    async def get_user_sessions(self, user_id: Optional[str]) -> Dict[str, List[str]]:
+        """Get assistant message payloads for every session of a user"""
+
+    @abstractmethod
+    async def list_session_summaries(self, user_id: Optional[str], limit: Optional[int] = None,
+                                     before: Optional[Tuple[float, str]] = None,
+                                     after: Optional[Tuple[float, str]] = None) -> List[Dict[str, Any]]:
+        """Get session summaries (title, mode, timestamps, message count), most recently updated first.
+        before/after are (updated_at, session_id) positions to page from."""
+
+    @abstractmethod
+    async def count_sessions(self, user_id: Optional[str]) -> int:
+        """Count a user's non-empty sessions"""
+
+    @abstractmethod
+    async def get_message_page(self, user_id: Optional[str], session_id: str, limit: Optional[int] = None,
+                               before_seq: Optional[int] = None,
+                               after_seq: Optional[int] = None) -> Optional[Tuple[int, List[Tuple[int, str]]]]:
+        """Get (total, [(seq, payload)]) for assistant messages in seq order, or None if not owned"""
+
+    @abstractmethod
+    async def get_history(self, session_id: str, limit: int) -> List[MessageRecord]:
+        """Get the most recent turns of a session as compact records, oldest first"""
+
+    @abstractmethod
+    async def get_changes(self, user_id: Optional[str], since: int, limit: int) -> Dict[str, Any]:
+        """Get sessions, message payloads and deleted session ids changed after a per-user version"""
+
+    @abstractmethod
+    async def get_export_rows(self, user_id: Optional[str], session_id: str, after_seq: int,
+                              limit: int) -> Optional[List[Tuple[int, str, str, float]]]:
+        """Get (seq, role, content, created_at) rows after a sequence number, or None if not owned"""
+
+    @abstractmethod
+    async def list_export_sessions(self, user_id: Optional[str], after: Optional[Tuple[float, str]],
+                                   limit: int) -> List[Tuple[str, Optional[str], float]]:
+        """Get (session_id, title, created_at) for a user's sessions, oldest first, after a position"""
+
+    @abstractmethod
+    async def get_export_session(self, user_id: Optional[str], session_id: str) -> Optional[Tuple[Optional[str], float]]:
+        """Get (title, created_at) for a user's session, or None if not owned"""
+
+    @abstractmethod
+    async def index_messages(self, batch_size: int) -> int:
+        """Add not yet indexed messages to the search index and return how many were indexed"""
+
+    @abstractmethod
+    async def search(self, user_id: Optional[str], query: str, limit: int) -> List[Dict[str, Any]]:
+        """Full-text search a user's messages, best matches first"""
+
+    @abstractmethod
+    async def delete_session(self, user_id: Optional[str], session_id: str) -> bool:
+        """Delete a user's session and its messages; returns False if the user doesn't own it"""
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Finish outstanding work and release the storage"""
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite (WAL) session store driven by a dedicated thread with batched commits"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            title TEXT,
+            mode TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_updated ON sessions (user_id, updated_at);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            message_id TEXT,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            payload TEXT,
+            created_at REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_session_seq ON messages (session_id, seq);
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS session_tombstones (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            deleted_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tombstones_user_version ON session_tombstones (user_id, version);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+            content,
+            session_id UNINDEXED,
+            seq UNINDEXED,
+            role UNINDEXED,
+            created_at UNINDEXED,
+            tokenize = 'porter unicode61'
+        );
+        CREATE TABLE IF NOT EXISTS search_users (
+            user_no INTEGER PRIMARY KEY,
+            user_id TEXT UNIQUE NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS search_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_message_id INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO search_state (id, last_message_id) VALUES (1, 0);
+    """
+
+    # Created after migration, since older databases lack the version columns
+    SCHEMA_VERSION_INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_version ON sessions (user_id, version);
+    """
+
+    # Statements are kept as constants so sqlite3's statement cache reuses them prepared
+    SQL_INSERT_SESSION = "INSERT OR IGNORE INTO sessions (session_id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)"
+    SQL_BUMP_VERSION = (
+        "INSERT INTO user_versions (user_id, version) VALUES (?, 1) "
+        "ON CONFLICT (user_id) DO UPDATE SET version = version + 1 RETURNING version"
+    )
+    SQL_RESERVE_VERSIONS = (
+        "INSERT INTO user_versions (user_id, version) VALUES (?, ?) "
+        "ON CONFLICT (user_id) DO UPDATE SET version = version + excluded.version RETURNING version"
+    )
+    SQL_USER_VERSION = "SELECT version FROM user_versions WHERE user_id = ?"
+    SQL_CHANGED_MESSAGES = (
+        "SELECT m.session_id, m.seq, m.version, m.payload FROM sessions s "
+        "JOIN messages m ON m.session_id = s.session_id "
+        "WHERE s.user_id = ? AND s.version > ? AND m.version > ? AND m.payload IS NOT NULL "
+        "ORDER BY m.version LIMIT ?"
+    )
+    SQL_CHANGED_SESSIONS = (
+        "SELECT session_id, title, mode, created_at, updated_at, message_count FROM sessions "
+        "WHERE user_id = ? AND version > ? AND version <= ? AND message_count > 0 ORDER BY version"
+    )
+    SQL_CHANGED_TOMBSTONES = (
+        "SELECT session_id FROM session_tombstones WHERE user_id = ? AND version > ? AND version <= ? ORDER BY version"
+    )
+    SQL_INSERT_TOMBSTONE = (
+        "INSERT OR REPLACE INTO session_tombstones (session_id, user_id, version, deleted_at) VALUES (?, ?, ?, ?)"
+    )
+    SQL_UPDATE_SUMMARY = (
+        "UPDATE sessions SET updated_at = ?, version = ?, message_count = message_count + ?, "
+        "title = COALESCE(title, ?), mode = COALESCE(mode, ?) WHERE session_id = ?"
+    )
+    SQL_SUMMARY_COLUMNS = "SELECT session_id, title, mode, created_at, updated_at, message_count FROM sessions "
+    SQL_LIST_SUMMARIES = (
+        SQL_SUMMARY_COLUMNS +
+        "WHERE user_id = ? AND message_count > 0 ORDER BY updated_at DESC, session_id DESC LIMIT ?"
+    )
+    SQL_LIST_SUMMARIES_BEFORE = (
+        SQL_SUMMARY_COLUMNS +
+        "WHERE user_id = ? AND message_count > 0 AND (updated_at < ? OR (updated_at = ? AND session_id < ?)) "
+        "ORDER BY updated_at DESC, session_id DESC LIMIT ?"
+    )
+    SQL_LIST_SUMMARIES_AFTER = (
+        SQL_SUMMARY_COLUMNS +
+        "WHERE user_id = ? AND message_count > 0 AND (updated_at > ? OR (updated_at = ? AND session_id > ?)) "
+        "ORDER BY updated_at ASC, session_id ASC LIMIT ?"
+    )
+    SQL_COUNT_SESSIONS = "SELECT COUNT(*) FROM sessions WHERE user_id = ? AND message_count > 0"
+    SQL_MESSAGE_COUNT = "SELECT message_count FROM sessions WHERE session_id = ? AND user_id = ?"
+    SQL_PAGE_FIRST = (
+        "SELECT seq, payload FROM messages WHERE session_id = ? AND payload IS NOT NULL ORDER BY seq LIMIT ?"
+    )
+    SQL_PAGE_BEFORE = (
+        "SELECT seq, payload FROM messages WHERE session_id = ? AND seq < ? AND payload IS NOT NULL "
+        "ORDER BY seq DESC LIMIT ?"
+    )
+    SQL_PAGE_AFTER = (
+        "SELECT seq, payload FROM messages WHERE session_id = ? AND seq > ? AND payload IS NOT NULL "
+        "ORDER BY seq LIMIT ?"
+    )
+    SQL_SEARCH_CURSOR = "SELECT last_message_id FROM search_state WHERE id = 1"
+    SQL_UNINDEXED_MESSAGES = (
+        "SELECT m.id, m.content, s.user_id, m.session_id, m.seq, m.role, m.created_at FROM messages m "
+        "JOIN sessions s ON s.session_id = m.session_id WHERE m.id > ? ORDER BY m.id LIMIT ?"
+    )
+    # Index rowids are (user number << 32) | message id, so each user's documents form one rowid
+    # range that FTS5 can seek to instead of filtering every match by owner
+    SQL_INSERT_SEARCH_USER = "INSERT OR IGNORE INTO search_users (user_id) VALUES (?)"
+    SQL_SEARCH_USER = "SELECT user_no FROM search_users WHERE user_id = ?"
+    SQL_INDEX_MESSAGE = (
+        "INSERT INTO messages_fts (rowid, content, session_id, seq, role, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+    )
+    SQL_SET_SEARCH_CURSOR = "UPDATE search_state SET last_message_id = ? WHERE id = 1"
+    # Deleting the newest rows lets SQLite reuse their ids, so never leave the cursor past the max
+    SQL_CLAMP_SEARCH_CURSOR = (
+        "UPDATE search_state SET last_message_id = MIN(last_message_id, (SELECT COALESCE(MAX(id), 0) FROM messages)) "
+        "WHERE id = 1"
+    )
+    SQL_UNINDEX_SESSION = (
+        "DELETE FROM messages_fts WHERE rowid IN (SELECT (? << 32) | id FROM messages WHERE session_id = ?)"
+    )
+    # BM25 ranks the user's newest matches only, which bounds the work for very common terms
+    SQL_SEARCH_WINDOW = (
+        "SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? AND rowid BETWEEN ? AND ? "
+        "ORDER BY rowid DESC LIMIT 1 OFFSET ?"
+    )
+    SQL_SEARCH = (
+        "SELECT session_id, seq, role, created_at, snippet(messages_fts, 0, ?, ?, '...', 16), rank "
+        "FROM messages_fts WHERE messages_fts MATCH ? AND rowid BETWEEN ? AND ? ORDER BY rank LIMIT ?"
+    )
+    SQL_EXPORT_ROWS = (
+        "SELECT seq, role, content, created_at FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?"
+    )
+    SQL_EXPORT_SESSIONS = (
+        "SELECT session_id, title, created_at FROM sessions WHERE user_id = ? AND message_count > 0 "
+        "AND (created_at > ? OR (created_at = ? AND session_id > ?)) ORDER BY created_at, session_id LIMIT ?"
+    )
+    SQL_EXPORT_SESSION = "SELECT title, created_at FROM sessions WHERE session_id = ? AND user_id = ?"
+    SQL_SESSION_OWNER = "SELECT user_id FROM sessions WHERE session_id = ?"
+    SQL_LAST_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM messages WHERE session_id = ?"
+    SQL_INSERT_MESSAGE = (
+        "INSERT INTO messages (session_id, seq, message_id, role, content, payload, created_at, version) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    SQL_SESSION_OWNED = "SELECT 1 FROM sessions WHERE session_id = ? AND user_id = ?"
+    SQL_SESSION_PAYLOADS = (
+        "SELECT payload FROM messages WHERE session_id = ? AND payload IS NOT NULL ORDER BY seq"
+    )
+    SQL_USER_PAYLOADS = (
+        "SELECT s.session_id, m.payload FROM sessions s "
+        "LEFT JOIN messages m ON m.session_id = s.session_id AND m.payload IS NOT NULL "
+        "WHERE s.user_id = ? ORDER BY s.updated_at DESC, m.seq"
+    )
+    SQL_HISTORY = "SELECT role, content, created_at FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?"
+    SQL_DELETE_MESSAGES = "DELETE FROM messages WHERE session_id = ?"
+    SQL_DELETE_SESSION = "DELETE FROM sessions WHERE session_id = ? AND user_id = ?"
+
+    def __init__(self, path: str, max_batch: int = 256, search_candidates: int = 1000):
+        self.path = path
+        self.max_batch = max_batch
+        self.search_candidates = search_candidates
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="session-store", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the connection owned by the store thread"""
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.executescript(self.SCHEMA)
+        self._migrate(conn)
+        self._migrate_versions(conn)
+        conn.executescript(self.SCHEMA_VERSION_INDEXES)
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        """Add and backfill session summary columns on databases created before they existed"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if 'message_count' in columns:
+            return
+        conn.executescript("""
+            BEGIN;
+            ALTER TABLE sessions ADD COLUMN title TEXT;
+            ALTER TABLE sessions ADD COLUMN mode TEXT;
+            ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0;
+            UPDATE sessions SET
+                message_count = (SELECT COUNT(*) FROM messages m
+                                 WHERE m.session_id = sessions.session_id AND m.payload IS NOT NULL),
+                title = (SELECT CASE WHEN length(m.content) > 50 THEN substr(m.content, 1, 50) || '...' ELSE m.content END
+                         FROM messages m WHERE m.session_id = sessions.session_id AND m.payload IS NOT NULL
+                         ORDER BY m.seq LIMIT 1),
+                mode = (SELECT json_extract(m.payload, '$.mode')
+                        FROM messages m WHERE m.session_id = sessions.session_id AND m.payload IS NOT NULL
+                        ORDER BY m.seq LIMIT 1);
+            COMMIT;
+        """)
+
+    def _migrate_versions(self, conn: sqlite3.Connection) -> None:
+        """Add change-feed version columns; existing rows keep version 0 and arrive with a full sync"""
+        for table in ('sessions', 'messages'):
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if 'version' not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def _run(self) -> None:
+        """Store thread: run queued jobs, committing each drained batch in one transaction"""
+        conn = self._connect()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    next_job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if next_job is None:
+                    self._jobs.put(None)
+                    break
+                batch.append(next_job)
+
+            results = []
+            try:
+                # A batch with writes takes the write lock up front: a deferred transaction that
+                # reads first fails with SQLITE_BUSY on its first write when another worker holds
+                # the lock, and busy_timeout cannot retry that upgrade. Read-only batches stay
+                # deferred so they never block on, or hold up, other workers' writes.
+                conn.execute("BEGIN IMMEDIATE" if any(write for _, write, _, _ in batch) else "BEGIN")
+            except Exception as e:
+                log_with_context(logger, 'error', f'Session store could not begin a batch: {str(e)}')
+                results = [(loop, future, None, e) for _, _, loop, future in batch]
+            else:
+                for fn, _, loop, future in batch:
+                    # A savepoint per job keeps one failing job from rolling back the batch
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        results.append((loop, future, fn(conn), None))
+                        conn.execute("RELEASE job")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((loop, future, None, e))
+                try:
+                    conn.execute("COMMIT")
+                except Exception as e:
+                    log_with_context(logger, 'error', f'Session store commit failed: {str(e)}')
+                    conn.execute("ROLLBACK")
+                    results = [(loop, future, None, e) for loop, future, _, _ in results]
+
+            for loop, future, result, error in results:
+                try:
+                    loop.call_soon_threadsafe(self._resolve, future, result, error)
+                except RuntimeError:
+                    # The submitting event loop has already closed
+                    pass
+        conn.close()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any, error: Optional[Exception]) -> None:
+        """Complete a job future on its event loop"""
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _submit(self, fn: Callable[[sqlite3.Connection], Any], write: bool = False) -> Any:
+        """Run a job on the store thread and wait for its batch to commit; pass write=True if it modifies data"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((fn, write, loop, future))
+        return await future
+
+    async def create_session(self, user_id: Optional[str], session_id: str) -> None:
+        now = time.time()
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> None:
+            conn.execute(self.SQL_INSERT_SESSION, (session_id, owner, now, now))
+
+        await self._submit(job, write=True)
+
+    async def append_messages(self, rows: List[Dict[str, Any]]) -> None:
+        def job(conn: sqlite3.Connection) -> None:
+            # Reserve one block of change-feed versions per user rather than bumping per row
+            owner_rows = Counter(row.get('user_id') or ANONYMOUS_USER for row in rows)
+            next_version = {}
+            for owner, count in owner_rows.items():
+                last = conn.execute(self.SQL_RESERVE_VERSIONS, (owner, count)).fetchone()[0]
+                next_version[owner] = last - count + 1
+
+            last_seq: Dict[str, Optional[int]] = {}
+            # Session id -> [updated_at, version, assistant messages, title, mode], applied once per job
+            summaries: Dict[str, List[Any]] = {}
+            for row in rows:
+                session_id = row['session_id']
+                owner = row.get('user_id') or ANONYMOUS_USER
+                created_at = row.get('created_at') or time.time()
+                if session_id not in last_seq:
+                    conn.execute(self.SQL_INSERT_SESSION, (session_id, owner, created_at, created_at))
+                    # Never append to a session id owned by someone else
+                    if conn.execute(self.SQL_SESSION_OWNER, (session_id,)).fetchone()[0] != owner:
+                        log_with_context(logger, 'warning', 'Rejected append to session owned by another user', session_id=session_id)
+                        last_seq[session_id] = None
+                    else:
+                        last_seq[session_id] = conn.execute(self.SQL_LAST_SEQ, (session_id,)).fetchone()[0]
+                if last_seq[session_id] is None:
+                    continue
+                last_seq[session_id] += 1
+                version = next_version[owner]
+                next_version[owner] += 1
+                conn.execute(self.SQL_INSERT_MESSAGE, (
+                    session_id, last_seq[session_id], row.get('message_id'), row['role'],
+                    row['content'], row.get('payload'), created_at, version
+                ))
+                summary = summaries.setdefault(session_id, [created_at, version, 0, None, None])
+                summary[0], summary[1] = created_at, version
+                if row.get('payload') is not None:
+                    summary[2] += 1
+                    if summary[3] is None:
+                        summary[3], summary[4] = session_title(row['content']), row.get('mode')
+
+            # Keep the session summary current so listing never reads message bodies
+            conn.executemany(self.SQL_UPDATE_SUMMARY, [
+                (updated_at, version, count, title, mode, session_id)
+                for session_id, (updated_at, version, count, title, mode) in summaries.items()
+            ])
+
+        await self._submit(job, write=True)
+
+    async def get_session_messages(self, user_id: Optional[str], session_id: str) -> List[str]:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> List[str]:
+            if conn.execute(self.SQL_SESSION_OWNED, (session_id, owner)).fetchone() is None:
+                return []
+            return [row[0] for row in conn.execute(self.SQL_SESSION_PAYLOADS, (session_id,))]
+
+        return await self._submit(job)
+
+    async def get_user_sessions(self, user_id: Optional[str]) -> Dict[str, List[str]]:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+            sessions: Dict[str, List[str]] = {}
+            for session_id, payload in conn.execute(self.SQL_USER_PAYLOADS, (owner,)):
+                messages = sessions.setdefault(session_id, [])
+                if payload is not None:
+                    messages.append(payload)
+            return sessions
+
+        return await self._submit(job)
+
+    async def list_session_summaries(self, user_id: Optional[str], limit: Optional[int] = None,
+                                     before: Optional[Tuple[float, str]] = None,
+                                     after: Optional[Tuple[float, str]] = None) -> List[Dict[str, Any]]:
+        owner = user_id or ANONYMOUS_USER
+        row_limit = -1 if limit is None else limit
+
+        def job(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            if before is not None:
+                rows = conn.execute(self.SQL_LIST_SUMMARIES_BEFORE, (owner, before[0], before[0], before[1], row_limit)).fetchall()
+            elif after is not None:
+                # Fetched oldest-first from the cursor, returned newest-first like other pages
+                rows = conn.execute(self.SQL_LIST_SUMMARIES_AFTER, (owner, after[0], after[0], after[1], row_limit)).fetchall()
+                rows.reverse()
+            else:
+                rows = conn.execute(self.SQL_LIST_SUMMARIES, (owner, row_limit)).fetchall()
+            return [
+                {'id': session_id, 'title': title, 'mode': mode, 'created_at': created_at,
+                 'updated_at': updated_at, 'message_count': message_count}
+                for session_id, title, mode, created_at, updated_at, message_count in rows
+            ]
+
+        return await self._submit(job)
+
+    async def count_sessions(self, user_id: Optional[str]) -> int:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> int:
+            return conn.execute(self.SQL_COUNT_SESSIONS, (owner,)).fetchone()[0]
+
+        return await self._submit(job)
+
+    async def get_message_page(self, user_id: Optional[str], session_id: str, limit: Optional[int] = None,
+                               before_seq: Optional[int] = None,
+                               after_seq: Optional[int] = None) -> Optional[Tuple[int, List[Tuple[int, str]]]]:
+        owner = user_id or ANONYMOUS_USER
+        row_limit = -1 if limit is None else limit
+
+        def job(conn: sqlite3.Connection) -> Optional[Tuple[int, List[Tuple[int, str]]]]:
+            count_row = conn.execute(self.SQL_MESSAGE_COUNT, (session_id, owner)).fetchone()
+            if count_row is None:
+                return None
+            if before_seq is not None:
+                rows = conn.execute(self.SQL_PAGE_BEFORE, (session_id, before_seq, row_limit)).fetchall()
+                rows.reverse()
+            elif after_seq is not None:
+                rows = conn.execute(self.SQL_PAGE_AFTER, (session_id, after_seq, row_limit)).fetchall()
+            else:
+                rows = conn.execute(self.SQL_PAGE_FIRST, (session_id, row_limit)).fetchall()
+            return count_row[0], rows
+
+        return await self._submit(job)
+
+    async def get_history(self, session_id: str, limit: int) -> List[MessageRecord]:
+        def job(conn: sqlite3.Connection) -> List[MessageRecord]:
+            rows = conn.execute(self.SQL_HISTORY, (session_id, limit)).fetchall()
+            return [MessageRecord.from_row(role, content, created_at) for role, content, created_at in reversed(rows)]
+
+        return await self._submit(job)
+
+    async def get_changes(self, user_id: Optional[str], since: int, limit: int) -> Dict[str, Any]:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> Dict[str, Any]:
+            row = conn.execute(self.SQL_USER_VERSION, (owner,)).fetchone()
+            current = row[0] if row else 0
+            # A client ahead of the server (e.g. a replaced database) must start over
+            reset = since > current
+            floor = -1 if reset or since <= 0 else since
+
+            messages = conn.execute(self.SQL_CHANGED_MESSAGES, (owner, floor, floor, limit + 1)).fetchall()
+            has_more = len(messages) > limit
+            if has_more:
+                # Stop at the last included message; later changes come with the next call
+                messages = messages[:limit]
+                current = messages[-1][2]
+
+            sessions = [
+                {'id': session_id, 'title': title, 'mode': mode, 'created_at': created_at,
+                 'updated_at': updated_at, 'message_count': message_count}
+                for session_id, title, mode, created_at, updated_at, message_count
+                in conn.execute(self.SQL_CHANGED_SESSIONS, (owner, floor, current))
+            ]
+            deleted = [] if floor < 0 else [
+                session_id for session_id, in conn.execute(self.SQL_CHANGED_TOMBSTONES, (owner, floor, current))
+            ]
+            return {
+                'version': current,
+                'sessions': sessions,
+                'messages': [(session_id, seq, payload) for session_id, seq, _, payload in messages],
+                'deleted': deleted,
+                'has_more': has_more,
+                'reset': reset
+            }
+
+        return await self._submit(job)
+
+    async def get_export_rows(self, user_id: Optional[str], session_id: str, after_seq: int,
+                              limit: int) -> Optional[List[Tuple[int, str, str, float]]]:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> Optional[List[Tuple[int, str, str, float]]]:
+            if conn.execute(self.SQL_SESSION_OWNED, (session_id, owner)).fetchone() is None:
+                return None
+            return conn.execute(self.SQL_EXPORT_ROWS, (session_id, after_seq, limit)).fetchall()
+
+        return await self._submit(job)
+
+    async def list_export_sessions(self, user_id: Optional[str], after: Optional[Tuple[float, str]],
+                                   limit: int) -> List[Tuple[str, Optional[str], float]]:
+        owner = user_id or ANONYMOUS_USER
+        created_at, session_id = after if after is not None else (-1.0, "")
+
+        def job(conn: sqlite3.Connection) -> List[Tuple[str, Optional[str], float]]:
+            return conn.execute(self.SQL_EXPORT_SESSIONS, (owner, created_at, created_at, session_id, limit)).fetchall()
+
+        return await self._submit(job)
+
+    async def get_export_session(self, user_id: Optional[str], session_id: str) -> Optional[Tuple[Optional[str], float]]:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> Optional[Tuple[Optional[str], float]]:
+            row = conn.execute(self.SQL_EXPORT_SESSION, (session_id, owner)).fetchone()
+            return (row[0], row[1]) if row else None
+
+        return await self._submit(job)
+
+    async def index_messages(self, batch_size: int) -> int:
+        def job(conn: sqlite3.Connection) -> int:
+            last_id = conn.execute(self.SQL_SEARCH_CURSOR).fetchone()[0]
+            rows = conn.execute(self.SQL_UNINDEXED_MESSAGES, (last_id, batch_size)).fetchall()
+            if not rows:
+                return 0
+            user_numbers: Dict[str, int] = {}
+            documents = []
+            for message_id, content, owner, session_id, seq, role, created_at in rows:
+                if owner not in user_numbers:
+                    conn.execute(self.SQL_INSERT_SEARCH_USER, (owner,))
+                    user_numbers[owner] = conn.execute(self.SQL_SEARCH_USER, (owner,)).fetchone()[0]
+                rowid = (user_numbers[owner] << 32) | message_id
+                documents.append((rowid, strip_html(content), session_id, seq, role, created_at))
+            conn.executemany(self.SQL_INDEX_MESSAGE, documents)
+            conn.execute(self.SQL_SET_SEARCH_CURSOR, (rows[-1][0],))
+            return len(rows)
+
+        return await self._submit(job, write=True)
+
+    async def search(self, user_id: Optional[str], query: str, limit: int) -> List[Dict[str, Any]]:
+        owner = user_id or ANONYMOUS_USER
+        match = build_match_query(query)
+        if match is None:
+            return []
+
+        def job(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            user_no = conn.execute(self.SQL_SEARCH_USER, (owner,)).fetchone()
+            if user_no is None:
+                return []
+            low = user_no[0] << 32
+            high = low | 0xFFFFFFFF
+            window = conn.execute(self.SQL_SEARCH_WINDOW, (match, low, high, self.search_candidates - 1)).fetchone()
+            if window is not None:
+                low = window[0]
+            rows = conn.execute(self.SQL_SEARCH, (SNIPPET_START, SNIPPET_END, match, low, high, limit)).fetchall()
+            results = []
+            for session_id, seq, role, created_at, snippet, rank in rows:
+                # Escape the indexed text, then turn the markers into highlight tags
+                snippet = html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+                results.append({'session_id': session_id, 'seq': seq, 'role': role, 'created_at': created_at,
+                                 'snippet': snippet, 'score': -rank})
+            return results
+
+        return await self._submit(job)
+
+    async def delete_session(self, user_id: Optional[str], session_id: str) -> bool:
+        owner = user_id or ANONYMOUS_USER
+
+        def job(conn: sqlite3.Connection) -> bool:
+            if conn.execute(self.SQL_SESSION_OWNED, (session_id, owner)).fetchone() is None:
+                return False
+            user_no = conn.execute(self.SQL_SEARCH_USER, (owner,)).fetchone()
+            if user_no is not None:
+                conn.execute(self.SQL_UNINDEX_SESSION, (user_no[0], session_id))
+            conn.execute(self.SQL_DELETE_MESSAGES, (session_id,))
+            conn.execute(self.SQL_DELETE_SESSION, (session_id, owner))
+            conn.execute(self.SQL_CLAMP_SEARCH_CURSOR)
+            version = conn.execute(self.SQL_BUMP_VERSION, (owner,)).fetchone()[0]
+            conn.execute(self.SQL_INSERT_TOMBSTONE, (session_id, owner, version, time.time()))
+            return True
+
+        return await self._submit(job, write=True)
+
+    async def close(self) -> None:
+        """Commit outstanding jobs and stop the store thread"""
+        self._jobs.put(None)
+        await asyncio.to_thread(self._thread.join)
+
+def create_session_store() -> SessionStore:
+    """Create the configured session store"""
+    return SQLiteSessionStore(settings.session_db_path, max_batch=settings.session_db_max_batch,
+                              search_candidates=settings.search_candidate_limit)
+
+# Global session store
+session_store = create_session_store()
@@ -0,0 +1,153 @@
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+from src.config.config import settings
+from src.models.records import MessageRecord
+from src.services.conversation_writer import ConversationWriter, conversation_writer
+from src.services.session_store import SessionStore, session_store
+from src.utils.performance_monitor import performance_monitor
+
+class ResidentSession:
+    """Recent turns of one in-memory session"""
+
+    __slots__ = ('turns', 'size', 'last_access')
+
+    def __init__(self, turns: Deque[MessageRecord]):
+        self.turns = turns
+        self.size = sum(turn.size for turn in turns)
+        self.last_access = time.monotonic()
+
+class SessionWorkingSet:
+    """Bounded in-memory working set of recent conversation turns.
+
+    Each resident session keeps only the turns the model context uses, in a ring
+    buffer. Idle sessions, and least recently used ones once the memory budget is
+    exceeded, are spilled: their turns are already durable in the session store,
+    so they are dropped from memory and reloaded from the store on next use.
+    Sessions with writes still queued in the conversation writer stay resident.
+    """
+
+    def __init__(self, store: SessionStore, writer: ConversationWriter, max_turns: int,
+                 memory_budget_bytes: int, idle_seconds: float):
+        self.store = store
+        self.writer = writer
+        self.max_turns = max_turns
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions: "OrderedDict[str, ResidentSession]" = OrderedDict()
+        self.resident_bytes = 0
+
+        self.hits = 0
+        self.loads = 0
+        self.idle_spills = 0
+        self.budget_spills = 0
+        self.pending_skips = 0
+
+    def _admit(self, session_id: str, turns: List[MessageRecord]) -> ResidentSession:
+        """Make a session resident and enforce the memory budget"""
+        entry = ResidentSession(deque(turns, maxlen=self.max_turns))
+        self._sessions[session_id] = entry
+        self.resident_bytes += entry.size
+        self._enforce_budget(keep=session_id)
+        return entry
+
+    async def _entry(self, session_id: str) -> ResidentSession:
+        """Get a resident session, loading its recent turns from the store on a miss"""
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            self.hits += 1
+            self._sessions.move_to_end(session_id)
+        else:
+            self.loads += 1
+            turns = await self.store.get_history(session_id, self.max_turns)
+            # Another request may have loaded it while we waited on the store
+            entry = self._sessions.get(session_id) or self._admit(session_id, turns)
+        entry.last_access = time.monotonic()
+        return entry
+
+    async def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        """Get a session's recent turns as role/content dicts, oldest first"""
+        entry = await self._entry(session_id)
+        return [turn.to_turn() for turn in entry.turns]
+
+    async def append(self, session_id: str, turns: List[MessageRecord]) -> None:
+        """Append turns to a session, dropping the oldest beyond the ring size.
+        Call before queueing the turns for persistence; the session is kept resident until then."""
+        entry = await self._entry(session_id)
+        size_before = entry.size
+        for turn in turns:
+            if len(entry.turns) == entry.turns.maxlen:
+                entry.size -= entry.turns[0].size
+            entry.turns.append(turn)
+            entry.size += turn.size
+        self.resident_bytes += entry.size - size_before
+        self._enforce_budget(keep=session_id)
+
+    def reset(self, session_id: str) -> None:
+        """Make a new session resident with no turns"""
+        self.discard(session_id)
+        self._admit(session_id, [])
+
+    def discard(self, session_id: str) -> None:
+        """Drop a session from memory"""
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.resident_bytes -= entry.size
+
+    def _spillable(self, session_id: str) -> bool:
+        """A session may leave memory only once all of its turns are durable"""
+        if session_id in self.writer.pending_sessions:
+            self.pending_skips += 1
+            return False
+        return True
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        """Spill least recently used sessions until under the memory budget"""
+        if self.resident_bytes <= self.memory_budget_bytes:
+            return
+        for session_id in list(self._sessions):
+            if self.resident_bytes <= self.memory_budget_bytes:
+                break
+            if session_id != keep and self._spillable(session_id):
+                self.discard(session_id)
+                self.budget_spills += 1
+
+    def spill_idle(self) -> int:
+        """Spill sessions idle past the threshold and return how many left memory"""
+        cutoff = time.monotonic() - self.idle_seconds
+        spilled = 0
+        # Oldest access first; stop at the first session that is still active
+        for session_id, entry in list(self._sessions.items()):
+            if entry.last_access > cutoff:
+                break
+            if self._spillable(session_id):
+                self.discard(session_id)
+                spilled += 1
+        self.idle_spills += spilled
+        return spilled
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get resident session count, memory use and spill statistics"""
+        lookups = self.hits + self.loads
+        return {
+            'resident_sessions': len(self._sessions),
+            'resident_bytes': self.resident_bytes,
+            'memory_budget_bytes': self.memory_budget_bytes,
+            'max_turns': self.max_turns,
+            'hits': self.hits,
+            'loads': self.loads,
+            'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0,
+            'idle_spills': self.idle_spills,
+            'budget_spills': self.budget_spills,
+            'pending_skips': self.pending_skips
+        }
+
+# Global session working set
+session_working_set = SessionWorkingSet(
+    session_store,
+    conversation_writer,
+    max_turns=settings.max_conversation_history,
+    memory_budget_bytes=settings.session_memory_budget_mb * 1024 * 1024,
+    idle_seconds=settings.session_idle_seconds
+)
+performance_monitor.register_component('session_working_set', session_working_set.get_stats)
@@ -0,0 +1,179 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Request
+from src.config.config import settings
+from src.middleware.rate_limiter import EVICTION_BATCH_SIZE, get_client_ip
+from src.services.auth_service import auth_service
+from src.utils.performance_monitor import performance_monitor
+
+# Rough characters per token for English text and code
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    """Estimate the token count of some text before the model reports it"""
+    return sum(len(text) for text in texts if text) // CHARS_PER_TOKEN + 1
+
+class TokenCharge:
+    """Token cost of one model request, estimated at admission and reconciled from model usage"""
+
+    __slots__ = ('identity', 'estimated', 'input_tokens', 'output_tokens', 'settled')
+
+    def __init__(self, identity: str, estimated: int):
+        self.identity = identity
+        self.estimated = estimated
+        self.input_tokens: Optional[int] = None
+        self.output_tokens: Optional[int] = None
+        self.settled = False
+
+# Charge of the request being handled, filled in by the model client as usage is reported
+current_charge: ContextVar[Optional[TokenCharge]] = ContextVar('current_charge', default=None)
+
+def record_usage(input_tokens: Optional[int] = None, output_tokens: Optional[int] = None) -> None:
+    """Record model-reported token usage against the current request's charge"""
+    charge = current_charge.get()
+    if charge is None:
+        return
+    if input_tokens is not None:
+        charge.input_tokens = input_tokens
+    if output_tokens is not None:
+        charge.output_tokens = output_tokens
+
+class TokenQuota:
+    """Per-identity LLM token budget over a sliding window.
+
+    Identities are the JWT subject when a valid token is sent, otherwise the
+    client IP. Works like the GCRA request limiter with a cost per request: the
+    identity's theoretical arrival time advances by cost * window / quota.
+    Admission charges the estimated input; once the model reports usage the
+    charge is reconciled to actual input plus output tokens, which may leave the
+    identity in debt until the window refills. Cached responses cost nothing.
+    """
+
+    def __init__(self, user_tokens: int, anonymous_tokens: int, window_seconds: int, max_identities: int):
+        self.user_tokens = user_tokens
+        self.anonymous_tokens = anonymous_tokens
+        self.window_seconds = window_seconds
+        self.max_identities = max_identities
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.RLock()
+
+        self.admitted = 0
+        self.denied = 0
+        self.tokens_charged = 0
+        self.tokens_refunded = 0
+
+    async def identify(self, request: Request) -> str:
+        """Get the quota identity for a request: the JWT subject, falling back to the client IP"""
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            token_data = await auth_service.verify_token(authorization[7:])
+            if token_data:
+                return f"user:{token_data.user_id}"
+        return f"ip:{get_client_ip(request)}"
+
+    def _limit(self, identity: str) -> int:
+        return self.user_tokens if identity.startswith('user:') else self.anonymous_tokens
+
+    def _state(self, limit: int, tat: float, current_time: float) -> Dict[str, int]:
+        interval = self.window_seconds / limit
+        return {
+            'limit': limit,
+            'remaining': max(0, int((self.window_seconds - (tat - current_time)) / interval)),
+            'reset': math.ceil(max(tat, current_time))
+        }
+
+    def admit(self, identity: str, estimated_tokens: int) -> Tuple[Optional[TokenCharge], Dict[str, int]]:
+        """Charge the estimated input tokens; returns no charge and a retry_after if the quota is used up"""
+        limit = self._limit(identity)
+        interval = self.window_seconds / limit
+        # A prompt larger than the whole quota still gets through once the window is full
+        cost = min(estimated_tokens, limit)
+        current_time = time.time()
+
+        with self.lock:
+            tat = max(self._tats.get(identity, current_time), current_time)
+            new_tat = tat + cost * interval
+            if new_tat - current_time > self.window_seconds:
+                self.denied += 1
+                state = self._state(limit, tat, current_time)
+                state['retry_after'] = max(1, math.ceil(new_tat - self.window_seconds - current_time))
+                return None, state
+
+            self._tats[identity] = new_tat
+            self._tats.move_to_end(identity)
+            if len(self._tats) > self.max_identities:
+                self._tats.popitem(last=False)
+            self.admitted += 1
+            self.tokens_charged += cost
+            return TokenCharge(identity, cost), self._state(limit, new_tat, current_time)
+
+    def settle(self, charge: TokenCharge, output_chars: int = 0) -> Dict[str, int]:
+        """Reconcile a charge with actual usage and return the identity's quota state.
+
+        Without reported usage the response came from cache and the estimate is refunded;
+        output of a stream stopped before the final usage report is estimated from its text.
+        """
+        limit = self._limit(charge.identity)
+        interval = self.window_seconds / limit
+        current_time = time.time()
+
+        with self.lock:
+            tat = self._tats.get(charge.identity, current_time)
+            if charge.settled:
+                return self._state(limit, tat, current_time)
+            charge.settled = True
+
+            if charge.input_tokens is None:
+                cost = 0
+            else:
+                output_tokens = charge.output_tokens
+                if output_tokens is None:
+                    output_tokens = output_chars // CHARS_PER_TOKEN
+                cost = charge.input_tokens + output_tokens
+
+            delta = cost - charge.estimated
+            if delta > 0:
+                self.tokens_charged += delta
+                tat = max(tat, current_time) + delta * interval
+            else:
+                self.tokens_refunded -= delta
+                tat = max(tat + delta * interval, current_time)
+            self._tats[charge.identity] = tat
+            self._tats.move_to_end(charge.identity)
+            return self._state(limit, tat, current_time)
+
+    def evict_idle(self, limit: int = EVICTION_BATCH_SIZE) -> int:
+        """Drop up to limit identities whose quota has fully refilled and return how many were removed"""
+        evicted = 0
+        with self.lock:
+            current_time = time.time()
+            while self._tats and evicted < limit:
+                identity, tat = next(iter(self._tats.items()))
+                if tat > current_time:
+                    break
+                del self._tats[identity]
+                evicted += 1
+        return evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get tracked identity count and token accounting statistics"""
+        return {
+            'tracked_identities': len(self._tats),
+            'admitted': self.admitted,
+            'denied': self.denied,
+            'tokens_charged': self.tokens_charged,
+            'tokens_refunded': self.tokens_refunded
+        }
+
+# Global token quota
+token_quota = TokenQuota(
+    user_tokens=settings.token_quota_user_tokens,
+    anonymous_tokens=settings.token_quota_anonymous_tokens,
+    window_seconds=settings.token_quota_window,
+    max_identities=settings.rate_limit_max_clients
+)
+performance_monitor.register_component('token_quota', token_quota.get_stats)
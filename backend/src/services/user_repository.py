@@ -0,0 +1,191 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.config.config import settings
+from src.utils.logger import get_logger, log_with_context
+
+logger = get_logger(__name__)
+
+# id, email, name, picture, google_id, is_active, created_at, last_login
+UserRow = Tuple[str, str, str, Optional[str], str, int, float, Optional[float]]
+
+class EmailInUseError(Exception):
+    """The email already belongs to a user with a different Google account"""
+
+class UserRepository(ABC):
+    """Storage interface for user accounts"""
+
+    @abstractmethod
+    async def insert_user(self, row: UserRow) -> UserRow:
+        """Insert a user and return it, or the already stored user with the same Google id.
+        Raises EmailInUseError if another Google account already has the email."""
+
+    @abstractmethod
+    async def get_by_id(self, user_id: str) -> Optional[UserRow]:
+        """Get a user by id"""
+
+    @abstractmethod
+    async def get_by_email(self, email: str) -> Optional[UserRow]:
+        """Get a user by email"""
+
+    @abstractmethod
+    async def get_by_google_id(self, google_id: str) -> Optional[UserRow]:
+        """Get a user by Google id"""
+
+    @abstractmethod
+    async def update_profile(self, user_id: str, changes: Dict[str, Any]) -> Optional[UserRow]:
+        """Update profile columns and return the stored user, or None if it doesn't exist"""
+
+    @abstractmethod
+    async def set_last_logins(self, logins: List[Tuple[float, str]]) -> None:
+        """Write (last_login, user_id) pairs in one transaction"""
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Finish outstanding work and release the storage"""
+
+class SQLiteUserRepository(UserRepository):
+    """SQLite (WAL) user table with unique email and Google id indexes, driven by a dedicated thread.
+
+    The database file is shared by every worker process, so accounts survive
+    restarts and a user created on one worker can sign in through another.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            name TEXT NOT NULL,
+            picture TEXT,
+            google_id TEXT NOT NULL,
+            is_active INTEGER NOT NULL DEFAULT 1,
+            created_at REAL NOT NULL,
+            last_login REAL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_google_id ON users (google_id);
+    """
+
+    # Statements are kept as constants so sqlite3's statement cache reuses them prepared
+    SQL_COLUMNS = "SELECT id, email, name, picture, google_id, is_active, created_at, last_login FROM users "
+    SQL_BY_ID = SQL_COLUMNS + "WHERE id = ?"
+    SQL_BY_EMAIL = SQL_COLUMNS + "WHERE email = ?"
+    SQL_BY_GOOGLE_ID = SQL_COLUMNS + "WHERE google_id = ?"
+    SQL_INSERT = (
+        "INSERT INTO users (id, email, name, picture, google_id, is_active, created_at, last_login) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING"
+    )
+    # Never move last_login backwards when workers flush out of order
+    SQL_SET_LAST_LOGIN = "UPDATE users SET last_login = MAX(COALESCE(last_login, 0), ?) WHERE id = ?"
+    PROFILE_COLUMNS = ("name", "picture", "is_active")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="user-repository", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the connection owned by the repository thread"""
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Other workers may hold the write lock briefly
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def _run(self) -> None:
+        """Repository thread: run queued jobs, each in its own transaction"""
+        conn = self._connect()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            fn, loop, future = job
+            try:
+                conn.execute("BEGIN")
+                result, error = fn(conn), None
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                log_with_context(logger, 'error', f'User repository job failed: {str(e)}')
+                result, error = None, e
+            try:
+                loop.call_soon_threadsafe(self._resolve, future, result, error)
+            except RuntimeError:
+                # The submitting event loop has already closed
+                pass
+        conn.close()
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any, error: Optional[Exception]) -> None:
+        """Complete a job future on its event loop"""
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run a job on the repository thread and wait for it to commit"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((fn, loop, future))
+        return await future
+
+    async def _fetch_one(self, sql: str, key: str) -> Optional[UserRow]:
+        return await self._submit(lambda conn: conn.execute(sql, (key,)).fetchone())
+
+    async def insert_user(self, row: UserRow) -> UserRow:
+        def job(conn: sqlite3.Connection) -> Optional[UserRow]:
+            conn.execute(self.SQL_INSERT, row)
+            # Another worker may have created the same Google account first; if there is no
+            # row for this Google id, the insert was skipped because the email is taken
+            return conn.execute(self.SQL_BY_GOOGLE_ID, (row[4],)).fetchone()
+
+        stored = await self._submit(job)
+        if stored is None:
+            raise EmailInUseError(row[1])
+        return stored
+
+    async def get_by_id(self, user_id: str) -> Optional[UserRow]:
+        return await self._fetch_one(self.SQL_BY_ID, user_id)
+
+    async def get_by_email(self, email: str) -> Optional[UserRow]:
+        return await self._fetch_one(self.SQL_BY_EMAIL, email)
+
+    async def get_by_google_id(self, google_id: str) -> Optional[UserRow]:
+        return await self._fetch_one(self.SQL_BY_GOOGLE_ID, google_id)
+
+    async def update_profile(self, user_id: str, changes: Dict[str, Any]) -> Optional[UserRow]:
+        columns = [column for column in self.PROFILE_COLUMNS if column in changes]
+
+        def job(conn: sqlite3.Connection) -> Optional[UserRow]:
+            if columns:
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                conn.execute(f"UPDATE users SET {assignments} WHERE id = ?",
+                             [changes[column] for column in columns] + [user_id])
+            return conn.execute(self.SQL_BY_ID, (user_id,)).fetchone()
+
+        return await self._submit(job)
+
+    async def set_last_logins(self, logins: List[Tuple[float, str]]) -> None:
+        def job(conn: sqlite3.Connection) -> None:
+            conn.executemany(self.SQL_SET_LAST_LOGIN, logins)
+
+        await self._submit(job)
+
+    async def close(self) -> None:
+        """Finish outstanding jobs and stop the repository thread"""
+        self._jobs.put(None)
+        await asyncio.to_thread(self._thread.join)
+
+def create_user_repository() -> UserRepository:
+    """Create the configured user repository"""
+    return SQLiteUserRepository(settings.user_db_path)
@@ -1,68 +1,157 @@
+import time
 import uuid
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional
+from src.config.config import settings
 from src.models.auth_schemas import UserCreate, UserResponse
-from src.utils.logger import get_logger
+from src.services.user_repository import UserRepository, UserRow, create_user_repository
+from src.utils.cache_manager import InMemoryCache
+from src.utils.logger import get_logger, log_with_context
+from src.utils.performance_monitor import performance_monitor
 
 logger = get_logger(__name__)
 
 class UserService:
-    """In-memory user service - replace with database later"""
-    
-    def __init__(self):
-        self.users: Dict[str, dict] = {}
-        self.users_by_email: Dict[str, str] = {}
-        self.users_by_google_id: Dict[str, str] = {}
-    
+    """User accounts stored in the user repository behind a read-through cache.
+
+    The cache holds frozen UserResponse objects by id, so repeat lookups share
+    one instance instead of rebuilding it; email and Google id lookups go
+    through small id maps, since neither changes once a user exists. Entries
+    expire after user_cache_ttl to pick up changes made by other workers.
+    Login times are collected in memory and written in one batch by a
+    background task instead of a write per login.
+    """
+
+    def __init__(self, repository: UserRepository):
+        self.repository = repository
+        self.cache = InMemoryCache(name="user", default_ttl=settings.user_cache_ttl,
+                                   max_entries=settings.user_cache_max_entries)
+        self.ids_by_email: Dict[str, str] = {}
+        self.ids_by_google_id: Dict[str, str] = {}
+        # Login times not yet written to the repository
+        self.pending_logins: Dict[str, float] = {}
+        # Called with the user id whenever a stored user changes
+        self._invalidation_listeners: List[Callable[[str], None]] = []
+        self.logins_flushed = 0
+        self.login_flushes = 0
+        performance_monitor.register_cache(self.cache.name, self.cache.get_stats)
+
+    def add_invalidation_listener(self, listener: Callable[[str], None]) -> None:
+        """Register a callback for users that are updated or deactivated"""
+        self._invalidation_listeners.append(listener)
+
+    def _notify(self, user_id: str) -> None:
+        for listener in self._invalidation_listeners:
+            listener(user_id)
+
+    def _remember(self, row: Optional[UserRow]) -> Optional[UserResponse]:
+        """Build the frozen user for a stored row and cache it"""
+        if row is None:
+            return None
+        user_id, email, name, picture, google_id, is_active, created_at, last_login = row
+        # A login not yet flushed is newer than the stored one
+        last_login = self.pending_logins.get(user_id, last_login)
+        user = UserResponse(
+            id=user_id,
+            email=email,
+            name=name,
+            picture=picture,
+            is_active=bool(is_active),
+            created_at=datetime.fromtimestamp(created_at),
+            last_login=datetime.fromtimestamp(last_login) if last_login is not None else None
+        )
+        self.cache.set(user_id, user)
+        if len(self.ids_by_email) >= settings.user_cache_max_entries:
+            self.ids_by_email.clear()
+            self.ids_by_google_id.clear()
+        self.ids_by_email[email] = user_id
+        self.ids_by_google_id[google_id] = user_id
+        return user
+
     async def create_user(self, user_data: UserCreate) -> UserResponse:
-        """Create a new user"""
-        user_id = str(uuid.uuid4())
-        
-        user = {
-            "id": user_id,
-            "email": user_data.email,
-            "name": user_data.name,
-            "picture": user_data.picture,
-            "google_id": user_data.google_id,
-            "is_active": True,
-            "created_at": datetime.now(),
-            "last_login": None
-        }
-        
-        self.users[user_id] = user
-        self.users_by_email[user_data.email] = user_id
-        self.users_by_google_id[user_data.google_id] = user_id
-        
+        """Create a new user; raises EmailInUseError if another Google account has the email"""
+        row = (str(uuid.uuid4()), user_data.email, user_data.name, user_data.picture,
+               user_data.google_id, 1, time.time(), None)
+        user = self._remember(await self.repository.insert_user(row))
+
         logger.info(f"Created new user: {user_data.email}")
-        
-        return UserResponse(**user)
-    
+
+        return user
+
     async def get_user_by_id(self, user_id: str) -> Optional[UserResponse]:
         """Get user by ID"""
-        user = self.users.get(user_id)
-        return UserResponse(**user) if user else None
-    
+        user = self.cache.get(user_id)
+        if user is None:
+            user = self._remember(await self.repository.get_by_id(user_id))
+        return user
+
     async def get_user_by_email(self, email: str) -> Optional[UserResponse]:
         """Get user by email"""
-        user_id = self.users_by_email.get(email)
+        user_id = self.ids_by_email.get(email)
         if user_id:
-            user = self.users.get(user_id)
-            return UserResponse(**user) if user else None
-        return None
-    
+            return await self.get_user_by_id(user_id)
+        return self._remember(await self.repository.get_by_email(email))
+
     async def get_user_by_google_id(self, google_id: str) -> Optional[UserResponse]:
         """Get user by Google ID"""
-        user_id = self.users_by_google_id.get(google_id)
+        user_id = self.ids_by_google_id.get(google_id)
         if user_id:
-            user = self.users.get(user_id)
-            return UserResponse(**user) if user else None
-        return None
-    
+            return await self.get_user_by_id(user_id)
+        return self._remember(await self.repository.get_by_google_id(google_id))
+
+    async def update_user(self, user_id: str, **changes) -> Optional[UserResponse]:
+        """Update a user's profile fields"""
+        row = await self.repository.update_profile(user_id, changes)
+        if row is None:
+            return None
+        user = self._remember(row)
+        self._notify(user_id)
+        return user
+
+    async def deactivate_user(self, user_id: str) -> bool:
+        """Deactivate a user so their tokens stop working"""
+        return await self.update_user(user_id, is_active=False) is not None
+
     async def update_last_login(self, user_id: str):
-        """Update user's last login time"""
-        if user_id in self.users:
-            self.users[user_id]["last_login"] = datetime.now()
-            logger.info(f"Updated last login for user: {user_id}")
+        """Update user's last login time; the write is batched by flush_last_logins"""
+        login_time = time.time()
+        self.pending_logins[user_id] = login_time
+        user = self.cache.get(user_id)
+        if user is not None:
+            self.cache.set(user_id, user.model_copy(update={"last_login": datetime.fromtimestamp(login_time)}))
+        self._notify(user_id)
+        logger.info(f"Updated last login for user: {user_id}")
+
+    async def flush_last_logins(self) -> int:
+        """Write pending login times in one transaction and return how many were written"""
+        if not self.pending_logins:
+            return 0
+        logins, self.pending_logins = self.pending_logins, {}
+        try:
+            await self.repository.set_last_logins([(login_time, user_id) for user_id, login_time in logins.items()])
+        except Exception as e:
+            # Keep them for the next flush unless a newer login replaced them meanwhile
+            for user_id, login_time in logins.items():
+                self.pending_logins.setdefault(user_id, login_time)
+            log_with_context(logger, 'error', f'Error writing login times: {str(e)}', users=len(logins))
+            return 0
+        self.logins_flushed += len(logins)
+        self.login_flushes += 1
+        return len(logins)
+
+    async def close(self) -> None:
+        """Write pending login times and close the repository"""
+        await self.flush_last_logins()
+        await self.repository.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get pending and flushed login write counts"""
+        return {
+            'pending_logins': len(self.pending_logins),
+            'logins_flushed': self.logins_flushed,
+            'login_flushes': self.login_flushes
+        }
 
 # Global user service instance
-user_service = UserService()
\ No newline at end of file
+user_service = UserService(create_user_repository())
+performance_monitor.register_component('user_service', user_service.get_stats)
@@ -1,7 +1,14 @@
 import asyncio
 import threading
 from src.utils.cache_manager import cache_manager
-from src.utils.logger import get_logger
+from src.utils.cache_snapshot import cache_snapshotter
+from src.services.session_working_set import session_working_set
+from src.services.session_store import session_store
+from src.services.blob_store import blob_store
+from src.middleware.rate_limiter import EVICTION_BATCH_SIZE, rate_limiter
+from src.services.token_quota import token_quota
+from src.services.user_service import user_service
+from src.utils.logger import get_logger, log_with_context
 from src.config.config import settings
 
 logger = get_logger(__name__)
@@ -26,7 +33,17 @@ class BackgroundTaskManager:
                 
                 if total_expired > 0:
                     logger.info(f"Cache cleanup completed: {total_expired} expired entries removed")
-                
+
+                # Drop context blobs nobody has used for a while
+                blob_store.evict_idle()
+
+                # Report how much the compressed tier stretches the memory budget
+                compression_stats = cache_manager.response_cache.get_compression_stats(
+                    memory_budget_bytes=settings.cache_memory_budget_mb * 1024 * 1024
+                )
+                if compression_stats['compressed_entries'] > 0:
+                    log_with_context(logger, 'info', 'Response cache compression stats', **compression_stats)
+
                 # Sleep for 5 minutes
                 await asyncio.sleep(300)
                 
@@ -34,6 +51,85 @@ class BackgroundTaskManager:
                 logger.error(f"Error in cache cleanup task: {str(e)}")
                 await asyncio.sleep(60)  # Retry after 1 minute on error
     
+    async def cache_snapshot_task(self):
+        """Periodic cache snapshot task"""
+        while self.running:
+            try:
+                await asyncio.sleep(settings.cache_snapshot_interval)
+                await cache_snapshotter.save_async()
+
+                for name, stats in cache_snapshotter.get_restore_stats().items():
+                    if stats['restored_entries'] > 0:
+                        log_with_context(logger, 'info', 'Restored cache entry hit rate', cache=name, **stats)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in cache snapshot task: {str(e)}")
+
+    async def session_spill_task(self):
+        """Periodic idle session spill task"""
+        while self.running:
+            try:
+                await asyncio.sleep(settings.session_spill_interval)
+                spilled = session_working_set.spill_idle()
+                if spilled > 0:
+                    log_with_context(logger, 'info', 'Spilled idle sessions', spilled=spilled,
+                                     **session_working_set.get_stats())
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in session spill task: {str(e)}")
+
+    async def rate_limit_eviction_task(self):
+        """Periodic eviction of idle rate limit clients and token quota identities"""
+        while self.running:
+            try:
+                await asyncio.sleep(settings.rate_limit_eviction_interval)
+                for name, limiter in (('rate_limiter', rate_limiter), ('token_quota', token_quota)):
+                    # Sweep in batches so a large backlog does not stall the event loop
+                    evicted = batch = limiter.evict_idle()
+                    while batch >= EVICTION_BATCH_SIZE:
+                        await asyncio.sleep(0)
+                        batch = limiter.evict_idle()
+                        evicted += batch
+                    if evicted > 0:
+                        log_with_context(logger, 'info', 'Evicted idle rate limit clients', limiter=name,
+                                         evicted=evicted, **limiter.get_stats())
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in rate limit eviction task: {str(e)}")
+
+    async def login_flush_task(self):
+        """Periodic batched write of user login times"""
+        while self.running:
+            try:
+                await asyncio.sleep(settings.user_login_flush_interval)
+                await user_service.flush_last_logins()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in login flush task: {str(e)}")
+
+    async def search_index_task(self):
+        """Incremental search indexing task, kept off the message append path"""
+        while self.running:
+            try:
+                indexed = await session_store.index_messages(settings.search_index_batch_size)
+                # Keep going while there is a backlog, otherwise wait for new messages
+                if indexed < settings.search_index_batch_size:
+                    await asyncio.sleep(settings.search_index_interval)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in search index task: {str(e)}")
+                await asyncio.sleep(60)
+
     def start_background_tasks(self):
         """Start all background tasks"""
         if not self.running:
@@ -42,6 +138,26 @@ class BackgroundTaskManager:
             # Start cache cleanup task
             cache_task = asyncio.create_task(self.cache_cleanup_task())
             self.tasks.append(cache_task)
+
+            # Start cache snapshot task
+            snapshot_task = asyncio.create_task(self.cache_snapshot_task())
+            self.tasks.append(snapshot_task)
+
+            # Start idle session spill task
+            spill_task = asyncio.create_task(self.session_spill_task())
+            self.tasks.append(spill_task)
+
+            # Start search index task
+            search_task = asyncio.create_task(self.search_index_task())
+            self.tasks.append(search_task)
+
+            # Start rate limit eviction task
+            rate_limit_task = asyncio.create_task(self.rate_limit_eviction_task())
+            self.tasks.append(rate_limit_task)
+
+            # Start login time flush task
+            login_flush_task = asyncio.create_task(self.login_flush_task())
+            self.tasks.append(login_flush_task)
             
             logger.info("Background tasks started")
     
@@ -1,52 +1,239 @@
 import hashlib
 import json
+import pickle
+import sys
 import time
-from typing import Any, Optional, Dict
+import zlib
+from typing import Any, Callable, Optional, Dict, List, Tuple
 import threading
+from collections import OrderedDict
+from src.config.config import settings
+from src.utils.performance_monitor import performance_monitor
+
+# Preset dictionary for zlib compression of cached Bedrock responses. zlib gives
+# the most weight to the end of the dictionary, so the most frequent fragments
+# (pickled dict keys and HTML formatting tags) come last.
+HTML_COMPRESSION_DICTIONARY = (
+    b"<b>Overview</b><b>Key Points</b><b>Analysis</b><b>Conclusions</b>"
+    b"<b>Solution</b><b>Explanation</b><b>Best Practices</b><b>Next Steps</b>"
+    b"<b>Error Analysis</b><b>Immediate Fix</b><b>Verification</b><b>Prevention</b>"
+    b"<h1></h1><h2></h2><h3></h3><ul><li></li></ul><br><br>"
+    b'<div class="research-response"><div class="code-response">'
+    b'<div class="troubleshoot-response"><div class="standard-response"></div>'
+    b'<pre><code class="language-bash"><pre><code class="language-javascript">'
+    b'<pre><code class="language-python"></code></pre><code></code>'
+    b"<i></i><i></i><b></b><b></b><strong></strong><em></em>\n\n1. 2. 3. - "
+    b"contenthas_codecode_languagesmoderesearchcodetroubleshootstandard"
+)
+
+class CacheStats:
+    """Cache counters, updated under the owning cache's lock alongside the entry changes they count"""
+
+    FIELDS = ('hits', 'misses', 'expirations', 'evictions', 'sets', 'set_time')
+
+    def __init__(self):
+        self.counts: Dict[str, float] = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field: str, amount: float = 1) -> None:
+        """Increment a counter (caller holds the cache lock)"""
+        self.counts[field] += amount
+
+    def snapshot(self) -> Dict[str, float]:
+        """Copy the counters (caller holds the cache lock)"""
+        return dict(self.counts)
 
 class InMemoryCache:
     """Thread-safe in-memory cache with TTL support"""
     
-    def __init__(self, default_ttl: int = 300):  # 5 minutes default
-        self._cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, default_ttl: int = 300,  # 5 minutes default
+                 name: str = "cache",
+                 max_entries: Optional[int] = None,
+                 compress_threshold: Optional[int] = None,
+                 compression_dict: Optional[bytes] = None,
+                 compression_level: int = 6):
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self._lock = threading.RLock()
         self.default_ttl = default_ttl
+        self.name = name
+        # Least recently used entries are evicted once max_entries is reached
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        # Called with the key whenever an entry leaves the cache for any reason
+        self._removal_listeners: List[Callable[[str], None]] = []
+
+        # Values whose estimated size reaches compress_threshold bytes are pickled
+        # and zlib-compressed on set, and decompressed lazily on each hit
+        self.compress_threshold = compress_threshold
+        self.compression_dict = compression_dict
+        self.compression_level = compression_level
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+        self._compressed_entries = 0
+        self._compressed_raw_bytes = 0
+        self._compressed_stored_bytes = 0
+        self._compress_time = 0.0
+        self._compress_count = 0
+        self._decompress_time = 0.0
+        self._decompress_count = 0
+
+        # Entries loaded from a snapshot, and how many of them were hit since
+        self._restored_entries = 0
+        self._restored_hits = 0
     
     def _generate_key(self, *args, **kwargs) -> str:
         """Generate cache key from arguments"""
         key_data = json.dumps([args, sorted(kwargs.items())], sort_keys=True)
         return hashlib.md5(key_data.encode()).hexdigest()
     
+    def _estimate_size(self, value: Any) -> int:
+        """Cheap estimate of a value's payload size in bytes"""
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        if isinstance(value, dict):
+            return sum(self._estimate_size(k) + self._estimate_size(v) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return sum(self._estimate_size(v) for v in value)
+        return sys.getsizeof(value)
+
+    def _compress(self, value: Any) -> bytes:
+        """Pickle and compress a value using the preset dictionary"""
+        if self.compression_dict:
+            compressor = zlib.compressobj(self.compression_level, zdict=self.compression_dict)
+        else:
+            compressor = zlib.compressobj(self.compression_level)
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        return compressor.compress(payload) + compressor.flush()
+
+    def _decompress(self, data: bytes) -> Any:
+        """Decompress and unpickle a stored value"""
+        if self.compression_dict:
+            decompressor = zlib.decompressobj(zdict=self.compression_dict)
+        else:
+            decompressor = zlib.decompressobj()
+        return pickle.loads(decompressor.decompress(data) + decompressor.flush())
+
+    def decode_stored(self, stored_value: Any, compressed: bool) -> Any:
+        """Get the value held by an exported or snapshotted entry"""
+        return self._decompress(stored_value) if compressed else stored_value
+
+    def add_removal_listener(self, listener: Callable[[str], None]) -> None:
+        """Register a callback for keys that are deleted, expired or evicted"""
+        self._removal_listeners.append(listener)
+
+    def _drop_entry(self, key: str) -> None:
+        """Remove an entry and update size accounting (caller holds the lock)"""
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            return
+        for listener in self._removal_listeners:
+            listener(key)
+        self._raw_bytes -= entry['raw_size']
+        self._stored_bytes -= entry['stored_size']
+        if entry['compressed']:
+            self._compressed_entries -= 1
+            self._compressed_raw_bytes -= entry['raw_size']
+            self._compressed_stored_bytes -= entry['stored_size']
+
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
         with self._lock:
-            if key in self._cache:
-                entry = self._cache[key]
-                if time.time() < entry['expires_at']:
-                    return entry['value']
-                else:
-                    del self._cache[key]
-            return None
+            entry = self._cache.get(key)
+            if entry is None:
+                self.stats.incr('misses')
+                return None
+            if time.time() >= entry['expires_at']:
+                self._drop_entry(key)
+                self.stats.incr('misses')
+                self.stats.incr('expirations')
+                return None
+            self.stats.incr('hits')
+            if self.max_entries is not None:
+                self._cache.move_to_end(key)
+            if entry.get('restored'):
+                entry['restored'] = False
+                self._restored_hits += 1
+            if not entry['compressed']:
+                return entry['value']
+            data = entry['value']
+
+        # Decompress outside the lock so concurrent hits don't serialize
+        start = time.perf_counter()
+        value = self._decompress(data)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._decompress_time += elapsed
+            self._decompress_count += 1
+        return value
+
+    def _evict_overflow(self) -> None:
+        """Evict least recently used entries beyond max_entries (caller holds the lock)"""
+        while len(self._cache) > self.max_entries:
+            oldest_key = next(iter(self._cache))
+            self._drop_entry(oldest_key)
+            self.stats.incr('evictions')
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """Set value in cache with TTL"""
+        set_start = time.perf_counter()
         ttl = ttl or self.default_ttl
+        raw_size = self._estimate_size(value)
+        stored_value = value
+        stored_size = raw_size
+        compressed = False
+        compress_time = 0.0
+
+        if self.compress_threshold is not None and raw_size >= self.compress_threshold:
+            start = time.perf_counter()
+            data = self._compress(value)
+            compress_time = time.perf_counter() - start
+            # Keep the plain object if compression doesn't pay for itself
+            if len(data) < raw_size:
+                stored_value = data
+                stored_size = len(data)
+                compressed = True
+
+        now = time.time()
         with self._lock:
+            self._drop_entry(key)
             self._cache[key] = {
-                'value': value,
-                'expires_at': time.time() + ttl,
-                'created_at': time.time()
+                'value': stored_value,
+                'expires_at': now + ttl,
+                'created_at': now,
+                'compressed': compressed,
+                'raw_size': raw_size,
+                'stored_size': stored_size
             }
+            self._raw_bytes += raw_size
+            self._stored_bytes += stored_size
+            if compressed:
+                self._compressed_entries += 1
+                self._compressed_raw_bytes += raw_size
+                self._compressed_stored_bytes += stored_size
+            if compress_time:
+                self._compress_time += compress_time
+                self._compress_count += 1
+            if self.max_entries is not None:
+                self._evict_overflow()
+            self.stats.incr('sets')
+            self.stats.incr('set_time', time.perf_counter() - set_start)
     
     def delete(self, key: str) -> None:
         """Delete key from cache"""
         with self._lock:
-            self._cache.pop(key, None)
+            self._drop_entry(key)
     
     def clear(self) -> None:
         """Clear all cache entries"""
         with self._lock:
+            for key in self._cache:
+                for listener in self._removal_listeners:
+                    listener(key)
             self._cache.clear()
+            self._raw_bytes = 0
+            self._stored_bytes = 0
+            self._compressed_entries = 0
+            self._compressed_raw_bytes = 0
+            self._compressed_stored_bytes = 0
     
     def cleanup_expired(self) -> int:
         """Remove expired entries and return count"""
@@ -59,17 +246,140 @@ class InMemoryCache:
                     expired_keys.append(key)
             
             for key in expired_keys:
-                del self._cache[key]
+                self._drop_entry(key)
+            self.stats.incr('expirations', len(expired_keys))
         
         return len(expired_keys)
 
+    def export_entries(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Get a point-in-time list of live entries for snapshotting"""
+        current_time = time.time()
+        with self._lock:
+            return [
+                (key, entry) for key, entry in self._cache.items()
+                if current_time < entry['expires_at']
+            ]
+
+    def restore_entry(self, key: str, stored_value: Any, compressed: bool,
+                      raw_size: int, stored_size: int, expires_at: float) -> bool:
+        """Restore a snapshotted entry with its original expiry, keeping newer live entries"""
+        current_time = time.time()
+        if current_time >= expires_at:
+            return False
+
+        with self._lock:
+            if key in self._cache:
+                return False
+            if self.max_entries is not None and len(self._cache) >= self.max_entries:
+                return False
+            self._cache[key] = {
+                'value': stored_value,
+                'expires_at': expires_at,
+                'created_at': current_time,
+                'compressed': compressed,
+                'raw_size': raw_size,
+                'stored_size': stored_size,
+                'restored': True
+            }
+            self._raw_bytes += raw_size
+            self._stored_bytes += stored_size
+            if compressed:
+                self._compressed_entries += 1
+                self._compressed_raw_bytes += raw_size
+                self._compressed_stored_bytes += stored_size
+            self._restored_entries += 1
+        return True
+
+    def get_restore_stats(self) -> Dict[str, Any]:
+        """Get how many snapshot-restored entries have been served"""
+        with self._lock:
+            restored = self._restored_entries
+            hits = self._restored_hits
+        return {
+            'restored_entries': restored,
+            'restored_hits': hits,
+            'restored_hit_rate': round(hits / restored * 100, 2) if restored else 0
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss/expiration/eviction counters, set latency and entry count"""
+        with self._lock:
+            totals = self.stats.snapshot()
+            entries = len(self._cache)
+            stored_bytes = self._stored_bytes
+        lookups = totals['hits'] + totals['misses']
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'stored_bytes': stored_bytes,
+            'hits': int(totals['hits']),
+            'misses': int(totals['misses']),
+            'hit_rate': round(totals['hits'] / lookups * 100, 2) if lookups else 0,
+            'expirations': int(totals['expirations']),
+            'evictions': int(totals['evictions']),
+            'sets': int(totals['sets']),
+            'avg_set_us': round(totals['set_time'] / totals['sets'] * 1e6, 1) if totals['sets'] else 0
+        }
+
+    def get_compression_stats(self, memory_budget_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """Get compression ratio, per-hit CPU cost and effective capacity for a memory budget"""
+        with self._lock:
+            entries = len(self._cache)
+            raw_bytes = self._raw_bytes
+            stored_bytes = self._stored_bytes
+            compressed_entries = self._compressed_entries
+            compressed_raw_bytes = self._compressed_raw_bytes
+            compressed_stored_bytes = self._compressed_stored_bytes
+            compress_count = self._compress_count
+            compress_time = self._compress_time
+            decompress_count = self._decompress_count
+            decompress_time = self._decompress_time
+
+        stats = {
+            'entries': entries,
+            'compressed_entries': compressed_entries,
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'compression_ratio': round(compressed_raw_bytes / compressed_stored_bytes, 2) if compressed_stored_bytes else 1.0,
+            'overall_ratio': round(raw_bytes / stored_bytes, 2) if stored_bytes else 1.0,
+            'avg_compress_us': round(compress_time / compress_count * 1e6, 1) if compress_count else 0,
+            'avg_decompress_us_per_hit': round(decompress_time / decompress_count * 1e6, 1) if decompress_count else 0,
+            'decompressed_hits': decompress_count
+        }
+
+        if memory_budget_bytes and entries:
+            stats['memory_budget_bytes'] = memory_budget_bytes
+            stats['effective_entries_uncompressed'] = int(memory_budget_bytes / (raw_bytes / entries)) if raw_bytes else 0
+            stats['effective_entries'] = int(memory_budget_bytes / (stored_bytes / entries)) if stored_bytes else 0
+
+        return stats
+
 class CacheManager:
     """Cache manager for different cache types"""
     
     def __init__(self):
-        self.response_cache = InMemoryCache(default_ttl=300)  # 5 min for responses
-        self.conversation_cache = InMemoryCache(default_ttl=1800)  # 30 min for conversations
-        self.mode_detection_cache = InMemoryCache(default_ttl=600)  # 10 min for mode detection
+        self.response_cache = InMemoryCache(  # 5 min for responses
+            default_ttl=300,
+            name="response",
+            max_entries=settings.response_cache_max_entries,
+            compress_threshold=settings.cache_compression_threshold,
+            compression_dict=HTML_COMPRESSION_DICTIONARY
+        )
+        self.conversation_cache = InMemoryCache(default_ttl=1800, name="conversation")  # 30 min for conversations
+        self.mode_detection_cache = InMemoryCache(  # 10 min for mode detection
+            default_ttl=600,
+            name="mode_detection",
+            max_entries=settings.mode_detection_cache_max_entries
+        )
+
+        for cache in (self.response_cache, self.conversation_cache, self.mode_detection_cache):
+            performance_monitor.register_cache(cache.name, cache.get_stats)
+
+        # Caches written to the snapshot file and restored on startup
+        self.persistent_caches = {
+            'response': self.response_cache,
+            'mode_detection': self.mode_detection_cache
+        }
     
     def get_response_cache_key(self, message: str, mode: str, context_hash: str = "") -> str:
         """Generate cache key for responses"""
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import pickle
+import struct
+import tempfile
+import time
+from typing import Any, BinaryIO, Callable, Dict, List
+from src.utils.cache_manager import cache_manager, InMemoryCache
+from src.utils.logger import get_logger, log_with_context
+from src.config.config import settings
+
+logger = get_logger(__name__)
+
+# File layout: magic + version, then one record per entry:
+#   cache name length (B), key length (H), compressed flag (B), expires_at (d),
+#   raw size (I), payload length (I), followed by cache name, key and payload.
+# Compressed entries are written as their stored zlib bytes; other values are pickled.
+SNAPSHOT_MAGIC = b"SKCS"
+SNAPSHOT_VERSION = 1
+RECORD_HEADER = struct.Struct(">BHBdII")
+
+class CacheSnapshotter:
+    """Persist cache entries to a local file and warm caches from it on startup.
+
+    Saving is skipped until the startup restore has finished: the load runs in a
+    thread that outlives a cancelled restore task, and a snapshot of the
+    half-warmed caches would replace the complete one.
+    """
+
+    def __init__(self, caches: Dict[str, InMemoryCache], path: str):
+        self.caches = caches
+        self.path = path
+        self.restore_finished = False
+        # Cache name -> callbacks run with the key and value of each restored entry
+        self._restore_listeners: Dict[str, List[Callable[[str, Any], None]]] = {}
+
+    def add_restore_listener(self, cache_name: str, listener: Callable[[str, Any], None]) -> None:
+        """Register a callback for entries restored into a cache, e.g. to rebuild an index over it"""
+        self._restore_listeners.setdefault(cache_name, []).append(listener)
+
+    def _write_record(self, fh: BinaryIO, cache_name: bytes, key: str, entry: Dict[str, Any]) -> None:
+        """Write a single cache entry record"""
+        key_bytes = key.encode()
+        if entry['compressed']:
+            payload = entry['value']
+        else:
+            payload = pickle.dumps(entry['value'], protocol=pickle.HIGHEST_PROTOCOL)
+        fh.write(RECORD_HEADER.pack(
+            len(cache_name), len(key_bytes), 1 if entry['compressed'] else 0,
+            entry['expires_at'], entry['raw_size'], len(payload)
+        ))
+        fh.write(cache_name)
+        fh.write(key_bytes)
+        fh.write(payload)
+
+    def save(self) -> int:
+        """Write all live entries to the snapshot file and return the entry count"""
+        written = 0
+        # A unique temp file per save, so workers saving at the same time never share one
+        fh = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)),
+                                         prefix=os.path.basename(self.path) + '.', suffix='.tmp', delete=False)
+        try:
+            with fh:
+                fh.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]))
+                for name, cache in self.caches.items():
+                    cache_name = name.encode()
+                    for key, entry in cache.export_entries():
+                        if written >= settings.cache_snapshot_max_entries:
+                            break
+                        try:
+                            self._write_record(fh, cache_name, key, entry)
+                        except (pickle.PicklingError, TypeError, AttributeError):
+                            continue
+                        written += 1
+            # Atomic replace so a crash mid-write never leaves a truncated snapshot
+            os.replace(fh.name, self.path)
+        except Exception:
+            try:
+                os.unlink(fh.name)
+            except OSError:
+                pass
+            raise
+        return written
+
+    def load(self) -> Dict[str, int]:
+        """Stream entries from the snapshot file into the caches, bounded by count and time"""
+        try:
+            return self._load()
+        finally:
+            self.restore_finished = True
+
+    def _load(self) -> Dict[str, int]:
+        stats = {'read': 0, 'restored': 0, 'expired': 0}
+        if not os.path.exists(self.path):
+            return stats
+
+        deadline = time.monotonic() + settings.cache_snapshot_load_budget_seconds
+        with open(self.path, 'rb') as fh:
+            header = fh.read(len(SNAPSHOT_MAGIC) + 1)
+            if header[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC or header[-1] != SNAPSHOT_VERSION:
+                log_with_context(logger, 'warning', 'Ignoring incompatible cache snapshot', path=self.path)
+                return stats
+
+            while stats['read'] < settings.cache_snapshot_max_entries and time.monotonic() < deadline:
+                record_header = fh.read(RECORD_HEADER.size)
+                if len(record_header) < RECORD_HEADER.size:
+                    break
+                name_len, key_len, compressed, expires_at, raw_size, payload_len = RECORD_HEADER.unpack(record_header)
+                cache_name = fh.read(name_len).decode()
+                key = fh.read(key_len).decode()
+                payload = fh.read(payload_len)
+                if len(payload) < payload_len:
+                    break
+                stats['read'] += 1
+
+                cache = self.caches.get(cache_name)
+                if cache is None:
+                    continue
+                if expires_at <= time.time():
+                    stats['expired'] += 1
+                    continue
+
+                value = payload if compressed else pickle.loads(payload)
+                if cache.restore_entry(key, value, bool(compressed), raw_size, payload_len, expires_at):
+                    stats['restored'] += 1
+                    listeners = self._restore_listeners.get(cache_name)
+                    if listeners:
+                        value = cache.decode_stored(value, bool(compressed))
+                        for listener in listeners:
+                            listener(key, value)
+        return stats
+
+    async def save_async(self) -> None:
+        """Write a snapshot off the event loop and log the outcome"""
+        if not self.restore_finished:
+            log_with_context(logger, 'warning', 'Skipping cache snapshot until the restore has finished')
+            return
+        start_time = time.time()
+        try:
+            written = await asyncio.to_thread(self.save)
+            log_with_context(logger, 'info', 'Cache snapshot written', entries=written,
+                             duration_ms=round((time.time() - start_time) * 1000, 2))
+        except Exception as e:
+            log_with_context(logger, 'error', f'Error writing cache snapshot: {str(e)}')
+
+    async def restore_async(self) -> None:
+        """Warm caches from the last snapshot without blocking startup"""
+        start_time = time.time()
+        try:
+            stats = await asyncio.to_thread(self.load)
+            log_with_context(logger, 'info', 'Cache snapshot restored',
+                             load_time_ms=round((time.time() - start_time) * 1000, 2), **stats)
+        except Exception as e:
+            log_with_context(logger, 'error', f'Error restoring cache snapshot: {str(e)}')
+
+    def get_restore_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get restored-entry hit rates per cache"""
+        return {name: cache.get_restore_stats() for name, cache in self.caches.items()}
+
+# Global cache snapshotter
+cache_snapshotter = CacheSnapshotter(cache_manager.persistent_caches, settings.cache_snapshot_path)
@@ -0,0 +1,163 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+import boto3
+import httpx
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from src.config.config import settings
+from src.utils.logger import get_logger, log_with_context
+from src.utils.performance_monitor import performance_monitor
+
+logger = get_logger(__name__)
+
+class ClientRegistry:
+    """Outbound AWS and HTTP clients shared for the application's lifetime.
+
+    Clients are built once with connection pools sized to the generation
+    concurrency limit. At startup the registry resolves AWS credentials and
+    opens a few TLS connections to each upstream before the app reports ready,
+    so the first user request does not pay for them. Clients are still built
+    lazily on first use when the app was not started through the lifecycle
+    events, e.g. in scripts.
+
+    boto3 calls block, so they run on a Bedrock thread pool sized like the
+    connection pool rather than on the event loop.
+    """
+
+    def __init__(self, prewarm_connections: int, prewarm_timeout: float):
+        self.prewarm_connections = prewarm_connections
+        self.prewarm_timeout = prewarm_timeout
+        self._session: Optional[boto3.session.Session] = None
+        self._bedrock = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._bedrock_executor: Optional[ThreadPoolExecutor] = None
+        self._bedrock_lock = threading.Lock()
+        self._warmers: Dict[str, Callable[[], Awaitable[None]]] = {}
+        self.warmup: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def bedrock(self):
+        """Get the Bedrock runtime client"""
+        if self._bedrock is None:
+            # Pre-warm threads and request handlers may ask for it at the same time
+            with self._bedrock_lock:
+                if self._bedrock is None:
+                    self._session = boto3.session.Session(region_name=settings.aws_region)
+                    self._bedrock = self._session.client(
+                        'bedrock-runtime',
+                        endpoint_url=settings.bedrock_endpoint_url,
+                        config=Config(
+                            max_pool_connections=settings.max_concurrent_requests,
+                            connect_timeout=settings.bedrock_connect_timeout,
+                            read_timeout=settings.bedrock_read_timeout,
+                            retries={'max_attempts': 3, 'mode': 'standard'},
+                            tcp_keepalive=True
+                        )
+                    )
+        return self._bedrock
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=settings.http_client_timeout,
+                limits=httpx.Limits(
+                    max_connections=settings.http_client_max_connections,
+                    max_keepalive_connections=settings.http_client_max_keepalive
+                )
+            )
+        return self._http
+
+    async def run_bedrock(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking Bedrock client call, or a read from its response, off the event loop"""
+        if self._bedrock_executor is None:
+            self._bedrock_executor = ThreadPoolExecutor(max_workers=settings.max_concurrent_requests,
+                                                        thread_name_prefix="bedrock")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._bedrock_executor, functools.partial(fn, *args, **kwargs))
+
+    def add_warmer(self, name: str, warmer: Callable[[], Awaitable[None]]) -> None:
+        """Register a coroutine run at startup to warm a client's connections or data"""
+        self._warmers[name] = warmer
+
+    @staticmethod
+    def _warm_bedrock_connection(client) -> None:
+        """Make one cheap signed call so a pooled TLS connection is open"""
+        try:
+            client.list_async_invokes(maxResults=1)
+        except ClientError:
+            # An error reply (e.g. no permission for this call) still came over a warmed connection
+            pass
+
+    async def _warm_bedrock(self) -> None:
+        """Build the Bedrock client, resolve credentials and open pooled connections"""
+        client = await asyncio.to_thread(lambda: self.bedrock)
+        credentials = self._session.get_credentials() if self._session is not None else None
+        if credentials is not None:
+            # Refreshable credentials (SSO, instance roles) are fetched here rather than on first call
+            await asyncio.to_thread(credentials.get_frozen_credentials)
+        if not hasattr(client, 'list_async_invokes'):
+            # ListAsyncInvokes only exists in newer botocore releases than requirements.txt allows;
+            # older clients skip opening connections early and pay for them on first use
+            log_with_context(logger, 'info', 'Bedrock client has no ListAsyncInvokes; skipping connection pre-warm')
+            return
+        await asyncio.gather(*(
+            asyncio.to_thread(self._warm_bedrock_connection, client) for _ in range(self.prewarm_connections)
+        ))
+
+    async def _run_warmer(self, name: str, warmer: Callable[[], Awaitable[None]]) -> None:
+        start_time = time.perf_counter()
+        try:
+            await warmer()
+            self.warmup[name] = {'ok': True}
+        except Exception as e:
+            # A cold client still works; its first request just pays the setup cost
+            self.warmup[name] = {'ok': False, 'error': str(e)}
+            log_with_context(logger, 'warning', f'Client pre-warm failed: {str(e)}', client=name)
+        self.warmup[name]['ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+
+    async def start(self) -> None:
+        """Build and pre-warm all clients, giving up on warming after the timeout"""
+        warmers = {'bedrock': self._warm_bedrock, **self._warmers}
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(
+                self._run_warmer(name, warmer) for name, warmer in warmers.items()
+            )), self.prewarm_timeout)
+        except asyncio.TimeoutError:
+            log_with_context(logger, 'warning', 'Client pre-warm timed out', timeout=self.prewarm_timeout)
+        log_with_context(logger, 'info', 'Clients pre-warmed',
+                         duration_ms=round((time.perf_counter() - start_time) * 1000, 1), clients=self.warmup)
+
+    async def close(self) -> None:
+        """Close all clients and their pooled connections"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._bedrock is not None:
+            self._bedrock.close()
+            self._bedrock = self._session = None
+        if self._bedrock_executor is not None:
+            self._bedrock_executor.shutdown(wait=False)
+            self._bedrock_executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get which clients are open and how their pre-warm went"""
+        return {
+            'bedrock_open': self._bedrock is not None,
+            'http_open': self._http is not None,
+            'bedrock_max_pool_connections': settings.max_concurrent_requests,
+            'warmup': self.warmup
+        }
+
+# Global client registry
+client_registry = ClientRegistry(
+    prewarm_connections=settings.client_prewarm_connections,
+    prewarm_timeout=settings.client_prewarm_timeout
+)
+performance_monitor.register_component('clients', client_registry.get_stats)
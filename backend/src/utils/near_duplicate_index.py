@@ -0,0 +1,159 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from src.config.config import settings
+from src.utils.cache_manager import cache_manager
+from src.utils.cache_snapshot import cache_snapshotter
+
+# Words that carry no meaning for matching support questions
+STOPWORDS = frozenset("""
+    a an the is are was were be been am i me my we our you your it its this that these those
+    how do does did can could should would will to of in on for with at by from as and or
+    what why when where which who whom please help get getting any some there here have has
+""".split())
+
+# Mersenne prime used for the universal hash family
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def normalize_query(text: str) -> Set[str]:
+    """Lowercase, strip punctuation and stopwords, and reduce simple plurals"""
+    tokens = set()
+    for token in re.findall(r'[a-z0-9]+', text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.add(token)
+    return tokens
+
+class MinHashLSHIndex:
+    """Local MinHash + LSH index mapping near-duplicate queries to response cache keys"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.8,
+                 max_entries: int = 10000, min_tokens: int = 2, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.min_tokens = min_tokens
+
+        # a, b < 2^32 so a * h + b never overflows uint64 for 32-bit shingle hashes
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+        self._lock = threading.RLock()
+        # cache key -> (mode, signature, band bucket keys), oldest first
+        self._entries: "OrderedDict[str, Tuple[str, np.ndarray, List[Tuple[str, int, bytes]]]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], Set[str]] = {}
+        self.lookups = 0
+        self.matches = 0
+
+    def _signature(self, shingles: Set[str]) -> np.ndarray:
+        """Compute the MinHash signature of a shingle set"""
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'little') for s in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, mode: str, signature: np.ndarray) -> List[Tuple[str, int, bytes]]:
+        """Split a signature into per-mode LSH band bucket keys"""
+        return [
+            (mode, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _shingles(self, query: str) -> Optional[Set[str]]:
+        """Get shingles for a query, or None if too short to match safely"""
+        shingles = normalize_query(query)
+        return shingles if len(shingles) >= self.min_tokens else None
+
+    def add(self, cache_key: str, query: str, mode: str) -> None:
+        """Index a cached response under its query"""
+        shingles = self._shingles(query)
+        if shingles is None:
+            return
+        signature = self._signature(shingles)
+        band_keys = self._band_keys(mode, signature)
+
+        with self._lock:
+            self._remove_locked(cache_key)
+            self._entries[cache_key] = (mode, signature, band_keys)
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, set()).add(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+
+    def lookup(self, query: str, mode: str) -> Optional[str]:
+        """Find the cache key of the most similar indexed query above the threshold"""
+        shingles = self._shingles(query)
+        if shingles is None:
+            return None
+        signature = self._signature(shingles)
+
+        best_key, best_similarity = None, self.threshold
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for band_key in self._band_keys(mode, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            for candidate in candidates:
+                similarity = float(np.mean(self._entries[candidate][1] == signature))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = candidate, similarity
+            if best_key is not None:
+                self.matches += 1
+        return best_key
+
+    def _remove_locked(self, cache_key: str) -> None:
+        """Remove a key from the index (caller holds the lock)"""
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        for band_key in entry[2]:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(cache_key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def remove(self, cache_key: str) -> None:
+        """Remove a key from the index"""
+        with self._lock:
+            self._remove_locked(cache_key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index size and match statistics"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'buckets': len(self._buckets),
+                'lookups': self.lookups,
+                'matches': self.matches,
+                'match_rate': round(self.matches / self.lookups * 100, 2) if self.lookups else 0
+            }
+
+# Global near-duplicate index, kept in step with the response cache
+near_duplicate_index = MinHashLSHIndex(
+    threshold=settings.near_duplicate_threshold,
+    max_entries=settings.response_cache_max_entries,
+    min_tokens=settings.near_duplicate_min_tokens
+)
+cache_manager.response_cache.add_removal_listener(near_duplicate_index.remove)
+
+def _index_restored_response(cache_key: str, response: Any) -> None:
+    """Index a response restored from a snapshot under the query it was cached for"""
+    query = response.get('query') if isinstance(response, dict) else None
+    if query:
+        near_duplicate_index.add(cache_key, *query)
+
+cache_snapshotter.add_restore_listener('response', _index_restored_response)
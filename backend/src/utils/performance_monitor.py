@@ -1,9 +1,17 @@
+import gc
+import os
 import time
 import psutil
 import threading
-from typing import Dict, Any
-from dataclasses import dataclass
+from collections import deque
+from typing import Deque, Dict, Any, Callable, List, Optional
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta
+from src.config.config import settings
+from src.utils.quantile_sketch import LogHistogram, SlidingHistogram
+
+# Response time windows reported in the metrics: name -> seconds
+RESPONSE_TIME_WINDOWS = {'1m': 60, '5m': 300, '1h': 3600}
 
 @dataclass
 class PerformanceMetrics:
@@ -11,28 +19,151 @@ class PerformanceMetrics:
     memory_percent: float
     memory_used_mb: float
     active_connections: int
-    response_times: list
+    # Response time histograms per window name
+    response_times: Dict[str, LogHistogram]
     cache_hit_rate: float
     timestamp: datetime
 
+@dataclass(frozen=True)
+class SystemSnapshot:
+    """Host and process resource usage at one sampling instant"""
+    timestamp: float
+    cpu_percent: float
+    process_cpu_percent: float
+    memory_percent: float
+    memory_used_mb: float
+    rss_mb: float
+    open_fds: int
+    threads: int
+    gc_counts: List[int]
+    gc_collections: List[int]
+    gc_collected: int
+
+class SystemSampler:
+    """Background thread sampling system and process metrics into a ring buffer.
+
+    psutil's CPU percentages are measured between consecutive samples, so no
+    call ever sleeps, and readers only take the latest snapshot reference. The
+    sampler runs on its own thread so it keeps reporting while the event loop
+    is stalled.
+    """
+
+    def __init__(self, interval: float, history_size: int):
+        self.interval = interval
+        self.history: Deque[SystemSnapshot] = deque(maxlen=history_size)
+        self.latest: Optional[SystemSnapshot] = None
+        self._process = psutil.Process(os.getpid())
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Prime the CPU counters so the first sample covers one interval
+        psutil.cpu_percent(interval=None)
+        self._process.cpu_percent(interval=None)
+
+    def sample(self) -> SystemSnapshot:
+        """Take one snapshot without blocking and add it to the history"""
+        memory = psutil.virtual_memory()
+        with self._process.oneshot():
+            rss = self._process.memory_info().rss
+            open_fds = self._process.num_fds() if hasattr(self._process, 'num_fds') else self._process.num_handles()
+            threads = self._process.num_threads()
+            process_cpu_percent = self._process.cpu_percent(interval=None)
+        gc_stats = gc.get_stats()
+        snapshot = SystemSnapshot(
+            timestamp=time.time(),
+            cpu_percent=psutil.cpu_percent(interval=None),
+            process_cpu_percent=process_cpu_percent,
+            memory_percent=memory.percent,
+            memory_used_mb=round(memory.used / (1024 * 1024), 2),
+            rss_mb=round(rss / (1024 * 1024), 2),
+            open_fds=open_fds,
+            threads=threads,
+            gc_counts=list(gc.get_count()),
+            gc_collections=[generation['collections'] for generation in gc_stats],
+            gc_collected=sum(generation['collected'] for generation in gc_stats)
+        )
+        self.history.append(snapshot)
+        self.latest = snapshot
+        return snapshot
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                # A failed sample leaves the previous snapshot in place
+                pass
+
+    def start(self) -> None:
+        """Start sampling on a daemon thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def get_latest(self) -> SystemSnapshot:
+        """Get the most recent snapshot, sampling once if the sampler hasn't run yet"""
+        snapshot = self.latest
+        return snapshot if snapshot is not None else self.sample()
+
+    def get_history(self) -> List[Dict[str, Any]]:
+        """Get the buffered snapshots, oldest first"""
+        return [asdict(snapshot) for snapshot in list(self.history)]
+
 class PerformanceMonitor:
     """Monitor application performance metrics"""
     
     def __init__(self):
-        self.response_times = []
+        # Short windows use 10 s slots, the hour uses 1 min slots
+        accuracy = settings.latency_sketch_relative_accuracy
+        self.response_times_recent = SlidingHistogram(300, 10, accuracy)
+        self.response_times_hour = SlidingHistogram(3600, 60, accuracy)
         self.cache_hits = 0
         self.cache_misses = 0
         self.active_connections = 0
         self.lock = threading.RLock()
         self.start_time = time.time()
+        # Named cache stats providers, read when metrics are requested
+        self.cache_stats_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        # Named component stats providers (queues, pools, indexes)
+        self.component_stats_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.sampler = SystemSampler(settings.metrics_sample_interval, settings.metrics_history_size)
+
+    def register_cache(self, name: str, stats_provider: Callable[[], Dict[str, Any]]):
+        """Register a named cache whose counters are aggregated into the metrics"""
+        with self.lock:
+            self.cache_stats_providers[name] = stats_provider
+
+    def register_component(self, name: str, stats_provider: Callable[[], Dict[str, Any]]):
+        """Register a named application component whose stats are reported with the metrics"""
+        with self.lock:
+            self.component_stats_providers[name] = stats_provider
+
+    def get_component_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get stats for registered application components"""
+        with self.lock:
+            providers = dict(self.component_stats_providers)
+        return {name: provider() for name, provider in providers.items()}
+
+    def get_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get per-cache hit/miss/eviction statistics"""
+        with self.lock:
+            providers = dict(self.cache_stats_providers)
+        return {name: provider() for name, provider in providers.items()}
     
     def record_response_time(self, response_time: float):
         """Record API response time"""
+        now = time.time()
         with self.lock:
-            self.response_times.append(response_time)
-            # Keep only last 1000 response times
-            if len(self.response_times) > 1000:
-                self.response_times = self.response_times[-1000:]
+            self.response_times_recent.record(response_time, now)
+            self.response_times_hour.record(response_time, now)
     
     def record_cache_hit(self):
         """Record cache hit"""
@@ -54,70 +185,95 @@ class PerformanceMonitor:
         with self.lock:
             self.active_connections = max(0, self.active_connections - 1)
     
+    def _get_cache_totals(self):
+        """Get hits and misses summed over registered caches and manual records"""
+        cache_stats = self.get_cache_stats()
+        hits = self.cache_hits + sum(stats['hits'] for stats in cache_stats.values())
+        misses = self.cache_misses + sum(stats['misses'] for stats in cache_stats.values())
+        return hits, misses
+
+    def get_response_time_histogram(self, window: str) -> LogHistogram:
+        """Get the response time histogram of one window ('1m', '5m' or '1h'), mergeable across workers"""
+        seconds = RESPONSE_TIME_WINDOWS[window]
+        now = time.time()
+        with self.lock:
+            if seconds <= 300:
+                return self.response_times_recent.snapshot(seconds, now)
+            return self.response_times_hour.snapshot(seconds, now)
+
+    @staticmethod
+    def summarize_response_times(histogram: LogHistogram, percentiles: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Summarize a response time histogram in milliseconds, with any extra percentiles"""
+        summary = {
+            "average_ms": round(histogram.mean() * 1000, 2),
+            "min_ms": round(histogram.min * 1000, 2) if histogram.count else 0,
+            "max_ms": round(histogram.max * 1000, 2) if histogram.count else 0,
+            "p50_ms": round(histogram.quantile(0.5) * 1000, 2),
+            "p95_ms": round(histogram.quantile(0.95) * 1000, 2),
+            "p99_ms": round(histogram.quantile(0.99) * 1000, 2),
+            "total_requests": histogram.count
+        }
+        for percentile in percentiles or ():
+            summary[f"p{percentile:g}_ms"] = round(histogram.quantile(percentile / 100) * 1000, 2)
+        return summary
+
     def get_metrics(self) -> PerformanceMetrics:
-        """Get current performance metrics"""
+        """Get current performance metrics, with system metrics from the latest sample"""
+        system = self.sampler.get_latest()
+        
+        # Cache hit rate across all registered caches
+        cache_hits, cache_misses = self._get_cache_totals()
+        total_cache_requests = cache_hits + cache_misses
+        cache_hit_rate = (cache_hits / total_cache_requests * 100) if total_cache_requests > 0 else 0
+        
+        response_times = {window: self.get_response_time_histogram(window) for window in RESPONSE_TIME_WINDOWS}
         with self.lock:
-            # System metrics
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            memory_percent = memory.percent
-            memory_used_mb = memory.used / (1024 * 1024)
-            
-            # Cache hit rate
-            total_cache_requests = self.cache_hits + self.cache_misses
-            cache_hit_rate = (self.cache_hits / total_cache_requests * 100) if total_cache_requests > 0 else 0
-            
-            return PerformanceMetrics(
-                cpu_percent=cpu_percent,
-                memory_percent=memory_percent,
-                memory_used_mb=memory_used_mb,
-                active_connections=self.active_connections,
-                response_times=self.response_times.copy(),
-                cache_hit_rate=cache_hit_rate,
-                timestamp=datetime.now()
-            )
+            active_connections = self.active_connections
+        
+        return PerformanceMetrics(
+            cpu_percent=system.cpu_percent,
+            memory_percent=system.memory_percent,
+            memory_used_mb=system.memory_used_mb,
+            active_connections=active_connections,
+            response_times=response_times,
+            cache_hit_rate=cache_hit_rate,
+            timestamp=datetime.now()
+        )
     
-    def get_summary_stats(self) -> Dict[str, Any]:
-        """Get summary performance statistics"""
+    def get_summary_stats(self, percentiles: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Get summary performance statistics, with response time percentiles per window"""
         metrics = self.get_metrics()
-        
-        response_times = metrics.response_times
-        avg_response_time = sum(response_times) / len(response_times) if response_times else 0
-        max_response_time = max(response_times) if response_times else 0
-        min_response_time = min(response_times) if response_times else 0
-        
-        # Calculate percentiles
-        if response_times:
-            sorted_times = sorted(response_times)
-            p95_index = int(0.95 * len(sorted_times))
-            p99_index = int(0.99 * len(sorted_times))
-            p95_response_time = sorted_times[p95_index] if p95_index < len(sorted_times) else max_response_time
-            p99_response_time = sorted_times[p99_index] if p99_index < len(sorted_times) else max_response_time
-        else:
-            p95_response_time = p99_response_time = 0
+        system = self.sampler.get_latest()
         
         uptime_seconds = time.time() - self.start_time
+        cache_hits, cache_misses = self._get_cache_totals()
         
         return {
             "system": {
                 "cpu_percent": metrics.cpu_percent,
                 "memory_percent": metrics.memory_percent,
                 "memory_used_mb": round(metrics.memory_used_mb, 2),
+                "process_cpu_percent": system.process_cpu_percent,
+                "rss_mb": system.rss_mb,
+                "open_fds": system.open_fds,
+                "threads": system.threads,
+                "gc_counts": system.gc_counts,
+                "gc_collections": system.gc_collections,
+                "gc_collected": system.gc_collected,
+                "sampled_at": datetime.fromtimestamp(system.timestamp).isoformat(),
                 "uptime_seconds": round(uptime_seconds, 2)
             },
             "application": {
                 "active_connections": metrics.active_connections,
                 "cache_hit_rate": round(metrics.cache_hit_rate, 2),
-                "total_cache_hits": self.cache_hits,
-                "total_cache_misses": self.cache_misses
+                "total_cache_hits": cache_hits,
+                "total_cache_misses": cache_misses
             },
+            "caches": self.get_cache_stats(),
+            "components": self.get_component_stats(),
             "response_times": {
-                "average_ms": round(avg_response_time * 1000, 2),
-                "min_ms": round(min_response_time * 1000, 2),
-                "max_ms": round(max_response_time * 1000, 2),
-                "p95_ms": round(p95_response_time * 1000, 2),
-                "p99_ms": round(p99_response_time * 1000, 2),
-                "total_requests": len(response_times)
+                window: self.summarize_response_times(histogram, percentiles)
+                for window, histogram in metrics.response_times.items()
             },
             "timestamp": metrics.timestamp.isoformat()
         }
@@ -0,0 +1,130 @@
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+# Values are clamped to this range, which bounds the number of buckets a histogram can hold
+MIN_TRACKED_VALUE = 1e-6
+MAX_TRACKED_VALUE = 3600.0
+
+class LogHistogram:
+    """Log-bucketed histogram answering any quantile within a relative error.
+
+    Bucket i counts values in (gamma^(i-1), gamma^i] with gamma = (1 + a) / (1 - a),
+    so reporting a bucket's midpoint is within relative accuracy a of every value
+    in it (the DDSketch construction). Recording is one dict increment; memory is
+    bounded by the number of buckets between MIN_TRACKED_VALUE and
+    MAX_TRACKED_VALUE (about 1150 at 1%), and in practice is the handful of
+    buckets the values actually fall in. Histograms with the same accuracy merge
+    exactly by adding bucket counts, so per-worker histograms can be combined.
+    """
+
+    __slots__ = ('relative_accuracy', '_gamma', '_log_gamma', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float) -> None:
+        """Add one value"""
+        value = min(max(value, MIN_TRACKED_VALUE), MAX_TRACKED_VALUE)
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram") -> None:
+        """Add another histogram's values to this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge histograms with different relative accuracy")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Get the value at quantile q (0 to 1), or 0 if the histogram is empty"""
+        if self.count == 0:
+            return 0.0
+        # Same rank as indexing the sorted values at int(q * count)
+        rank = min(int(q * self.count), self.count - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                estimate = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        """Get the exact mean of the recorded values"""
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize for merging in another process"""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'counts': {str(index): count for index, count in self.counts.items()},
+            'count': self.count,
+            'total': self.total,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LogHistogram":
+        """Rebuild a histogram serialized by to_dict"""
+        histogram = cls(data['relative_accuracy'])
+        histogram.counts = {int(index): count for index, count in data['counts'].items()}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        if histogram.count:
+            histogram.min = data['min']
+            histogram.max = data['max']
+        return histogram
+
+class SlidingHistogram:
+    """Log histograms over a sliding time window, kept as a ring of fixed-length slots.
+
+    Each slot holds the values recorded during one slot_seconds interval and is
+    reset when the ring comes back around to it, so memory stays fixed. Window
+    queries merge the slots that fall inside the window, which makes the window
+    edge accurate to one slot.
+    """
+
+    def __init__(self, window_seconds: int, slot_seconds: int, relative_accuracy: float):
+        self.slot_seconds = slot_seconds
+        self.relative_accuracy = relative_accuracy
+        self.slot_count = max(1, window_seconds // slot_seconds)
+        self._slots: List[Optional[LogHistogram]] = [None] * self.slot_count
+        self._epochs: List[int] = [-1] * self.slot_count
+
+    def record(self, value: float, now: Optional[float] = None) -> None:
+        """Add one value to the current slot"""
+        epoch = int((time.time() if now is None else now) // self.slot_seconds)
+        position = epoch % self.slot_count
+        if self._epochs[position] != epoch:
+            self._slots[position] = LogHistogram(self.relative_accuracy)
+            self._epochs[position] = epoch
+        self._slots[position].record(value)
+
+    def snapshot(self, window_seconds: int, now: Optional[float] = None) -> LogHistogram:
+        """Merge the slots of the last window_seconds into one histogram"""
+        epoch = int((time.time() if now is None else now) // self.slot_seconds)
+        oldest = epoch - min(self.slot_count, max(1, window_seconds // self.slot_seconds)) + 1
+        merged = LogHistogram(self.relative_accuracy)
+        for slot, slot_epoch in zip(self._slots, self._epochs):
+            if slot is not None and oldest <= slot_epoch <= epoch:
+                merged.merge(slot)
+        return merged
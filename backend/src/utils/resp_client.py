@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from urllib.parse import urlparse
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+class RespClient:
+    """Minimal pipelined asyncio client for Redis-protocol (RESP2) servers.
+
+    One connection is shared by all callers: commands are written in order and
+    a reader task resolves replies in the same order, so concurrent requests
+    never wait on each other's round-trips. The connection is opened lazily and
+    re-opened after a failure.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Deque[asyncio.Future] = deque()
+        self._connect_lock = asyncio.Lock()
+        self._scripts: Dict[str, str] = {}
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b'+':
+            return body.decode()
+        if prefix == b'-':
+            return RespError(body.decode())
+        if prefix == b':':
+            return int(body)
+        if prefix == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        if prefix == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply prefix {prefix!r}")
+
+    async def _read_loop(self) -> None:
+        """Resolve pending commands in the order they were sent"""
+        try:
+            while True:
+                reply = await self._read_reply()
+                future = self._pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(reply, RespError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._reader_task = None
+            self._disconnect(e)
+
+    def _disconnect(self, error: Exception) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError(str(error)))
+
+    def _send(self, args) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Queue and write together so replies line up with the pending queue
+        self._pending.append(future)
+        self._writer.write(self._encode(args))
+        return future
+
+    async def _ensure_connected(self) -> None:
+        if self._writer is not None:
+            return
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+            self._reader_task = asyncio.create_task(self._read_loop())
+            setup = []
+            if self.password:
+                setup.append(self._send(('AUTH', self.password)))
+            if self.db:
+                setup.append(self._send(('SELECT', self.db)))
+            try:
+                for future in setup:
+                    await asyncio.wait_for(future, self.timeout)
+            except Exception:
+                await self.close()
+                raise
+            logger.info(f"Connected to {self.host}:{self.port}")
+
+    async def execute(self, *args) -> Any:
+        """Run one command and return its reply; raises RespError, ConnectionError or asyncio.TimeoutError"""
+        await self._ensure_connected()
+        future = self._send(args)
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def eval_script(self, script: str, keys: List[str], args: List[Any]) -> Any:
+        """Run a Lua script by its SHA-1, loading it on first use or after a server restart"""
+        sha = self._scripts.get(script)
+        if sha is None:
+            sha = self._scripts[script] = hashlib.sha1(script.encode()).hexdigest()
+        try:
+            return await self.execute('EVALSHA', sha, len(keys), *keys, *args)
+        except RespError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+            return await self.execute('EVAL', script, len(keys), *keys, *args)
+
+    async def close(self) -> None:
+        """Close the connection"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._disconnect(ConnectionError("Client closed"))
@@ -0,0 +1,29 @@
+import asyncio
+import json
+from src.models.schemas import ExportFormat
+from src.services.export_service import ExportService
+from src.services.session_store import SQLiteSessionStore
+
+def _rows(session_id, count):
+    return [{
+        'session_id': session_id, 'user_id': 'u1', 'role': 'assistant',
+        'content': f'Answer {session_id} {i}', 'message_id': f'{session_id}-{i}',
+        'payload': json.dumps({'mode': 'general'}), 'mode': 'general'
+    } for i in range(count)]
+
+def test_resumed_user_export_repeats_session_heading(tmp_path):
+    """An export resumed mid-session starts with the document and session headings"""
+    async def scenario():
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+        try:
+            await store.append_messages(_rows('s1', 3))
+            service = ExportService(store, chunk_size=2)
+            return "".join([chunk async for chunk in
+                            await service.open_user_export('u1', ExportFormat.MARKDOWN, after='s1:1')])
+        finally:
+            await store.close()
+
+    text = asyncio.run(scenario())
+    assert text.startswith("# Chat history\n\n## Answer s1 0\n\n")
+    assert "Answer s1 0\n\n" not in text.split("## Answer s1 0\n\n", 1)[1]
+    assert "Answer s1 2" in text
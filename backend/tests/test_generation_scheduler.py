@@ -0,0 +1,32 @@
+import asyncio
+from src.services import generation_scheduler as scheduler_module
+from src.services.generation_scheduler import GenerationPriority, GenerationScheduler
+
+def test_cancelled_waiter_then_trim_keeps_dispatching(monkeypatch):
+    """A user whose queued request was cancelled must not break dispatch after the user table is trimmed"""
+    monkeypatch.setattr(scheduler_module, 'MAX_TRACKED_USERS', 2)
+
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrent=1, max_per_user=1)
+        holder = scheduler.slot('a', GenerationPriority.STANDARD)
+        await holder.__aenter__()
+
+        async def use_slot(identity):
+            async with scheduler.slot(identity, GenerationPriority.STANDARD):
+                pass
+
+        cancelled = asyncio.create_task(use_slot('b'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+
+        # Admitting a new user goes over the tracking limit while 'b' still has a ready entry
+        queued = asyncio.create_task(use_slot('c'))
+        await asyncio.sleep(0)
+        await holder.__aexit__(None, None, None)
+        await queued
+        return scheduler
+
+    scheduler = asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert scheduler.active == 0
+    assert scheduler.waiting == 0
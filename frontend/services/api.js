@@ -10,15 +10,73 @@ const getAuthHeaders = () => {
 
 
 
+const sha256Hex = async (text) => {
+  const digest = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+};
+
 export class ApiService {
   static currentRequestId = null;
 
-  static async sendMessage(request) {
-    const response = await fetch(`${API_BASE_URL}/api/chat/message`, {
-      method: "POST",
+  // Upload large code/error context once and send its digest on later turns
+  static async ensureBlob(text) {
+    const digest = await sha256Hex(text);
+    const head = await fetch(`${API_BASE_URL}/api/chat/blobs/${digest}`, {
+      method: "HEAD",
       headers: getAuthHeaders(),
-      body: JSON.stringify(request),
     });
+    if (head.ok) return digest;
+
+    const response = await fetch(`${API_BASE_URL}/api/chat/blobs`, {
+      method: "POST",
+      headers: { ...getAuthHeaders(), "Content-Type": "text/plain; charset=utf-8" },
+      body: text,
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return (await response.json()).digest;
+  }
+
+  // Blob uploads need a signed-in user; anonymous requests and failed uploads send context inline
+  static async withContextRefs(request) {
+    const { code, error, ...rest } = request;
+    if ((!code && !error) || !localStorage.getItem("access_token")) return request;
+    try {
+      const resolved = { ...rest };
+      if (code) resolved.code_ref = await this.ensureBlob(code);
+      if (error) resolved.error_ref = await this.ensureBlob(error);
+      return resolved;
+    } catch (err) {
+      console.warn("Context upload failed, sending it inline:", err);
+      return request;
+    }
+  }
+
+  // Blobs are kept per server worker, so the worker handling the message may not know
+  // a ref (or it was evicted after the HEAD check); resend the context inline once then
+  static async postWithContext(path, request) {
+    const send = (body) =>
+      fetch(`${API_BASE_URL}${path}`, {
+        method: "POST",
+        headers: getAuthHeaders(),
+        body: JSON.stringify(body),
+      });
+    const withRefs = await this.withContextRefs(request);
+    const response = await send(withRefs);
+    if (withRefs === request || response.status !== 400) return response;
+
+    const detail = (await response.clone().json().catch(() => ({}))).detail;
+    if (typeof detail === "string" && detail.startsWith("Unknown ")) {
+      return send(request);
+    }
+    return response;
+  }
+
+  static async sendMessage(request) {
+    const response = await this.postWithContext("/api/chat/message", request);
 
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
@@ -30,11 +88,7 @@ export class ApiService {
   static async sendMessageStream(request, callbacks) {
     console.log("Sending streaming request:", request);
     try {
-      const response = await fetch(`${API_BASE_URL}/api/chat/message/stream`, {
-        method: "POST",
-        headers: getAuthHeaders(),
-        body: JSON.stringify(request),
-      });
+      const response = await this.postWithContext("/api/chat/message/stream", request);
 
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
@@ -73,6 +127,7 @@ export class ApiService {
                   callbacks.onModeSuggestion?.(data.data);
                   break;
                 case "end":
+                  if (data.quota) callbacks.onQuota?.(data.quota);
                   callbacks.onEnd?.(accumulatedContent, data.message_id);
                   return;
                 case "error":
@@ -132,6 +187,27 @@ export class ApiService {
     return await response.json();
   }
 
+  static async getSessionChanges(since = 0) {
+    const response = await fetch(`${API_BASE_URL}/api/chat/sessions/changes?since=${since}`, {
+      headers: getAuthHeaders(),
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return await response.json();
+  }
+
+  static async searchMessages(query, limit = 20) {
+    const params = new URLSearchParams({ q: query, limit: String(limit) });
+    const response = await fetch(`${API_BASE_URL}/api/chat/search?${params}`, {
+      headers: getAuthHeaders(),
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return await response.json();
+  }
+
   static async getSessionMessages(sessionId) {
     const response = await fetch(`${API_BASE_URL}/api/chat/sessions/${sessionId}`, {
       headers: getAuthHeaders(),
@@ -35,6 +35,8 @@ export class AuthService {
     localStorage.removeItem('user');
     
     if (userId) {
+      // Local copy is gone, so the next session sync must start from scratch
+      localStorage.removeItem(`session_sync_version_${userId}`);
       await indexedDBService.clearUserData(userId);
     }
   }
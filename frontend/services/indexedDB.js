@@ -1,3 +1,11 @@
+// Resolves once a readwrite transaction has committed; request objects are not promises
+const transactionDone = (transaction) =>
+  new Promise((resolve, reject) => {
+    transaction.oncomplete = () => resolve();
+    transaction.onerror = () => reject(transaction.error);
+    transaction.onabort = () => reject(transaction.error || new Error('Transaction aborted'));
+  });
+
 class IndexedDBService {
   constructor() {
     this.dbName = 'ChatAppDB';
@@ -36,7 +44,31 @@ class IndexedDBService {
     
     const transaction = this.db.transaction(['sessions'], 'readwrite');
     const store = transaction.objectStore('sessions');
-    await store.put(session);
+    store.put(session);
+    await transactionDone(transaction);
+  }
+
+  async deleteSession(sessionId) {
+    if (!this.db) await this.init();
+    
+    const transaction = this.db.transaction(['sessions', 'messages'], 'readwrite');
+    transaction.objectStore('sessions').delete(sessionId);
+    
+    const messageStore = transaction.objectStore('messages');
+    const messageRequest = messageStore.index('sessionId').getAllKeys(sessionId);
+    messageRequest.onsuccess = () => {
+      messageRequest.result.forEach(key => messageStore.delete(key));
+    };
+    await transactionDone(transaction);
+  }
+
+  async saveMessages(messages) {
+    if (!this.db) await this.init();
+    
+    const transaction = this.db.transaction(['messages'], 'readwrite');
+    const store = transaction.objectStore('messages');
+    messages.forEach(message => store.put(message));
+    await transactionDone(transaction);
   }
 
   async getUserSessions(userId) {
@@ -56,6 +88,8 @@ class IndexedDBService {
   async clearUserData(userId) {
     if (!this.db) await this.init();
     
+    // Read the sessions first: awaiting inside the transaction would let it commit early
+    const sessions = await this.getUserSessions(userId);
     const transaction = this.db.transaction(['sessions', 'messages'], 'readwrite');
     const sessionStore = transaction.objectStore('sessions');
     const messageStore = transaction.objectStore('messages');
@@ -69,7 +103,6 @@ class IndexedDBService {
     };
     
     // Clear user messages
-    const sessions = await this.getUserSessions(userId);
     sessions.forEach(session => {
       const messageIndex = messageStore.index('sessionId');
       const messageRequest = messageIndex.getAllKeys(session.id);
@@ -78,6 +111,7 @@ class IndexedDBService {
         messageRequest.result.forEach(key => messageStore.delete(key));
       };
     });
+    await transactionDone(transaction);
   }
 }
 
@@ -2,25 +2,48 @@ import { ApiService } from './api';
 import { indexedDBService } from './indexedDB';
 import { AuthService } from './auth';
 
+const syncVersionKey = (userId) => `session_sync_version_${userId}`;
+
 export class SessionSyncService {
+  static getSyncVersion(userId) {
+    return parseInt(localStorage.getItem(syncVersionKey(userId)) || '0', 10);
+  }
+
+  static async applyChanges(userId, changes) {
+    if (changes.reset) {
+      await indexedDBService.clearUserData(userId);
+    }
+    
+    // Apply deletions before upserts so a re-created session is kept
+    for (const sessionId of changes.deleted || []) {
+      await indexedDBService.deleteSession(sessionId);
+    }
+    
+    for (const session of changes.sessions || []) {
+      await indexedDBService.saveSession({ ...session, userId });
+    }
+    
+    if (changes.messages && changes.messages.length) {
+      await indexedDBService.saveMessages(
+        changes.messages.map(change => ({ ...change.message, sessionId: change.session_id, seq: change.seq }))
+      );
+    }
+  }
+
   static async syncSessions() {
     if (!AuthService.isAuthenticated()) return;
     
-    try {
-      const backendSessions = await ApiService.getUserSessions();
-      
-      // Store in IndexedDB for offline access
-      if (backendSessions.sessions) {
-        for (const session of backendSessions.sessions) {
-          await indexedDBService.saveSession({
-            ...session,
-            userId: AuthService.getCurrentUserId()
-          });
-        }
-      }
-    } catch (error) {
-      console.error('Failed to sync sessions:', error);
-    }
+    const userId = AuthService.getCurrentUserId();
+    
+    // Fetch only what changed since the last sync, following has_more until caught up
+    let since = this.getSyncVersion(userId);
+    let changes;
+    do {
+      changes = await ApiService.getSessionChanges(since);
+      await this.applyChanges(userId, changes);
+      since = changes.version;
+      localStorage.setItem(syncVersionKey(userId), String(since));
+    } while (changes.has_more);
   }
 
   static async getOfflineSessions() {
@@ -28,7 +51,8 @@ export class SessionSyncService {
     if (!userId) return [];
     
     try {
-      return await indexedDBService.getUserSessions(userId);
+      const sessions = await indexedDBService.getUserSessions(userId);
+      return sessions.sort((a, b) => new Date(b.updated_at) - new Date(a.updated_at));
     } catch (error) {
       console.error('Failed to get offline sessions:', error);
       return [];
@@ -39,14 +63,10 @@ export class SessionSyncService {
     if (AuthService.isAuthenticated()) {
       try {
         await this.syncSessions();
-        const response = await ApiService.getUserSessions();
-        return response.sessions || [];
       } catch (error) {
-        console.error('Failed to get online sessions, falling back to offline:', error);
-        return await this.getOfflineSessions();
+        console.error('Failed to sync sessions, using offline copy:', error);
       }
-    } else {
-      return await this.getOfflineSessions();
     }
+    return await this.getOfflineSessions();
   }
-}
\ No newline at end of file
+}